@@ -13,6 +13,7 @@ from celery.states import STARTED, SUCCESS, FAILURE, PENDING, RECEIVED
 from tensorlakehouse_openeo_driver.tasks import create_batch_jobs
 from celery import states
 from tensorlakehouse_openeo_driver import tasks
+from tensorlakehouse_openeo_driver.util import prefetch
 from tensorlakehouse_openeo_driver.constants import GTIFF, logger
 
 
@@ -350,6 +351,8 @@ class TensorLakeHouseBatchJobs(BatchJobs):
 
     def cancel_job(self, job_id: str, user_id: str):
         self.get_job_info(job_id=job_id, user_id=user_id)
+        # stop the readahead of the job, including on the workers of the dask cluster
+        prefetch.cancel_job(job_id=job_id)
 
     def delete_job(self, job_id: str, user_id: str):
         self.cancel_job(job_id, user_id)
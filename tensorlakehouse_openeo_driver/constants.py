@@ -1,6 +1,7 @@
 import logging
 import logging.config
 import os
+import tempfile
 from pathlib import Path
 from typing import Optional
 
@@ -55,6 +56,88 @@ if not TEST_DATA_ROOT.exists():
 TENSORLAKEHOUSE_OPENEO_DRIVER_DATA_DIR = TENSORLAKEHOUSE_OPENEO_DRIVER_ROOT_DIR / "data"
 if not TENSORLAKEHOUSE_OPENEO_DRIVER_DATA_DIR.exists():
     TENSORLAKEHOUSE_OPENEO_DRIVER_DATA_DIR.mkdir()
+# bucket that stores the results of batch jobs
+OUTPUT_BUCKET_NAME = os.getenv("OUTPUT_BUCKET_NAME", "openeo-geodn-driver-output")
+
+# filesystems and boto3 sessions are created once per endpoint and reused across requests.
+# Max number of connections of each pool, max number of concurrent transfers and keep-alive
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50))
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", 10))
+S3_TCP_KEEPALIVE = os.getenv("S3_TCP_KEEPALIVE", "true").lower() == "true"
+
+# a duplicate (hedged) range request is issued when a read takes longer than the
+# HEDGE_PERCENTILE of the latencies observed on the endpoint. HEDGE_DEFAULT_DEADLINE (seconds)
+# is used until HEDGE_MIN_SAMPLES reads have been observed. Throttled reads (HTTP 429/503)
+# are retried up to READ_MAX_RETRIES times
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 0.95))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+HEDGE_DEFAULT_DEADLINE = float(os.getenv("HEDGE_DEFAULT_DEADLINE", 1.0))
+READ_MAX_RETRIES = int(os.getenv("READ_MAX_RETRIES", 5))
+
+# chunks of Zarr stores and referenced NetCDF/GRIB2 files are read ahead of dask in the order
+# of the STAC items. At most PREFETCH_WINDOW reads are in flight (0 disables readahead) and
+# at most PREFETCH_MAX_BYTES of chunks that have not been consumed are kept in memory. All
+# prefetchers share a pool of PREFETCH_MAX_WORKERS threads
+PREFETCH_WINDOW = int(os.getenv("PREFETCH_WINDOW", 16))
+PREFETCH_MAX_BYTES = int(os.getenv("PREFETCH_MAX_BYTES", 512 * 2**20))
+PREFETCH_MAX_WORKERS = int(
+    os.getenv("PREFETCH_MAX_WORKERS", max(4 * PREFETCH_WINDOW, 1))
+)
+
+# COG items are read pixel window by pixel window (one range read per asset) instead of by
+# odc-stac when the area of interest has at most COG_WINDOW_READ_MAX_PIXELS pixels, e.g., a point
+COG_WINDOW_READ_MAX_PIXELS = int(os.getenv("COG_WINDOW_READ_MAX_PIXELS", 4096))
+
+# remote NetCDF files are read through a fsspec cache. Reads are aligned to blocks of
+# NETCDF_BLOCK_SIZE bytes, so that adjacent chunks are fetched by a single range request
+NETCDF_BLOCK_SIZE = int(os.getenv("NETCDF_BLOCK_SIZE", 8 * 2**20))
+# fsspec cache type, e.g., blockcache, readahead, bytes
+NETCDF_CACHE_TYPE = os.getenv("NETCDF_CACHE_TYPE", "blockcache")
+# NetCDF results are written chunk by chunk with the compression filter NETCDF_COMPRESSION
+# (zlib or zstd) at level NETCDF_COMPRESSION_LEVEL, unless save_result options say otherwise
+NETCDF_COMPRESSION = os.getenv("NETCDF_COMPRESSION", "zlib")
+NETCDF_COMPRESSION_LEVEL = int(os.getenv("NETCDF_COMPRESSION_LEVEL", 4))
+
+# cfgrib indexes of local GRIB2 files are cached by file version (path, size and mtime) and the
+# least recently used ones are removed when the cache exceeds GRIB_INDEX_CACHE_MAX_BYTES
+GRIB_INDEX_CACHE_DIR = Path(
+    os.getenv(
+        "GRIB_INDEX_CACHE_DIR",
+        Path(tempfile.gettempdir()) / "tensorlakehouse_openeo_driver" / "grib_index",
+    )
+)
+GRIB_INDEX_CACHE_MAX_BYTES = int(os.getenv("GRIB_INDEX_CACHE_MAX_BYTES", 2**30))
+# GRIB2 messages that are closer than GRIB_MAX_RANGE_GAP bytes are fetched by a single request
+GRIB_MAX_RANGE_GAP = int(os.getenv("GRIB_MAX_RANGE_GAP", 2**20))
+
+# FSTD files stored on COS are downloaded to a read-through cache, because librmn reads local
+# files only. Least recently used files are removed when the cache exceeds FSTD_CACHE_MAX_BYTES,
+# except the files that are still read by a data cube
+FSTD_CACHE_DIR = Path(
+    os.getenv(
+        "FSTD_CACHE_DIR",
+        Path(tempfile.gettempdir()) / "tensorlakehouse_openeo_driver" / "fstd",
+    )
+)
+FSTD_CACHE_MAX_BYTES = int(os.getenv("FSTD_CACHE_MAX_BYTES", 10 * 2**30))
+
+# GRIB2 and FSTD items are decoded either one after another in the request thread (serial),
+# in a pool of DECODE_MAX_WORKERS processes (processes) or as dask delayed tasks (dask)
+DECODE_EXECUTION_MODE = os.getenv("DECODE_EXECUTION_MODE", "serial")
+decode_max_workers_str = os.getenv("DECODE_MAX_WORKERS")
+DECODE_MAX_WORKERS: Optional[int] = (
+    int(decode_max_workers_str) if decode_max_workers_str is not None else None
+)
+
+# user-defined functions run chunk by chunk in a pool of UDF_MAX_WORKERS isolated processes.
+# Each process may allocate up to UDF_MAX_MEMORY bytes and each chunk must be processed within
+# UDF_TIMEOUT seconds
+UDF_TIMEOUT = float(os.getenv("UDF_TIMEOUT", 600))
+UDF_MAX_MEMORY = int(os.getenv("UDF_MAX_MEMORY", 4 * 2**30))
+udf_max_workers_str = os.getenv("UDF_MAX_WORKERS")
+UDF_MAX_WORKERS: Optional[int] = (
+    int(udf_max_workers_str) if udf_max_workers_str is not None else None
+)
 
 
 # RasterCube/DataArray dimensions
@@ -84,6 +167,7 @@ OPENEO_PASSWORD = os.getenv("OPENEO_PASSWORD", None)
 # list of media types for STAC
 # https://github.com/radiantearth/stac-spec/blob/master/best-practices.md#working-with-media-types
 ZIP_ZARR_MEDIA_TYPE = "application/zip+zarr"
+ZARR_MEDIA_TYPE = "application/vnd+zarr"
 NETCDF_MEDIA_TYPE = "application/netcdf"
 X_NETCDF_MEDIA_TYPE = "application/x-netcdf"
 COG_MEDIA_TYPE = "image/tiff; application=geotiff; profile=cloud-optimized"
@@ -91,8 +175,15 @@ JPG2000_MEDIA_TYPE = "image/jp2"
 GEOTIFF_MEDIA_TYPE = "image/tiff; application=geotiff"
 GEOTIFF_MEDIA_TYPE_SIMPLE = "image/tiff"
 PARQUET_MEDIA_TYPE = "table/parquet; application=geoparquet; profile=cloud-optimized"
+# version of the GeoParquet specification of the "geo" metadata of parquet files
+GEOPARQUET_VERSION = "1.0.0"
 GRIB2_MEDIA_TYPE = "application/x-grib2"
 FSTD_MEDIA_TYPE = "application/x-fstd"
+# byte-range references (kerchunk) of NetCDF and GRIB2 files are stored as sidecar files and
+# added to the STAC items as an extra asset
+REFERENCES_MEDIA_TYPE = "application/json; profile=kerchunk"
+REFERENCES_ASSET = "references"
+REFERENCES_SUFFIX = "references.json"
 # default reference system
 EPSG_4326 = "EPSG:4326"
 
@@ -106,6 +197,11 @@ ZARR = "ZARR"
 
 GEOTIFF_PREFIX = "openeo_output_"
 FILE_DATETIME_FORMAT = "%Y-%m-%dT%H-%M-%SZ"
+# GeoTIFF results are tiled COGs with blocks of COG_BLOCKSIZE pixels compressed by COG_COMPRESSION
+COG_COMPRESSION = os.getenv("COG_COMPRESSION", "DEFLATE")
+COG_BLOCKSIZE = int(os.getenv("COG_BLOCKSIZE", 512))
+# without a dask cluster, time slices are encoded as COGs by at most COG_MAX_WORKERS threads
+COG_MAX_WORKERS = int(os.getenv("COG_MAX_WORKERS", os.cpu_count() or 1))
 PARQUET = "PARQUET"
 
 broker_url = os.getenv("BROKER_URL", "redis://:@0.0.0.0:6379/")
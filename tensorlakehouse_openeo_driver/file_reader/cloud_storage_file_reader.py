@@ -10,6 +10,7 @@ from boto3.session import Session
 from urllib.parse import urlparse
 from datetime import datetime
 from openeo_pg_parser_networkx.pg_schema import ParameterReference
+from tensorlakehouse_openeo_driver.constants import REFERENCES_ASSET
 from tensorlakehouse_openeo_driver.util import object_storage_util
 
 assert os.path.isfile("logging.conf")
@@ -66,7 +67,9 @@ class CloudStorageFileReader:
                 assert start <= end, f"Error! {start=} {end=}"
         self.temporal_extent = temporal_extent
         assets: Dict = items[0].assets
-        asset_values: pystac.Asset = next(iter(assets.values()))
+        asset_values: pystac.Asset = CloudStorageFileReader._get_data_asset(
+            assets=assets
+        )
         href = asset_values.href
         self.bucket = CloudStorageFileReader._extract_bucket_name_from_url(url=href)
         credentials = object_storage_util.get_credentials_by_bucket(bucket=self.bucket)
@@ -147,12 +150,7 @@ class CloudStorageFileReader:
     def _create_boto3_session(
         self,
     ) -> Session:
-        session = Session(
-            aws_access_key_id=self.access_key_id,
-            aws_secret_access_key=self.secret_access_key,
-            region_name=self.region,
-        )
-        return session
+        return object_storage_util.get_boto3_session(bucket=self.bucket)
 
     @staticmethod
     def _get_dimension_description(item: pystac.Item, axis: str) -> Optional[str]:
@@ -163,6 +161,41 @@ class CloudStorageFileReader:
                 return key
         return None
 
+    @staticmethod
+    def _get_data_asset(assets: Dict[str, Any]) -> Any:
+        """get the first asset that points to the data, i.e., skip the references asset
+
+        Args:
+            assets (Dict[str, Any]): assets of a STAC item, either as pystac.Asset or as dict
+
+        Returns:
+            Any: data asset
+        """
+        for key, asset in assets.items():
+            if key != REFERENCES_ASSET:
+                return asset
+        raise ValueError(f"Error! Unable to find data asset: {list(assets.keys())}")
+
+    @staticmethod
+    def _get_references_href(assets: Dict[str, Any]) -> Optional[str]:
+        """get the link to the byte-range references (kerchunk) of the data asset
+
+        Args:
+            assets (Dict[str, Any]): assets of a STAC item, either as pystac.Asset or as dict
+
+        Returns:
+            Optional[str]: link to the references file if the item has one, otherwise None
+        """
+        asset = assets.get(REFERENCES_ASSET)
+        if asset is None:
+            return None
+        elif isinstance(asset, pystac.Asset):
+            return asset.href
+        else:
+            href = asset["href"]
+            assert isinstance(href, str), f"Error! Unexpected href: {href}"
+            return href
+
     @staticmethod
     def _extract_bucket_name_from_url(url: str) -> str:
         """parse url and get the bucket as str
@@ -252,27 +285,25 @@ class CloudStorageFileReader:
     def create_s3filesystem(
         self,
     ) -> s3fs.S3FileSystem:
-        """create a s3filesystem object
+        """get the s3filesystem of the bucket, which is shared by all readers
+
+        Returns:
+            s3fs.S3FileSystem: filesystem
+        """
+        return object_storage_util.get_s3filesystem(bucket=self.bucket)
+
+    @staticmethod
+    def _get_s3filesystem_by_url(url: str) -> s3fs.S3FileSystem:
+        """get the s3filesystem of the bucket of the specified url
 
         Args:
-            endpoint (str): endpoint to s3
-            access_key_id (str): key
-            secret (str): secret
+            url (str): link to file on COS
 
         Returns:
-            s3fs.S3FileSystem: _description_
+            s3fs.S3FileSystem: filesystem
         """
-        if self.endpoint.startswith("https://"):
-            endpoint_url = self.endpoint
-        else:
-            endpoint_url = f"https://{self.endpoint}"
-        fs = s3fs.S3FileSystem(
-            anon=False,
-            endpoint_url=endpoint_url,
-            key=self.access_key_id,
-            secret=self.secret_access_key,
-        )
-        return fs
+        bucket = CloudStorageFileReader._extract_bucket_name_from_url(url=url)
+        return object_storage_util.get_s3filesystem(bucket=bucket)
 
     @staticmethod
     def _get_dimension_name(
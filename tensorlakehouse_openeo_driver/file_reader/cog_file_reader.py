@@ -1,11 +1,23 @@
+import math
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, DefaultDict, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urlparse
+import fsspec
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.windows import from_bounds
 from pystac import Item
 import xarray as xr
 from tensorlakehouse_openeo_driver.constants import (
+    COG_WINDOW_READ_MAX_PIXELS,
     DEFAULT_BANDS_DIMENSION,
     DEFAULT_X_DIMENSION,
     DEFAULT_Y_DIMENSION,
+    PREFETCH_MAX_BYTES,
+    PREFETCH_WINDOW,
+    S3_MAX_CONCURRENCY,
 )
 from tensorlakehouse_openeo_driver.file_reader.cloud_storage_file_reader import (
     CloudStorageFileReader,
@@ -17,12 +29,23 @@ from odc.stac import stac_load, configure_rio
 from tensorlakehouse_openeo_driver.file_reader.raster_file_reader import (
     RasterFileReader,
 )
+from tensorlakehouse_openeo_driver.geospatial_utils import reproject_bbox
 import statistics
 
 assert os.path.isfile("logging.conf")
 logging.config.fileConfig(fname="logging.conf", disable_existing_loggers=False)
 logger = logging.getLogger("geodnLogger")
 
+# consecutive tiles are fetched by a single request, requests share HTTP/2 connections and
+# fetched blocks are cached, i.e., the nearest equivalent of readahead for GDAL. The cache size
+# applies to each open file
+GDAL_READ_OPTIONS: Dict[str, Any] = {
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "VSI_CACHE": True,
+    "VSI_CACHE_SIZE": PREFETCH_MAX_BYTES // max(PREFETCH_WINDOW, 1),
+}
+
 
 class COGFileReader(RasterFileReader):
     def __init__(
@@ -52,6 +75,8 @@ class COGFileReader(RasterFileReader):
         Returns:
             xr.DataArray: datacube
         """
+        if self._can_read_windows():
+            return self._load_items_using_windows()
         # group items by media type, because zarr items are handled differently than non-zarr items
         (
             items_by_crs_and_res,
@@ -170,7 +195,9 @@ class COGFileReader(RasterFileReader):
         os.environ["AWS_SECRET_ACCESS_KEY"] = self.secret_access_key
         os.environ["AWS_S3_ENDPOINT"] = self.endpoint
         session = self._create_boto3_session()
-        configure_rio(cloud_defaults=True, aws={"session": session})
+        configure_rio(
+            cloud_defaults=True, aws={"session": session}, **GDAL_READ_OPTIONS
+        )
 
         # get epsg from arbitray item
         epsg = COGFileReader._get_most_frequent_epsg(items=self.items)
@@ -217,6 +244,195 @@ class COGFileReader(RasterFileReader):
 
         return arr
 
+    @staticmethod
+    def _count_pixels(
+        bbox: Tuple[float, float, float, float], resolution: float
+    ) -> Tuple[Tuple[float, float, float, float], int, int]:
+        """snap the bounding box to the pixel grid, like odc-stac does, so that a point selects
+        the pixel that contains it
+
+        Args:
+            bbox (Tuple[float, float, float, float]): bounding box in the CRS of the items
+            resolution (float): pixel size
+
+        Returns:
+            Tuple[Tuple[float, float, float, float], int, int]: snapped bbox, width and height
+        """
+        minx, miny, maxx, maxy = bbox
+        # tolerance for floating point errors, e.g., 0.05 / 0.01 = 5.000000000000001
+        eps = 1e-9
+        left = math.floor(minx / resolution + eps) * resolution
+        bottom = math.floor(miny / resolution + eps) * resolution
+        width = max(1, math.ceil((maxx - left) / resolution - eps))
+        height = max(1, math.ceil((maxy - bottom) / resolution - eps))
+        snapped = (
+            left,
+            bottom,
+            left + width * resolution,
+            bottom + height * resolution,
+        )
+        return snapped, width, height
+
+    def _get_band_href(self, item: Item, band: str) -> Optional[str]:
+        """link to the file that contains the band or None if it is not a single-band file"""
+        if band in item.assets.keys():
+            href = item.assets[band].href
+        elif (
+            RasterFileReader.DATA in item.assets.keys()
+            and len(item.properties["cube:variables"]) == 1
+        ):
+            href = item.assets[RasterFileReader.DATA].href
+        else:
+            return None
+        if href.lower().startswith("http"):
+            href = CloudStorageFileReader._convert_https_to_s3(url=href)
+        return href
+
+    def _can_read_windows(self) -> bool:
+        """window reads apply if the area of interest is small, the items share CRS and
+        resolution and each band is stored as a single-band file"""
+        epsg_res = {
+            (
+                CloudStorageFileReader._get_epsg(item=item),
+                CloudStorageFileReader._get_resolution(item=item),
+            )
+            for item in self.items
+        }
+        if len(epsg_res) != 1:
+            return False
+        epsg, resolution = epsg_res.pop()
+        if epsg is None or resolution is None:
+            return False
+        bbox = reproject_bbox(bbox=self.bbox, src_crs=4326, dst_crs=epsg)
+        _, width, height = COGFileReader._count_pixels(bbox=bbox, resolution=resolution)
+        if width * height > COG_WINDOW_READ_MAX_PIXELS:
+            return False
+        return all(
+            self._get_band_href(item=item, band=band) is not None
+            for item in self.items
+            for band in self.bands
+        )
+
+    def _read_window(
+        self,
+        href: str,
+        bounds: Tuple[float, float, float, float],
+        width: int,
+        height: int,
+    ) -> Tuple[np.ndarray, Optional[float]]:
+        """read the pixels of the bounding box, i.e., only the tiles that intersect it. Objects
+        on COS are read by GDAL through the filesystem of the bucket, i.e., by hedged reads
+
+        Args:
+            href (str): link to COG file
+            bounds (Tuple[float, float, float, float]): bounding box in the CRS of the file
+            width (int): number of columns
+            height (int): number of rows
+
+        Returns:
+            Tuple[np.ndarray, Optional[float]]: pixels and nodata value
+        """
+        opener = None
+        path = href
+        if urlparse(href).scheme == "s3":
+            opener = CloudStorageFileReader._get_s3filesystem_by_url(url=href)
+            _, path = fsspec.core.split_protocol(href)
+        with rasterio.Env(**GDAL_READ_OPTIONS):
+            with rasterio.open(path, opener=opener) as src:
+                window = from_bounds(*bounds, transform=src.transform)
+                fill_value = src.nodata if src.nodata is not None else 0
+                data = src.read(
+                    1,
+                    window=window,
+                    out_shape=(height, width),
+                    boundless=True,
+                    fill_value=fill_value,
+                )
+                return data, src.nodata
+
+    def _load_items_using_windows(self) -> xr.DataArray:
+        """read the pixel window of each asset concurrently, so that latency depends on the
+        number of reads instead of the size of a dask graph. Items that have the same timestamp
+        (e.g., adjacent tiles) are merged, where the first valid pixel wins
+
+        Returns:
+            xr.DataArray: in-memory datacube (bands, time, y, x)
+        """
+        arbitrary_item = self.items[0]
+        epsg = CloudStorageFileReader._get_epsg(item=arbitrary_item)
+        resolution = CloudStorageFileReader._get_resolution(item=arbitrary_item)
+        assert isinstance(epsg, int) and isinstance(resolution, float)
+        bbox = reproject_bbox(bbox=self.bbox, src_crs=4326, dst_crs=epsg)
+        bounds, width, height = COGFileReader._count_pixels(
+            bbox=bbox, resolution=resolution
+        )
+        timestamps = sorted(
+            {COGFileReader._get_timestamp(item=item) for item in self.items}
+        )
+        time_index = {timestamp: i for i, timestamp in enumerate(timestamps)}
+        reads = [
+            (time_index[COGFileReader._get_timestamp(item=item)], b, href)
+            for item in self.items
+            for b, href in enumerate(
+                self._get_band_href(item=item, band=band) for band in self.bands
+            )
+        ]
+        logger.debug(
+            f"COGFileReader::_load_items_using_windows - {len(reads)} reads {bounds=} {width=} {height=}"
+        )
+        with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY) as executor:
+            results = list(
+                executor.map(
+                    lambda read: self._read_window(
+                        href=read[2], bounds=bounds, width=width, height=height
+                    ),
+                    reads,
+                )
+            )
+        data: Optional[np.ndarray] = None
+        filled: Optional[np.ndarray] = None
+        nodata = None
+        for (t, b, _), (pixels, pixels_nodata) in zip(reads, results):
+            if data is None:
+                nodata = pixels_nodata
+                fill_value = nodata if nodata is not None else 0
+                shape = (len(self.bands), len(timestamps), height, width)
+                data = np.full(shape, fill_value, dtype=pixels.dtype)
+                filled = np.zeros(shape, dtype=bool)
+            assert data is not None and filled is not None
+            valid = ~filled[b, t]
+            if pixels_nodata is not None:
+                valid &= pixels != pixels_nodata
+            data[b, t][valid] = pixels[valid]
+            filled[b, t] |= valid
+        left, bottom, right, top = bounds
+        x_dim = self._get_dimension_name(item=arbitrary_item, axis=DEFAULT_X_DIMENSION)
+        y_dim = self._get_dimension_name(item=arbitrary_item, axis=DEFAULT_Y_DIMENSION)
+        arr = xr.DataArray(
+            data,
+            dims=[DEFAULT_BANDS_DIMENSION, "time", y_dim, x_dim],
+            coords={
+                DEFAULT_BANDS_DIMENSION: self.bands,
+                "time": timestamps,
+                y_dim: top - resolution * (np.arange(height) + 0.5),
+                x_dim: left + resolution * (np.arange(width) + 0.5),
+            },
+        )
+        if nodata is not None:
+            arr.attrs["nodata"] = nodata
+        arr_with_crs: xr.DataArray = arr.rio.write_crs(f"epsg:{epsg}")
+        return arr_with_crs
+
+    @staticmethod
+    def _get_timestamp(item: Item) -> np.datetime64:
+        """timestamp of the item as UTC without timezone, like odc-stac"""
+        dt = item.properties.get("datetime") or item.properties.get("start_datetime")
+        timestamp = pd.Timestamp(dt)
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+        dt64: np.datetime64 = timestamp.to_datetime64()
+        return dt64
+
     @staticmethod
     def _get_most_frequent_resolution(items: List[Item]) -> float:
         resolution_list = list()
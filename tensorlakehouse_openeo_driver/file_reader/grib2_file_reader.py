@@ -2,17 +2,23 @@ from pathlib import Path
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 from tensorlakehouse_openeo_driver.constants import (
+    DECODE_EXECUTION_MODE,
+    DECODE_MAX_WORKERS,
     DEFAULT_BANDS_DIMENSION,
     DEFAULT_X_DIMENSION,
     DEFAULT_Y_DIMENSION,
-    TENSORLAKEHOUSE_OPENEO_DRIVER_DATA_DIR,
+    GRIB_INDEX_CACHE_DIR,
+    GRIB_INDEX_CACHE_MAX_BYTES,
+    GRIB_MAX_RANGE_GAP,
     logger,
 )
 from tensorlakehouse_openeo_driver.file_reader.cloud_storage_file_reader import (
     CloudStorageFileReader,
 )
+import tempfile
 import uuid
 import pandas as pd
+import s3fs
 import xarray as xr
 import cfgrib
 from tensorlakehouse_openeo_driver.file_reader.raster_file_reader import (
@@ -23,10 +29,28 @@ from tensorlakehouse_openeo_driver.geospatial_utils import (
     filter_by_time,
     reproject_bbox,
 )
+from tensorlakehouse_openeo_driver.util.decode_executor import map_items
+from tensorlakehouse_openeo_driver.util.disk_cache import DiskCache, fingerprint
+from tensorlakehouse_openeo_driver.util.grib_message_index import (
+    fetch_messages,
+    read_message_index,
+    select_messages,
+)
+from tensorlakehouse_openeo_driver.util.reference_index import (
+    open_reference_datasets,
+    to_s3_url,
+)
 from urllib.parse import urlparse
 
+# cfgrib dimensions that are not vertical levels
+GRIB_NON_LEVEL_DIMS = ["number", "step", "time", "valid_time"]
+
 
 class Grib2FileReader(RasterFileReader):
+    # cfgrib indexes are shared by all requests
+    index_cache = DiskCache(
+        cache_dir=GRIB_INDEX_CACHE_DIR, max_bytes=GRIB_INDEX_CACHE_MAX_BYTES
+    )
 
     def __init__(
         self,
@@ -57,8 +81,8 @@ class Grib2FileReader(RasterFileReader):
         self.temporal_extent = temporal_extent
         self.properties = properties
 
-    def _check_coords(self, ds: xr.Dataset) -> bool:
-        extra_dims_filter = self.get_extra_dimensions_filter()
+    @staticmethod
+    def _check_coords(ds: xr.Dataset, extra_dims_filter: Dict[str, Any]) -> bool:
         coords_names = set(list(ds.coords.keys()))
         for dim_name, dim_value in extra_dims_filter.items():
             if dim_name not in coords_names or dim_value not in ds[dim_name].values:
@@ -66,10 +90,14 @@ class Grib2FileReader(RasterFileReader):
 
         return True
 
+    @staticmethod
     def _check_dimensions(
-        self, ds: xr.Dataset, x_dim: str, y_dim: str, temporal_dim: Optional[str]
+        ds: xr.Dataset,
+        x_dim: str,
+        y_dim: str,
+        temporal_dim: Optional[str],
+        extra_dims_filter: Dict[str, Any],
     ) -> bool:
-        extra_dims_filter = self.get_extra_dimensions_filter()
         required_dims = set(list(extra_dims_filter.keys()))
         dimensions = set(list(ds.sizes.keys()))
         if temporal_dim is not None:
@@ -84,6 +112,164 @@ class Grib2FileReader(RasterFileReader):
         bands = set(self.bands)
         return bands.issubset(variables)
 
+    def _is_requested_dataset(
+        self,
+        ds: xr.Dataset,
+        x_dim: str,
+        y_dim: str,
+        temporal_dim: Optional[str],
+        extra_dims_filter: Dict[str, Any],
+    ) -> bool:
+        """check whether the hypercube contains all bands and extra-dimension values"""
+        return (
+            Grib2FileReader._check_coords(ds=ds, extra_dims_filter=extra_dims_filter)
+            and self._check_bands(ds=ds)
+            and Grib2FileReader._check_dimensions(
+                ds=ds,
+                x_dim=x_dim,
+                y_dim=y_dim,
+                temporal_dim=temporal_dim,
+                extra_dims_filter=extra_dims_filter,
+            )
+        )
+
+    @staticmethod
+    def _get_filter_by_keys(
+        bands: List[str], extra_dims_filter: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """translate the requested bands and extra-dimension filters into cfgrib
+        filter_by_keys, so that only the matching hypercube is decoded. cfgrib matches keys
+        exactly, so only unambiguous filters are translated, i.e., cfVarName if a single band
+        is requested and typeOfLevel if a single extra dimension is a level. Bands are named
+        after cfVarName, which differs from shortName for some variables, e.g., t2m is 2t
+
+        Args:
+            bands (List[str]): requested bands, i.e., cfgrib variable names
+            extra_dims_filter (Dict[str, Any]): extra-dimension names and values
+
+        Returns:
+            Dict[str, Any]: filter_by_keys, which is empty if the mapping is ambiguous
+        """
+        filter_by_keys: Dict[str, Any] = dict()
+        if len(bands) == 1:
+            filter_by_keys["cfVarName"] = bands[0]
+        # cfgrib names the vertical dimension after the typeOfLevel, e.g., isobaricInhPa
+        levels = [
+            dim for dim in extra_dims_filter.keys() if dim not in GRIB_NON_LEVEL_DIMS
+        ]
+        if len(levels) == 1:
+            filter_by_keys["typeOfLevel"] = levels[0]
+        return filter_by_keys
+
+    def _open_filtered_dataset(
+        self,
+        path: str,
+        indexpath: str,
+        filter_by_keys: Dict[str, Any],
+        x_dim: str,
+        y_dim: str,
+        temporal_dim: Optional[str],
+        extra_dims_filter: Dict[str, Any],
+    ) -> Optional[xr.Dataset]:
+        """open the hypercube selected by filter_by_keys
+
+        Returns:
+            Optional[xr.Dataset]: dataset or None if the filter does not select a single
+                hypercube that contains the requested data
+        """
+        try:
+            ds = xr.open_dataset(
+                path,
+                engine="cfgrib",
+                backend_kwargs={
+                    "filter_by_keys": filter_by_keys,
+                    "indexpath": indexpath,
+                },
+            )
+        except cfgrib.dataset.DatasetBuildError as e:
+            logger.debug(f"Unable to open hypercube {filter_by_keys=}: {e}")
+            return None
+        if self._is_requested_dataset(
+            ds=ds,
+            x_dim=x_dim,
+            y_dim=y_dim,
+            temporal_dim=temporal_dim,
+            extra_dims_filter=extra_dims_filter,
+        ):
+            return ds
+        return None
+
+    def _get_indexpath(self, path: Path) -> str:
+        """get the path of the cfgrib index of the specified file version. The index is built
+        by scanning the whole file once and reused while the file is unchanged
+
+        Args:
+            path (Path): path to local GRIB2 file
+
+        Returns:
+            str: indexpath template, where cfgrib replaces short_hash by the hash of the
+                index keys
+        """
+        key = fingerprint(path_or_url=str(path.resolve()))
+        prefix = Grib2FileReader.index_cache.get_path(key=key)
+        return f"{prefix}.{{short_hash}}.idx"
+
+    def _open_remote_messages(
+        self, fs: s3fs.S3FileSystem, url: str, extra_dims_filter: Dict[str, Any]
+    ) -> Optional[List[xr.Dataset]]:
+        """fetch only the GRIB2 messages that match the requested bands and extra-dimension
+        filters, instead of downloading the whole file. It requires a message index next to
+        the GRIB2 file
+
+        Args:
+            fs (s3fs.S3FileSystem): filesystem
+            url (str): link to GRIB2 file
+            extra_dims_filter (Dict[str, Any]): extra-dimension names and values
+
+        Returns:
+            Optional[List[xr.Dataset]]: datasets or None if the file has no usable index
+        """
+        messages = read_message_index(fs=fs, url=url)
+        if messages is None:
+            return None
+        selected = select_messages(
+            messages=messages,
+            variables=self.bands,
+            extra_dims_filter=extra_dims_filter,
+        )
+        if len(selected) == 0:
+            logger.debug(f"No message matches {self.bands=} in the index of {url}")
+            return None
+        content = fetch_messages(
+            fs=fs, url=url, messages=selected, max_gap=GRIB_MAX_RANGE_GAP
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / f"{uuid.uuid4().hex}.grb2"
+            path.write_bytes(content)
+            # the subset is small, so it is loaded before the temporary file is removed
+            datasets = cfgrib.open_datasets(str(path), backend_kwargs={"indexpath": ""})
+            return [ds.load() for ds in datasets]
+
+    @staticmethod
+    def _squeeze(ds: xr.Dataset, x_dim: str, y_dim: str) -> xr.Dataset:
+        """cfgrib represents dimensions of size one as scalar coordinates, so the datasets
+        opened through references are squeezed the same way
+
+        Args:
+            ds (xr.Dataset): dataset opened through references
+            x_dim (str): name of x dimension
+            y_dim (str): name of y dimension
+
+        Returns:
+            xr.Dataset: squeezed dataset
+        """
+        dims = [
+            dim
+            for dim, size in ds.sizes.items()
+            if size == 1 and dim not in [x_dim, y_dim]
+        ]
+        return ds.squeeze(dim=dims)
+
     @staticmethod
     def convert_longitude_coords(
         ds: xr.Dataset, units: Optional[str], x_dim: str, y_dim: str
@@ -105,141 +291,179 @@ class Grib2FileReader(RasterFileReader):
             ds = ds.sortby([x_dim, y_dim])
         return ds
 
-    def load_items(self) -> xr.DataArray:
-        """load items that are associated with grib2 files
+    def _load_item(self, item: Dict[str, Any]) -> xr.DataArray:
+        """decode the requested hypercube of a GRIB2 file and clip it by the bounding box
 
-        Based on https://docs.xarray.dev/en/stable/examples/ERA5-GRIB-example.html
+        Args:
+            item (Dict[str, Any]): STAC item
 
         Returns:
-            xr.DataArray: raster data cube
+            xr.DataArray: subset of the item
         """
-        logger.debug(f"Loading GRIB2 files: bands={self.bands} bbox={self.bbox}")
-        # initialize array and crs variables
         da = None
-        crs_code = None
-        data_arrays = list()
-        # load each item
-        for item in self.items:
-            assets: Dict[str, Any] = item["assets"]
-            asset_value = next(iter(assets.values()))
-            # get dimension names
-            x_dim = CloudStorageFileReader._get_dimension_name(
-                item=item, axis=DEFAULT_X_DIMENSION
-            )
-            assert x_dim is not None
-            y_dim = CloudStorageFileReader._get_dimension_name(
-                item=item, axis=DEFAULT_Y_DIMENSION
-            )
-            assert y_dim is not None
-            time_dim = CloudStorageFileReader._get_dimension_name(
-                item=item, dim_type="temporal"
+        assets: Dict[str, Any] = item["assets"]
+        asset_value = CloudStorageFileReader._get_data_asset(assets=assets)
+        # get dimension names
+        x_dim = CloudStorageFileReader._get_dimension_name(
+            item=item, axis=DEFAULT_X_DIMENSION
+        )
+        assert x_dim is not None
+        y_dim = CloudStorageFileReader._get_dimension_name(
+            item=item, axis=DEFAULT_Y_DIMENSION
+        )
+        assert y_dim is not None
+        time_dim = CloudStorageFileReader._get_dimension_name(
+            item=item, dim_type="temporal"
+        )
+        crs_code = CloudStorageFileReader._get_epsg(item=item)
+        extra_dims_filter = self.get_extra_dimensions_filter()
+        # initial implementation assumes that file is local
+        # href field can be either URL (a link to a file on COS) or a path to a local file
+        path_or_url = asset_value["href"]
+        parse_url = urlparse(path_or_url)
+        references_href = CloudStorageFileReader._get_references_href(assets=assets)
+        if references_href is not None:
+            datasets = [
+                Grib2FileReader._squeeze(ds=ds, x_dim=x_dim, y_dim=y_dim)
+                for ds in open_reference_datasets(references_url=references_href)
+            ]
+        elif parse_url.scheme == "":
+            path = Path(path_or_url)
+            assert path.exists(), f"Error! File does not exist: {path_or_url}"
+            indexpath = self._get_indexpath(path=path)
+            filter_by_keys = Grib2FileReader._get_filter_by_keys(
+                bands=self.bands, extra_dims_filter=extra_dims_filter
             )
-            crs_code = CloudStorageFileReader._get_epsg(item=item)
-            # initial implementation assumes that file is local
-            # href field can be either URL (a link to a file on COS) or a path to a local file
-            path_or_url = asset_value["href"]
-            parse_url = urlparse(path_or_url)
-            if parse_url.scheme == "":
-                path = Path(path_or_url)
-                assert path.exists(), f"Error! File does not exist: {path_or_url}"
-                hex_code = uuid.uuid4().hex
-                indexpath = (
-                    TENSORLAKEHOUSE_OPENEO_DRIVER_DATA_DIR
-                    / f"{path.name}.{hex_code}.idx"
+            ds = None
+            if len(filter_by_keys) > 0:
+                ds = self._open_filtered_dataset(
+                    path=path_or_url,
+                    indexpath=indexpath,
+                    filter_by_keys=filter_by_keys,
+                    x_dim=x_dim,
+                    y_dim=y_dim,
+                    temporal_dim=time_dim,
+                    extra_dims_filter=extra_dims_filter,
                 )
+            if ds is not None:
+                datasets = [ds]
+            else:
+                # ambiguous mapping: decode all hypercubes and search them
                 datasets = cfgrib.open_datasets(
-                    path_or_url, backend_kwargs={"indexpath": str(indexpath)}
+                    path_or_url, backend_kwargs={"indexpath": indexpath}
                 )
+            Grib2FileReader.index_cache.evict()
+        else:
+            url = to_s3_url(url=path_or_url)
+            fs = CloudStorageFileReader._get_s3filesystem_by_url(url=url)
+            remote_datasets = self._open_remote_messages(
+                fs=fs, url=url, extra_dims_filter=extra_dims_filter
+            )
+            if remote_datasets is not None:
+                datasets = remote_datasets
             else:
-                s3fs = self.create_s3filesystem()
-                s3_file_obj = s3fs.open(path_or_url, mode="rb")
+                s3_file_obj = fs.open(url, mode="rb")
                 ds = xr.open_dataset(s3_file_obj, engine="cfgrib")
                 datasets = [ds]
-            try:
-                units = item["properties"]["cube:dimensions"][x_dim].get("unit")
-            except KeyError as e:
-                msg = f"Error! Missing key: {item=} {e=}"
-                raise KeyError(msg)
-            # cfgrib follows NetCDF Climate and Forecast (CF) Metadata Conventions and because of
-            # that longitude is represented as degrees east,i.e., from 0 to 360
-            i = 0
-            found = False
-            while i < len(datasets) and not found:
-                ds = datasets[i]
-                i += 1
-
-                # set of dimensions that this dataset contains
-
-                if (
-                    self._check_coords(ds=ds)
-                    and self._check_bands(ds=ds)
-                    and self._check_dimensions(
-                        ds=ds, x_dim=x_dim, y_dim=y_dim, temporal_dim=time_dim
-                    )
-                ):
-                    found = True
-                    ds = Grib2FileReader.convert_longitude_coords(
-                        ds=ds, units=units, x_dim=x_dim, y_dim=y_dim
-                    )
-                    assert isinstance(
-                        ds, xr.Dataset
-                    ), f"Error! Unexpected type={type(ds)}"
-
-                    # get CRS
-                    if ds.rio.crs is None:
-                        ds.rio.write_crs(f"epsg:{crs_code}", inplace=True)
-                    # assert all(
-                    #     band in list(ds) for band in self.bands
-                    # ), f"Error! not all bands={self.bands} are in ds={list(ds)}"
-                    # drop bands that are not required
-                    ds = ds[self.bands]
-                    # drop dimensions that are not required
-                    extra_dim_filter = self.get_extra_dimensions_filter()
-                    ds = ds.sel(extra_dim_filter)
-                    # if bands is already one of the dimensions, use default 'variable'
-                    if DEFAULT_BANDS_DIMENSION in dict(ds.dims).keys():
-                        da = ds.to_array()
-                    else:
-                        # else export array using bands
-                        da = ds.to_array(dim=DEFAULT_BANDS_DIMENSION)
-
-                    # add temporal dimension if it does not exist on dataarray
-
-                    if time_dim is None:
-                        raise ValueError(f"Error! {item=}")
-                    elif time_dim not in da.dims:
-                        dt_str = item["properties"].get("datetime")
-                        timestamps = pd.to_datetime([pd.Timestamp(dt_str)])
-
-                        da = da.expand_dims({time_dim: timestamps})
-            assert (
-                found
-            ), f"Error! Unable to find data that contains all {self.bands} variables all {self.get_extra_dimensions_filter()}"
-            data_arrays.append(da)
-        # get temporal dimension name from an arbitrary item. Assumption that all items
-        # have the same temporal dimension name
+        try:
+            units = item["properties"]["cube:dimensions"][x_dim].get("unit")
+        except KeyError as e:
+            msg = f"Error! Missing key: {item=} {e=}"
+            raise KeyError(msg)
+        # cfgrib follows NetCDF Climate and Forecast (CF) Metadata Conventions and because of
+        # that longitude is represented as degrees east,i.e., from 0 to 360
+        i = 0
+        found = False
+        while i < len(datasets) and not found:
+            ds = datasets[i]
+            i += 1
 
-        if len(data_arrays) > 1:
+            # set of dimensions that this dataset contains
 
-            # concatenate all xarray.DataArray objects
-            data_array = xr.concat(data_arrays, dim=time_dim)
-        else:
-            data_array = data_arrays.pop()
+            if self._is_requested_dataset(
+                ds=ds,
+                x_dim=x_dim,
+                y_dim=y_dim,
+                temporal_dim=time_dim,
+                extra_dims_filter=extra_dims_filter,
+            ):
+                found = True
+                ds = Grib2FileReader.convert_longitude_coords(
+                    ds=ds, units=units, x_dim=x_dim, y_dim=y_dim
+                )
+                assert isinstance(ds, xr.Dataset), f"Error! Unexpected type={type(ds)}"
+
+                # get CRS
+                if ds.rio.crs is None:
+                    ds.rio.write_crs(f"epsg:{crs_code}", inplace=True)
+                # assert all(
+                #     band in list(ds) for band in self.bands
+                # ), f"Error! not all bands={self.bands} are in ds={list(ds)}"
+                # drop bands that are not required
+                ds = ds[self.bands]
+                # drop dimensions that are not required
+                ds = ds.sel(extra_dims_filter)
+                # if bands is already one of the dimensions, use default 'variable'
+                if DEFAULT_BANDS_DIMENSION in dict(ds.dims).keys():
+                    da = ds.to_array()
+                else:
+                    # else export array using bands
+                    da = ds.to_array(dim=DEFAULT_BANDS_DIMENSION)
+
+                # add temporal dimension if it does not exist on dataarray
+
+                if time_dim is None:
+                    raise ValueError(f"Error! {item=}")
+                elif time_dim not in da.dims:
+                    dt_str = item["properties"].get("datetime")
+                    timestamps = pd.to_datetime([pd.Timestamp(dt_str)])
+
+                    da = da.expand_dims({time_dim: timestamps})
+        assert (
+            found
+        ), f"Error! Unable to find data that contains all {self.bands} variables all {extra_dims_filter}"
         # filter by area of interest
         assert isinstance(crs_code, int), f"Error! Invalid type: {crs_code=}"
         reprojected_bbox = reproject_bbox(
             bbox=self.bbox, src_crs=4326, dst_crs=crs_code
         )
-        assert x_dim is not None
-        assert y_dim is not None
-        assert isinstance(data_array, xr.DataArray)
+        assert isinstance(da, xr.DataArray)
         da = clip_box(
-            data=data_array,
+            data=da,
             bbox=reprojected_bbox,
             x_dim=x_dim,
             y_dim=y_dim,
             crs=crs_code,
         )
+        return da
+
+    def load_items(self) -> xr.DataArray:
+        """load items that are associated with grib2 files
+
+        Based on https://docs.xarray.dev/en/stable/examples/ERA5-GRIB-example.html
+
+        Returns:
+            xr.DataArray: raster data cube
+        """
+        logger.debug(f"Loading GRIB2 files: bands={self.bands} bbox={self.bbox}")
+        # each item is decoded and clipped independently, either in this thread, in a pool
+        # of processes or on the dask cluster
+        data_arrays = map_items(
+            load_item=self._load_item,
+            items=self.items,
+            mode=DECODE_EXECUTION_MODE,
+            max_workers=DECODE_MAX_WORKERS,
+        )
+        # get temporal dimension name from an arbitrary item. Assumption that all items
+        # have the same temporal dimension name
+        time_dim = CloudStorageFileReader._get_dimension_name(
+            item=self.items[0], dim_type="temporal"
+        )
+        if len(data_arrays) > 1:
+            # concatenate all xarray.DataArray objects
+            da = xr.concat(data_arrays, dim=time_dim)
+        else:
+            da = data_arrays.pop()
         # remove timestamps that have not been selected by end-user
         if time_dim is not None and time_dim in da.dims:
             da = filter_by_time(
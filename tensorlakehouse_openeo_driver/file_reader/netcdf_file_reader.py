@@ -1,11 +1,14 @@
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import IO, Any, Dict, List, Optional, Tuple
 
 from pystac import Asset, Item
 from tensorlakehouse_openeo_driver.constants import (
     DEFAULT_BANDS_DIMENSION,
     DEFAULT_X_DIMENSION,
     DEFAULT_Y_DIMENSION,
+    NETCDF_BLOCK_SIZE,
+    NETCDF_CACHE_TYPE,
+    logger,
 )
 from tensorlakehouse_openeo_driver.file_reader.cloud_storage_file_reader import (
     CloudStorageFileReader,
@@ -22,6 +25,16 @@ from tensorlakehouse_openeo_driver.geospatial_utils import (
 )
 from urllib.parse import urlparse
 import pandas as pd
+import s3fs
+from tensorlakehouse_openeo_driver.util.prefetch import Prefetcher, create_prefetcher
+from tensorlakehouse_openeo_driver.util.reference_index import (
+    open_combined_reference_dataset,
+    open_reference_datasets,
+)
+
+# the first bytes of a file identify its format. NetCDF4 files are HDF5 files
+NETCDF3_SIGNATURE = b"CDF"
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
 
 
 class NetCDFFileReader(RasterFileReader):
@@ -46,6 +59,109 @@ class NetCDFFileReader(RasterFileReader):
         url = f"s3://{self.bucket}/{path}"
         return url
 
+    @staticmethod
+    def _get_engine(file_obj: IO[bytes]) -> str:
+        """inspect the signature of the file to select the xarray engine. NetCDF3 files are
+        read by scipy, whereas NetCDF4 files (HDF5) are read by h5netcdf
+
+        Args:
+            file_obj (IO[bytes]): file-like object
+
+        Returns:
+            str: engine name
+        """
+        signature = file_obj.read(len(HDF5_SIGNATURE))
+        file_obj.seek(0)
+        if signature.startswith(HDF5_SIGNATURE):
+            return "h5netcdf"
+        elif signature.startswith(NETCDF3_SIGNATURE):
+            return "scipy"
+        else:
+            raise ValueError(f"Error! Unknown NetCDF file signature: {signature!r}")
+
+    @staticmethod
+    def _get_on_disk_chunks(ds: xr.Dataset, bands: List[str]) -> Dict[str, int]:
+        """get the on-disk chunk size of each dimension of the selected variables, so that
+        each dask chunk maps to one or more HDF5 chunks
+
+        Args:
+            ds (xr.Dataset): dataset opened without dask
+            bands (List[str]): selected variables
+
+        Returns:
+            Dict[str, int]: dimension names and chunk sizes
+        """
+        chunks: Dict[str, int] = dict()
+        for band in bands:
+            variable = ds[band]
+            # contiguous variables (e.g., NetCDF3) do not have chunksizes
+            chunksizes = variable.encoding.get("chunksizes")
+            if chunksizes is None:
+                continue
+            for dim, size in zip(map(str, variable.dims), chunksizes):
+                # if variables are chunked differently, use the largest chunk of the dimension
+                chunks[dim] = max(size, chunks.get(dim, 0))
+        return chunks
+
+    def _open_remote_dataset(self, fs: s3fs.S3FileSystem, url: str) -> xr.Dataset:
+        """open a NetCDF file stored on COS lazily. The file object is wrapped by a fsspec
+        block cache, i.e., bytes are fetched in blocks of NETCDF_BLOCK_SIZE, which coalesces
+        the requests of adjacent chunks and avoids downloading the whole object. Note that this
+        only applies to NetCDF4 files: the scipy engine does not memory-map file-like objects, so
+        it reads the data of every variable when a NetCDF3 file is opened, i.e., NetCDF3 files
+        are downloaded in full
+
+        Args:
+            fs (s3fs.S3FileSystem): filesystem
+            url (str): link to the NetCDF file
+
+        Returns:
+            xr.Dataset: dask-backed dataset
+        """
+        file_obj = fs.open(
+            url,
+            mode="rb",
+            block_size=NETCDF_BLOCK_SIZE,
+            cache_type=NETCDF_CACHE_TYPE,
+        )
+        engine = NetCDFFileReader._get_engine(file_obj=file_obj)
+        logger.debug(f"NetCDFFileReader::_open_remote_dataset - {url=} {engine=}")
+        ds = xr.open_dataset(file_obj, engine=engine)
+        bands = [band for band in self.bands if band in ds]
+        chunks = NetCDFFileReader._get_on_disk_chunks(ds=ds, bands=bands)
+        return ds.chunk(chunks)
+
+    def _open_combined_references(
+        self, prefetcher: Optional[Prefetcher]
+    ) -> Optional[xr.Dataset]:
+        """if every item has references and the files share the temporal dimension, open a
+        single Zarr view of all files instead of one dataset per item
+
+        Args:
+            prefetcher (Optional[Prefetcher]): see open_reference_datasets
+
+        Returns:
+            Optional[xr.Dataset]: combined dataset or None if items cannot be combined
+        """
+        if len(self.items) < 2:
+            return None
+        references_hrefs = list()
+        for item in self.items:
+            references_href = CloudStorageFileReader._get_references_href(
+                assets=item.assets
+            )
+            if references_href is None:
+                return None
+            references_hrefs.append(references_href)
+        time_dim = CloudStorageFileReader._get_dimension_name(
+            item=self.items[0].to_dict(), dim_type="temporal"
+        )
+        if time_dim is None:
+            return None
+        return open_combined_reference_dataset(
+            references_urls=references_hrefs, concat_dim=time_dim, prefetcher=prefetcher
+        )
+
     def load_items(self) -> xr.DataArray:
         """load items that are associated with netcdf files
 
@@ -56,19 +172,37 @@ class NetCDFFileReader(RasterFileReader):
         da = None
         crs_code = None
         data_arrays = list()
+        # chunks of the referenced files are read ahead in the order of the items
+        prefetcher = create_prefetcher()
+        prefetch_sources = list()
+        combined = self._open_combined_references(prefetcher=prefetcher)
+        # a combined dataset covers all items, whose metadata is read from the first one
+        items = self.items if combined is None else self.items[:1]
         # load each item
-        for item in self.items:
+        for item in items:
             assets: Dict[str, Asset] = item.assets
-            asset_value = next(iter(assets.values()))
+            asset_value = CloudStorageFileReader._get_data_asset(assets=assets)
             # href field can be either URL (a link to a file on COS) or a path to a local file
             path_or_url = asset_value.href
             parse_url = urlparse(path_or_url)
-            if parse_url.scheme == "":
+            references_href = CloudStorageFileReader._get_references_href(assets=assets)
+            if combined is not None:
+                ds = combined
+                if prefetcher is not None:
+                    prefetch_sources.append((ds.encoding["prefetch_store"], ds))
+            elif references_href is not None:
+                # read chunks directly through the precomputed references, i.e., without
+                # parsing the header of the file
+                ds = open_reference_datasets(
+                    references_url=references_href, prefetcher=prefetcher
+                )[0]
+                if prefetcher is not None:
+                    prefetch_sources.append((ds.encoding["prefetch_store"], ds))
+            elif parse_url.scheme == "":
                 ds = xr.open_dataset(path_or_url, engine="netcdf4")
             else:
-                s3fs = self.create_s3filesystem()
-                s3_file_obj = s3fs.open(path_or_url, mode="rb")
-                ds = xr.open_dataset(s3_file_obj, engine="scipy")
+                fs = self.create_s3filesystem()
+                ds = self._open_remote_dataset(fs=fs, url=path_or_url)
             # get dimension names
             x_dim = CloudStorageFileReader._get_dimension_name(
                 item=item.to_dict(), axis=DEFAULT_X_DIMENSION
@@ -129,5 +263,9 @@ class NetCDFFileReader(RasterFileReader):
             da = filter_by_time(
                 data=da, temporal_extent=self.temporal_extent, temporal_dim=time_dim
             )
-
+        if prefetcher is not None:
+            for store, source in prefetch_sources:
+                prefetcher.plan_chunks(
+                    store=store, variables=self.bands, source=source, subset=da
+                )
         return da
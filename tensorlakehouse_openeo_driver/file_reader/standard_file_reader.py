@@ -2,25 +2,44 @@ from pathlib import Path
 import warnings
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
+import dask.array
+import numpy as np
 from tensorlakehouse_openeo_driver.constants import (
+    DECODE_EXECUTION_MODE,
+    DECODE_MAX_WORKERS,
     DEFAULT_BANDS_DIMENSION,
     DEFAULT_X_DIMENSION,
     DEFAULT_Y_DIMENSION,
+    FSTD_CACHE_DIR,
+    FSTD_CACHE_MAX_BYTES,
     logger,
 )
 from tensorlakehouse_openeo_driver.file_reader.cloud_storage_file_reader import (
     CloudStorageFileReader,
 )
 import xarray as xr
+from urllib.parse import urlparse
 
 from tensorlakehouse_openeo_driver.geospatial_utils import (
     clip_box,
     filter_by_time,
     reproject_bbox,
 )
+from tensorlakehouse_openeo_driver.util.decode_executor import map_items
+from tensorlakehouse_openeo_driver.util.disk_cache import CacheLease, DiskCache
+from tensorlakehouse_openeo_driver.util.reference_index import (
+    to_s3_url,
+)
+
+
+def _hold_lease(block: np.ndarray, lease: CacheLease) -> np.ndarray:
+    """keep a reference to the lease in the task graph of a dask array"""
+    return block
 
 
 class FSTDFileReader(CloudStorageFileReader):
+    # local copies of FSTD files stored on COS are shared by all requests
+    file_cache = DiskCache(cache_dir=FSTD_CACHE_DIR, max_bytes=FSTD_CACHE_MAX_BYTES)
 
     def __init__(
         self,
@@ -50,65 +69,73 @@ class FSTDFileReader(CloudStorageFileReader):
                 assert isinstance(temporal_extent[1], datetime)
                 assert temporal_extent[0] <= temporal_extent[1]
         self.temporal_extent = temporal_extent
+        self.properties = properties
 
-    def load_items(self) -> xr.DataArray:
-        """load items that are associated with FSTD files
+    def _get_local_path(self, href: str) -> Tuple[str, Optional[CacheLease]]:
+        """FSTD files are read by librmn, which requires local files. Objects stored on COS are
+        downloaded once per version to a read-through cache
+
+        Args:
+            href (str): path to local file or link to object on COS
 
         Returns:
-            xr.DataArray: raster data cube
+            Tuple[str, Optional[CacheLease]]: path to local file and the lease of the cached
+                copy, which is None for local files
+        """
+        if urlparse(href).scheme == "":
+            assert Path(href).exists(), f"Error! File does not exist: {href}"
+            return href, None
+        url = to_s3_url(url=href)
+        fs = CloudStorageFileReader._get_s3filesystem_by_url(url=url)
+        lease = FSTDFileReader.file_cache.fetch(fs=fs, url=url, suffix=".fst")
+        return str(lease.path), lease
+
+    def _load_item(self, item: Dict[str, Any]) -> xr.DataArray:
+        """open a FSTD file lazily, select bands and extra-dimension values and clip it by the
+        bounding box. Records are decoded only when the array is computed
+
+        Args:
+            item (Dict[str, Any]): STAC item
+
+        Returns:
+            xr.DataArray: dask-backed subset of the item
         """
         import fstd2nc
 
-        # initialize array and crs variables
-        da = None
-        crs_code = None
-        data_arrays = list()
-        # load each item
-        for item in self.items:
-            assets: Dict[str, Any] = item["assets"]
-            asset_value = next(iter(assets.values()))
-            # initial implementation assumes that file is local
-            file_path = asset_value["href"]
-            assert Path(file_path).exists(), f"Error! File does not exist: {file_path}"
-
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                logger.debug(
-                    f"StandardFileReader::load_items - reading file: {file_path}"
-                )
-                buffer = fstd2nc.Buffer(file_path, forecast_axis=True)
-                ds = buffer.to_xarray()
-                # get dimension names
-                x_dim = CloudStorageFileReader._get_dimension_name(
-                    item=item, axis=DEFAULT_X_DIMENSION
-                )
-                y_dim = CloudStorageFileReader._get_dimension_name(
-                    item=item, axis=DEFAULT_Y_DIMENSION
-                )
-                time_dim = CloudStorageFileReader._get_dimension_name(
-                    item=item, dim_type="temporal"
-                )
-                # get CRS
-                crs_code = CloudStorageFileReader._get_epsg(item=item)
-                if ds.rio.crs is None:
-                    ds.rio.write_crs(f"epsg:{crs_code}", inplace=True)
-                assert all(
-                    band in list(ds) for band in self.bands
-                ), f"Error! not all bands={self.bands} are in ds={list(ds)}"
-                # drop bands that were not required
-                ds = ds[self.bands]
-                # if bands is already one of the dimensions, use default 'variable'
-                if DEFAULT_BANDS_DIMENSION in dict(ds.dims).keys():
-                    da = ds.to_array()
-                else:
-                    # else export array using bands
-                    da = ds.to_array(dim=DEFAULT_BANDS_DIMENSION)
-                data_arrays.append(da)
-        if len(data_arrays) > 1:
-            # concatenate all xarray.DataArray objects
-            data_array = xr.concat(data_arrays, dim=time_dim)
+        assets: Dict[str, Any] = item["assets"]
+        asset_value = CloudStorageFileReader._get_data_asset(assets=assets)
+        file_path, lease = self._get_local_path(href=asset_value["href"])
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            logger.debug(f"StandardFileReader::load_items - reading file: {file_path}")
+            # only the headers of the requested variables are scanned, data is read by dask
+            buffer = fstd2nc.Buffer(file_path, vars=self.bands, forecast_axis=True)
+            ds = buffer.to_xarray()
+        # get dimension names
+        x_dim = CloudStorageFileReader._get_dimension_name(
+            item=item, axis=DEFAULT_X_DIMENSION
+        )
+        y_dim = CloudStorageFileReader._get_dimension_name(
+            item=item, axis=DEFAULT_Y_DIMENSION
+        )
+        # get CRS
+        crs_code = CloudStorageFileReader._get_epsg(item=item)
+        if ds.rio.crs is None:
+            ds.rio.write_crs(f"epsg:{crs_code}", inplace=True)
+        assert all(
+            band in list(ds) for band in self.bands
+        ), f"Error! not all bands={self.bands} are in ds={list(ds)}"
+        # drop bands that were not required
+        ds = ds[self.bands]
+        # select values of extra dimensions, e.g., level, before any record is decoded
+        ds = ds.sel(self.get_extra_dimensions_filter())
+        # if bands is already one of the dimensions, use default 'variable'
+        if DEFAULT_BANDS_DIMENSION in dict(ds.dims).keys():
+            da = ds.to_array()
         else:
-            data_array = data_arrays.pop()
+            # else export array using bands
+            da = ds.to_array(dim=DEFAULT_BANDS_DIMENSION)
         # filter by area of interest
         assert isinstance(crs_code, int), f"Error! Invalid type: {crs_code=}"
         reprojected_bbox = reproject_bbox(
@@ -116,12 +143,43 @@ class FSTDFileReader(CloudStorageFileReader):
         )
         assert x_dim is not None and y_dim is not None
         da = clip_box(
-            data=data_array,
+            data=da,
             bbox=reprojected_bbox,
             x_dim=x_dim,
             y_dim=y_dim,
             crs=crs_code,
         )
+        if lease is not None and isinstance(da.data, dask.array.Array):
+            # records are read from the cached copy when the array is computed, so the copy is
+            # not evicted as long as this array or an array derived from it exists
+            data = dask.array.map_blocks(
+                _hold_lease, da.data, lease=lease, dtype=da.dtype
+            )
+            da = da.copy(data=data)
+        return da
+
+    def load_items(self) -> xr.DataArray:
+        """load items that are associated with FSTD files
+
+        Returns:
+            xr.DataArray: raster data cube
+        """
+        # each item is decoded and clipped independently, either in this thread, in a pool
+        # of processes or on the dask cluster
+        data_arrays = map_items(
+            load_item=self._load_item,
+            items=self.items,
+            mode=DECODE_EXECUTION_MODE,
+            max_workers=DECODE_MAX_WORKERS,
+        )
+        time_dim = CloudStorageFileReader._get_dimension_name(
+            item=self.items[0], dim_type="temporal"
+        )
+        if len(data_arrays) > 1:
+            # concatenate all xarray.DataArray objects
+            da = xr.concat(data_arrays, dim=time_dim)
+        else:
+            da = data_arrays.pop()
         # remove timestamps that have not been selected by end-user
         if time_dim is not None:
             da = filter_by_time(
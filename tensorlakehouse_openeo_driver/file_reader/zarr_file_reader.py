@@ -17,6 +17,7 @@ from tensorlakehouse_openeo_driver.geospatial_utils import (
     filter_by_time,
     reproject_bbox,
 )
+from tensorlakehouse_openeo_driver.util.prefetch import create_prefetcher
 
 assert os.path.isfile("logging.conf")
 logging.config.fileConfig(fname="logging.conf", disable_existing_loggers=False)
@@ -60,6 +61,9 @@ class ZarrFileReader(CloudStorageFileReader):
         fs = self.create_s3filesystem()
         store = fs.get_mapper(s3_link)
         # store = s3fs.S3Map(root=s3_link, s3=fs)
+        prefetcher = create_prefetcher()
+        if prefetcher is not None:
+            store = prefetcher.wrap(store=store)
         dataset = xr.open_zarr(store=store)
 
         t_axis_name = CloudStorageFileReader._get_dimension_name(
@@ -98,4 +102,9 @@ class ZarrFileReader(CloudStorageFileReader):
             {y_axis_name: slice(reprojected_bbox[1], reprojected_bbox[3] + epsilon)}
         ]
         assert isinstance(array, xr.DataArray)
+        if prefetcher is not None:
+            # the chunks that intersect the selection are read ahead in temporal order
+            prefetcher.plan_chunks(
+                store=store, variables=self.bands, source=dataset, subset=array
+            )
         return array
@@ -1,6 +1,5 @@
-from collections import defaultdict
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union, DefaultDict
+from typing import Dict, List, Optional, Tuple, Union
 import geojson
 import numpy as np
 import pyproj
@@ -8,12 +7,14 @@ import xarray as xr
 import pandas as pd
 from rasterio.crs import CRS
 from tensorlakehouse_openeo_driver.constants import DEFAULT_TIME_DIMENSION
+from tensorlakehouse_openeo_driver.util import crs_util
 from rasterio.enums import Resampling
+from odc.geo.geobox import GeoBox
+from odc.geo.xr import xr_reproject
 from datetime import datetime
 from rioxarray.exceptions import OneDimensionalRaster
-import bisect
+import cftime
 from cftime._cftime import Datetime360Day
-import pytz
 from shapely.geometry.polygon import Polygon
 from shapely.geometry import shape
 
@@ -38,29 +39,32 @@ def clip_box(
     """
     # set CRS
     if data.rio.crs is None:
-        input_crs = CRS.from_epsg(crs)
-        data.rio.write_crs(input_crs, inplace=True)
+        assert crs is not None
+        input_crs = crs_util.get_crs(crs_code=crs)
+        data = data.rio.write_crs(input_crs)
     # area selected by the end-user
     minx, miny, maxx, maxy = bbox
-    # rename dimensions because clip_box accepts only x and y
-    data = rename_dimension(data=data, rename_dict={x_dim: "x", y_dim: "y"})
+    x_values = np.asarray(data[x_dim].values)
+    y_values = np.asarray(data[y_dim].values)
     # adjust user input based on the limits of the data coordinates
-    minx = max(minx, min(data["x"].values))
-    maxx = min(maxx, max(data["x"].values))
+    minx = max(minx, x_values.min())
+    maxx = min(maxx, x_values.max())
 
-    miny = max(miny, min(data["y"].values))
-    maxy = min(maxy, max(data["y"].values))
+    miny = max(miny, y_values.min())
+    maxy = min(maxy, y_values.max())
 
     try:
+        # clip_box finds the spatial dimensions by name, so set them instead of renaming
+        data = data.rio.set_spatial_dims(x_dim=x_dim, y_dim=y_dim)
         data = data.rio.clip_box(minx=minx, miny=miny, maxx=maxx, maxy=maxy, crs=crs)
     except OneDimensionalRaster:
         # handling exception when resulting dataarray has either x or y 1-size dimension
 
         # assumption: coordinates are sorted
         # get index of x that is smaller than minx
-        minx_index = bisect.bisect_left(a=data.x.values, x=minx)
+        minx_index = int(np.searchsorted(x_values, minx, side="left"))
         # get index of x that is greater than maxx
-        maxx_index = bisect.bisect_right(a=data.x.values, x=maxx)
+        maxx_index = int(np.searchsorted(x_values, maxx, side="right"))
         if minx_index == maxx_index:
             if minx_index > 0:
                 minx_index -= 1
@@ -68,22 +72,20 @@ def clip_box(
                 maxx_index += 1
 
         # get index of y that is smaller than miny
-        miny_index = bisect.bisect_left(a=data.y.values, x=miny)
+        miny_index = int(np.searchsorted(y_values, miny, side="left"))
         # get index of y that is smaller than maxy
-        maxy_index = bisect.bisect_right(a=data.y.values, x=maxy)
+        maxy_index = int(np.searchsorted(y_values, maxy, side="right"))
         if miny_index == maxy_index:
             if miny_index > 0:
                 miny_index -= 1
             else:
                 maxy_index += 1
         selector = {
-            "x": slice(minx_index, maxx_index),
-            "y": slice(miny_index, maxy_index),
+            x_dim: slice(minx_index, maxx_index),
+            y_dim: slice(miny_index, maxy_index),
         }
 
         data = data.isel(selector)
-    # rename dimensions back to original
-    data = rename_dimension(data=data, rename_dict={"x": x_dim, "y": y_dim})
     return data
 
 
@@ -94,46 +96,6 @@ def rename_dimension(data: xr.DataArray, rename_dict: Dict[str, str]):
     return data
 
 
-def _convert_to_datetime(
-    datetime_index: List[Union[str, datetime, np.datetime64, Datetime360Day, int]]
-) -> List[datetime]:
-    """convert a list of datetime values to native datetime
-
-    Args:
-        datetime_index (_type_): _description_
-
-
-    Returns:
-        List[datetime]: list of timezone aware datetime objects
-    """
-    dt = datetime_index[0]
-    timestamps: List[datetime] = list()
-    if isinstance(dt, str) or isinstance(dt, datetime) or isinstance(dt, np.datetime64):
-        for dt in datetime_index:
-            ts = pd.Timestamp(dt)
-            if ts.tzinfo is None:
-                ts = ts.tz_localize(tz="UTC")
-            timestamps.append(ts.to_pydatetime())
-    elif isinstance(dt, Datetime360Day):
-        for dt in datetime_index:
-            julian = (dt.month - 1) * 30 + dt.day
-
-            ts = pd.to_datetime(
-                f"{dt.year}-{julian}T{dt.hour}:{dt.minute}:{dt.second}",
-                format="%Y-%jT%H:%M:%S",
-            )
-            if ts.tzinfo is None:
-                ts = ts.tz_localize(tz="UTC")
-            timestamps.append(ts.to_pydatetime())
-    elif isinstance(dt, int):
-        for dt in datetime_index:
-            assert isinstance(dt, int)
-            timestamps.append(
-                pd.Timestamp.fromtimestamp(dt / 1e9, tz="UTC").to_pydatetime()
-            )
-    return timestamps
-
-
 def filter_by_time(
     data: Union[xr.DataArray, xr.Dataset],
     temporal_extent: Tuple[datetime, Optional[datetime]],
@@ -165,19 +127,17 @@ def filter_by_time(
     end_datetime = temporal_extent[1]
     ts = data[temporal_dim].values
     assert len(ts) > 0, "Error! temporal dimension is empty"
+    # convert temporal index to UTC datetime64, so that it can be bisected by numpy
+    timestamps = _to_datetime64(datetime_index=ts)
+    start_index = int(
+        np.searchsorted(timestamps, _to_utc_datetime64(start_datetime), side="left")
+    )
     # if end_datetime is None it is a open ended interval
     if end_datetime is None:
-        end_datetime = sorted(ts)[-1]
-    if start_datetime.tzinfo is None:
-        start_datetime = pytz.UTC.localize(start_datetime)
-
-    if end_datetime.tzinfo is None:
-        end_datetime = pytz.UTC.localize(end_datetime)
-
-    # convert temporal index to datetime timezone-aware
-    timestamps = _convert_to_datetime(datetime_index=ts)
-    start_index = bisect.bisect_left(timestamps, start_datetime)
-    end_index = bisect.bisect_right(timestamps, end_datetime)
+        end = timestamps.max()
+    else:
+        end = _to_utc_datetime64(end_datetime)
+    end_index = int(np.searchsorted(timestamps, end, side="right"))
     if start_index == end_index:
         data = data.isel({temporal_dim: [start_index]})
     else:
@@ -185,30 +145,105 @@ def filter_by_time(
     return data
 
 
+def _to_utc_datetime64(dt: Union[str, datetime, np.datetime64]) -> np.datetime64:
+    """convert a datetime to UTC datetime64 without timezone. Naive datetimes are assumed to be
+    UTC
+
+    Args:
+        dt (Union[str, datetime, np.datetime64]): datetime value
+
+    Returns:
+        np.datetime64: UTC datetime64 with nanosecond precision
+    """
+    ts = pd.Timestamp(dt)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return ts.to_datetime64().astype("datetime64[ns]")
+
+
+def _to_datetime64(
+    datetime_index: Union[
+        np.ndarray, List[Union[str, datetime, np.datetime64, Datetime360Day, int]]
+    ]
+) -> np.ndarray:
+    """convert datetime values to UTC datetime64 without timezone. Datetime360Day values are
+    mapped to the day of the year, e.g., 03-01 is the 61st day, and integers are nanoseconds
+    since epoch
+
+    Args:
+        datetime_index (Union[np.ndarray, List]): datetime values
+
+    Returns:
+        np.ndarray: UTC datetime64 values with nanosecond precision
+    """
+    values = np.asarray(datetime_index)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype("datetime64[ns]")
+    if np.issubdtype(values.dtype, np.integer):
+        # integers are nanoseconds since epoch
+        return values.astype("int64").view("datetime64[ns]")
+    if isinstance(values.flat[0], Datetime360Day):
+        # day of the 360-day year as day of the year
+        day_of_year = np.fromiter(
+            ((dt.month - 1) * 30 + dt.day for dt in values.flat),
+            dtype="int64",
+            count=values.size,
+        )
+        seconds = np.fromiter(
+            (dt.hour * 3600 + dt.minute * 60 + dt.second for dt in values.flat),
+            dtype="int64",
+            count=values.size,
+        )
+        years = np.fromiter(
+            (dt.year for dt in values.flat), dtype="int64", count=values.size
+        )
+        return (
+            (years - 1970).astype("datetime64[Y]").astype("datetime64[ns]")
+            + (day_of_year - 1).astype("timedelta64[D]")
+            + seconds.astype("timedelta64[s]")
+        )
+    if isinstance(values.flat[0], cftime.datetime):
+        return (
+            xr.CFTimeIndex(values.ravel())
+            .to_datetimeindex()
+            .to_numpy(dtype="datetime64[ns]")
+        )
+    index = pd.to_datetime(values.ravel(), utc=True).tz_convert(None)
+    return index.to_numpy(dtype="datetime64[ns]")
+
+
 def remove_repeated_time_coords(
     data_array: xr.DataArray, time_dim: str = DEFAULT_TIME_DIMENSION
 ) -> xr.DataArray:
     """Squeeze duplicate timestamps into unique timestamps.
     This function keeps the time dimension but merges duplicate timestamps by backward filling nan values.
+
+    Timestamps are grouped in a single pass. The first occurrence of each timestamp is selected
+    by one vectorised isel and its nan values are filled by the k-th occurrences, so that the
+    number of operations depends on the maximum number of duplicates of a timestamp instead of
+    the length of the time dimension
     """
     assert time_dim in data_array.dims, f"Error! {time_dim} is not in {data_array.dims}"
+    # group id of each timestamp, in order of first appearance
+    codes, uniques = pd.factorize(data_array[time_dim].values, use_na_sentinel=False)
     # if there is no repeated timestamp, return same array
-    if len(set(data_array[time_dim].values)) == len(data_array[time_dim].values):
+    if len(uniques) == len(codes):
         return data_array
-    else:
-        array_by_time: DefaultDict = defaultdict(list)
-        for index, t in enumerate(data_array[time_dim].values):
-            slice_array = data_array.isel({time_dim: index})
-            if t in array_by_time.keys():
-                array_by_time[t] = array_by_time[t].combine_first(slice_array)
-            else:
-                array_by_time[t] = slice_array
-        # print('length of concat list', len(arr_timestamp_lst))
-        arr: xr.DataArray = xr.concat(
-            array_by_time.values(), dim=time_dim, compat="override", coords="minimal"
-        )
-
-        return arr
+    # rank of each timestamp within its group, e.g., 0 for the first occurrence
+    order = np.argsort(codes, kind="stable")
+    group_start = np.searchsorted(codes[order], np.arange(len(uniques)))
+    ranks = np.empty_like(codes)
+    ranks[order] = np.arange(len(codes)) - group_start[codes[order]]
+    first_index = order[group_start]
+    arr: xr.DataArray = data_array.isel({time_dim: first_index})
+    for rank in range(1, int(ranks.max()) + 1):
+        # index of the rank-th occurrence of each timestamp. Timestamps that have fewer
+        # occurrences point to the first one, which does not fill anything
+        index = first_index.copy()
+        is_rank = ranks == rank
+        index[codes[is_rank]] = np.flatnonzero(is_rank)
+        arr = arr.fillna(data_array.isel({time_dim: index}))
+    return arr
 
 
 def remove_files_in_dir(dir_path: Path, prefix: str, suffix: str):
@@ -231,109 +266,129 @@ def _find_files_in_dir(dir_path: Path, prefix: str, suffix: str) -> List[Path]:
     return file_list
 
 
-def reproject_cube(
+def warp_cube(
     data_cube: xr.DataArray,
-    target_projection: CRS,
-    resolution: Optional[float],
+    geobox: GeoBox,
     resampling: Resampling,
-    shape: Optional[Tuple[int, int]] = None,
 ) -> xr.DataArray:
-    # We collect all available dimensions
-    non_spatial_dimension_names = [
-        dim for dim in data_cube.dims if dim not in ["y", "x"]
-    ]
-    # This code assumes that all dimensions have coordinates.
-    # I'm not aware of a use case we have where they not.
-    # So we raise an exception if this fails.
-    for dim in non_spatial_dimension_names:
-        if dim not in data_cube.coords:
-            raise ValueError(f"Dimension {dim} does not appear to have coordinates.")
-
-    if "__unified_non_spatial_dimension__" in data_cube.dims:
-        raise ValueError(
-            "The data array must not contain a dimension with name `__unified_dimension__`."
-        )
+    """warp the data cube onto the destination GeoBox. Non-spatial dimensions are kept as they
+    are. If the data is a dask array, every output tile is a separate task that reads only the
+    source chunks overlapping its footprint, so tiles are warped in parallel and the peak memory
+    of a task is bounded by the tile size instead of the size of the cube
 
-    # To reproject, we stack along a new dimension
-    data_cube_stacked = data_cube.stack(
-        dimensions={"__unified_non_spatial_dimension__": non_spatial_dimension_names},
-        create_index=True,
-    )
+    Args:
+        data_cube (xr.DataArray): data cube with y and x dimensions and a CRS
+        geobox (GeoBox): destination grid
+        resampling (Resampling): resampling method
+
+    Returns:
+        xr.DataArray: warped data cube
+    """
+    nodata = data_cube.rio.nodata
     # If we do not assign a no data value, we will get funny results
-    if data_cube_stacked.rio.nodata is None:
-        data_cube_stacked.rio.write_nodata(np.nan, inplace=True)
-    assert data_cube_stacked.rio.nodata is not None
-
-    # So we can finally reproject
-    data_cube_stacked_reprojected: xr.DataArray = data_cube_stacked.transpose(
-        "__unified_non_spatial_dimension__", "y", "x"
-    ).rio.reproject(
-        dst_crs=target_projection,
-        resolution=resolution,
+    if nodata is None and np.issubdtype(data_cube.dtype, np.floating):
+        nodata = np.nan
+    y_dim, x_dim = data_cube.odc.spatial_dims
+    chunks: Optional[Tuple[int, int]] = None
+    if data_cube.chunks is not None:
+        # output tiles have the size of the source chunks
+        chunks = (
+            data_cube.chunksizes[y_dim][0],
+            data_cube.chunksizes[x_dim][0],
+        )
+    warped = xr_reproject(
+        data_cube,
+        geobox,
         resampling=resampling,
-        shape=shape,
+        dst_nodata=nodata,
+        chunks=chunks,
     )
+    warped.name = data_cube.name
+    # odc names the spatial dimensions after the CRS (e.g., latitude/longitude)
+    dst_y_dim, dst_x_dim = warped.odc.spatial_dims
+    if (dst_y_dim, dst_x_dim) != (y_dim, x_dim):
+        warped = warped.rename({dst_y_dim: y_dim, dst_x_dim: x_dim})
+    if nodata is not None:
+        warped.rio.write_nodata(nodata, encoded=False, inplace=True)
+    return warped.transpose(*data_cube.dims)
 
-    # In theory we would simply call `.unstack` to bring things back to the original form.
-    # However, there seems to be a bug in rioxarray that multiindexes become indexes.
-    # So we simply re-assign the old index since we did not touch it in the first place.
-    data_cube_stacked_reprojected = data_cube_stacked_reprojected.assign_coords(
-        {
-            "__unified_non_spatial_dimension__": data_cube_stacked.indexes[
-                "__unified_non_spatial_dimension__"
-            ]
-        }
-    )
-    # Now we can unstack
-    data_cube_stacked_reprojected = data_cube_stacked_reprojected.unstack(
-        "__unified_non_spatial_dimension__"
-    )
-    # And we bring the dimensions back to the original order
-    data_cube_stacked_reprojected = data_cube_stacked_reprojected.transpose(
-        *data_cube.dims
-    )
 
-    return data_cube_stacked_reprojected
+def reproject_cube(
+    data_cube: xr.DataArray,
+    target_projection: CRS,
+    resolution: Optional[float],
+    resampling: Resampling,
+    shape: Optional[Tuple[int, int]] = None,
+) -> xr.DataArray:
+    """reproject the data cube to the target projection (see warp_cube)
+
+    Args:
+        data_cube (xr.DataArray): data cube with y and x dimensions and a CRS
+        target_projection (CRS): destination CRS
+        resolution (Optional[float]): destination resolution. If None, it is estimated from
+            the source resolution
+        resampling (Resampling): resampling method
+        shape (Optional[Tuple[int, int]], optional): destination height and width, which
+            cover the footprint of the source. Defaults to None.
+
+    Returns:
+        xr.DataArray: reprojected data cube
+    """
+    src_geobox = data_cube.odc.geobox
+    assert src_geobox is not None, "Error! Unable to find the grid of the data cube"
+    dst_crs = target_projection.to_string()
+    if shape is not None:
+        footprint = src_geobox.to_crs(dst_crs)
+        geobox = GeoBox.from_bbox(
+            footprint.extent.boundingbox, crs=dst_crs, shape=shape
+        )
+    elif resolution is not None:
+        geobox = src_geobox.to_crs(dst_crs, resolution=resolution)
+    else:
+        geobox = src_geobox.to_crs(dst_crs)
+    return warp_cube(data_cube=data_cube, geobox=geobox, resampling=resampling)
 
 
 def reproject_bbox(
     bbox: Tuple[float, float, float, float],
     dst_crs: Union[int, str],
     src_crs: Union[int, str] = 4326,
+    densify_pts: Optional[int] = crs_util.DENSIFY_PTS,
 ) -> Tuple[float, float, float, float]:
-    """reproject bounding box to specified dst_crs
+    """reproject bounding box to specified dst_crs. The edges are densified, so that the result
+    covers the whole area of interest, whose edges are curved in most projected CRSs
 
     Args:
         bbox (Tuple[float, float, float, float]): west, south, east, north
         dst_crs (Union[int, str]): destination CRS
         src_crs (Union[int, str], optional): source CRS. Defaults to 4326.
+        densify_pts (Optional[int], optional): number of points added to each edge before
+            reprojecting. If None, only the corners are reprojected. Defaults to
+            crs_util.DENSIFY_PTS.
 
     Returns:
         Tuple[float, float, float, float]: reprojected bbox
     """
-    crs_from: CRS = _get_epsg(crs_code=src_crs)
-    crs_to: CRS = _get_epsg(crs_code=dst_crs)
+    crs_from: pyproj.CRS = _get_epsg(crs_code=src_crs)
+    crs_to: pyproj.CRS = _get_epsg(crs_code=dst_crs)
     if crs_from.to_epsg() == crs_to.to_epsg():
         return bbox
 
-    transformer = pyproj.Transformer.from_crs(
-        crs_from=crs_from, crs_to=crs_to, always_xy=True
-    )
     minx, miny, maxx, maxy = bbox
     assert minx <= maxx, f"Error! {minx=} <= {maxx=} is false"
     assert miny <= maxy, f"Error! {miny=} <= {maxy=} is false"
-    repr_minx, repr_miny = transformer.transform(minx, miny)
-    repr_maxx, repr_maxy = transformer.transform(maxx, maxy)
+    repr_minx, repr_miny, repr_maxx, repr_maxy = crs_util.transform_bounds(
+        bbox=bbox, crs_from=crs_from, crs_to=crs_to, densify_pts=densify_pts
+    )
     assert repr_minx <= repr_maxx, f"Error! {repr_minx=} <= {repr_maxx=}"
     assert repr_miny <= repr_maxy, f"Error! {repr_miny=} <= {repr_maxy=}"
     return (repr_minx, repr_miny, repr_maxx, repr_maxy)
 
 
-def _get_epsg(crs_code: Union[str, int]) -> CRS:
+def _get_epsg(crs_code: Union[str, int]) -> pyproj.CRS:
     if isinstance(crs_code, str):
         crs_code = int(crs_code.split(":")[1])
-    crs_obj = pyproj.CRS.from_epsg(crs_code)
-    return crs_obj
+    return crs_util.get_crs(crs_code=crs_code)
 
 
 def convert_bbox_to_polygon(bbox: Tuple[float, float, float, float]) -> Polygon:
@@ -6,6 +6,7 @@ import logging
 import os
 import sys
 from asgiref.wsgi import WsgiToAsgi
+import dask
 from dask.distributed import Client, LocalCluster
 
 import openeo_driver
@@ -21,6 +22,7 @@ from tensorlakehouse_openeo_driver.constants import (
     TENSORLAKEHOUSE_OPENEO_DRIVER_PORT,
     STAC_URL,
 )
+from tensorlakehouse_openeo_driver.util import udf_runtime
 
 assert os.path.isfile("logging.conf")
 logging.config.fileConfig(fname="logging.conf", disable_existing_loggers=False)
@@ -37,7 +39,9 @@ def make_dask_client() -> Client:
     client = None
     # if remote dask scheduler is available
     if DASK_SCHEDULER_ADDRESS is not None and "0.0.0.0" in DASK_SCHEDULER_ADDRESS:
-        # otherwise use local dask cluster
+        # otherwise use local dask cluster, whose workers start the UDF processes. The config
+        # is set globally, because restarted workers read it again
+        dask.config.set(udf_runtime.DASK_CONFIG)
         cluster = LocalCluster(n_workers=4)
         logger.debug(f"\n\nDask dashboard link={cluster.dashboard_link}")
         client = Client(cluster)
@@ -24,7 +24,6 @@ from tensorlakehouse_openeo_driver.constants import (
 )
 import pandas as pd
 import pyproj
-from pyproj import Transformer
 from tensorlakehouse_openeo_driver.file_reader.cog_file_reader import COGFileReader
 from tensorlakehouse_openeo_driver.file_reader.netcdf_file_reader import (
     NetCDFFileReader,
@@ -42,6 +41,7 @@ from openeo_pg_parser_networkx.pg_schema import ParameterReference
 
 from tensorlakehouse_openeo_driver.stac.stac import make_stac_client
 from tensorlakehouse_openeo_driver.pipeline.handler.handler_factory import make_handler
+from tensorlakehouse_openeo_driver.util import crs_util
 
 
 class AbstractLoadCollection(ABC):
@@ -73,13 +73,13 @@ class AbstractLoadCollection(ABC):
         Returns:
             _type_: _description_
         """
-        epsg4326 = pyproj.CRS.from_epsg(4326)
-        transformer = Transformer.from_crs(
-            crs_from=crs_from, crs_to=epsg4326, always_xy=True
+        # the edges are densified, so that the box covers the curved edges of the reprojected box
+        return crs_util.transform_bounds(
+            bbox=(lonmin, latmin, lonmax, latmax),
+            crs_from=crs_from,
+            crs_to=4326,
+            densify_pts=crs_util.DENSIFY_PTS,
         )
-        east, north = transformer.transform(lonmax, latmax)
-        west, south = transformer.transform(lonmin, latmin)
-        return west, south, east, north
 
 
 class LoadCollectionFromCOS(AbstractLoadCollection):
@@ -407,9 +407,9 @@ class LoadCollectionFromCOS(AbstractLoadCollection):
             Tuple[float, float, float, float]: min lon, min lat, max lon, max lat
         """
         # get original crs
-        pyproj_crs = pyproj.CRS.from_string(spatial_extent.crs)
+        pyproj_crs = crs_util.get_crs(crs_code=spatial_extent.crs)
         # required projection to search on STAC
-        epsg4326 = pyproj.CRS.from_epsg(4326)
+        epsg4326 = crs_util.get_crs(crs_code=4326)
         # get bounding box
         lonmin, latmin, lonmax, latmax = (
             spatial_extent.west,
@@ -10,6 +10,7 @@ from tensorlakehouse_openeo_driver.process_implementations.load_collection impor
     LoadCollectionFromCOS,
 )
 
+import dask_geopandas
 import geopandas as gpd
 import numpy as np
 import openeo
@@ -18,7 +19,6 @@ import pyproj
 import xarray as xr
 from openeo_driver.errors import ProcessParameterInvalidException
 from openeo_pg_parser_networkx.graph import Callable
-from openeo.udf.udf_data import UdfData
 from openeo_pg_parser_networkx.pg_schema import (
     BoundingBox,
     TemporalInterval,
@@ -27,6 +27,7 @@ from openeo_processes_dask.process_implementations.data_model import (
     RasterCube,
     VectorCube,
 )
+from openeo_processes_dask.process_implementations.cubes import _filter
 from openeo_processes_dask.process_implementations.exceptions import (
     DimensionNotAvailable,
     OverlapResolverMissing,
@@ -36,25 +37,38 @@ from openeo_processes_dask.process_implementations.math import (
     mean as openeo_processes_dask_mean,
 )
 
-from pyproj import Transformer
 from rasterio import crs
+import shapely
 from shapely.geometry import shape
 from shapely.geometry.polygon import Polygon
 
 from tensorlakehouse_openeo_driver.constants import (
+    DEFAULT_BANDS_DIMENSION,
     GTIFF,
     NETCDF,
     PARQUET,
     STAC_DATETIME_FORMAT,
     STAC_URL,
     DEFAULT_TIME_DIMENSION,
+    ZARR,
     ZIP,
 )
 from tensorlakehouse_openeo_driver.driver_data_cube import TensorLakehouseDataCube
-from tensorlakehouse_openeo_driver.save_result import GeoDNImageCollectionResult
-from tensorlakehouse_openeo_driver.geospatial_utils import reproject_cube
+from tensorlakehouse_openeo_driver.save_result import (
+    GeoDNImageCollectionResult,
+    get_result_store_url,
+)
+from tensorlakehouse_openeo_driver.geospatial_utils import reproject_cube, warp_cube
 from tensorlakehouse_openeo_driver.stac.stac import make_stac_client
 from tensorlakehouse_openeo_driver.stac.stac_utils import get_dimension_names
+from tensorlakehouse_openeo_driver.util import (
+    crs_util,
+    cube_merge,
+    grouped_reduction,
+    udf_runtime,
+    zonal_statistics,
+)
+from tensorlakehouse_openeo_driver.util.reference_index import get_storage_options
 
 logging.config.fileConfig(fname="logging.conf", disable_existing_loggers=False)
 logger = logging.getLogger("geodnLogger")
@@ -160,8 +174,8 @@ def _get_bounding_box(spatial_extent: BoundingBox) -> Tuple[float, float, float,
     latmin = spatial_extent.south
     lonmax = spatial_extent.east
     lonmin = spatial_extent.west
-    pyproj_crs = pyproj.CRS.from_string(spatial_extent.crs)
-    epsg4326 = pyproj.CRS.from_epsg(4326)
+    pyproj_crs = crs_util.get_crs(crs_code=spatial_extent.crs)
+    epsg4326 = crs_util.get_crs(crs_code=4326)
 
     if pyproj_crs != epsg4326:
         lonmin, latmin, lonmax, latmax = to_epsg4326(
@@ -194,13 +208,13 @@ def to_epsg4326(
     Returns:
         _type_: _description_
     """
-    epsg4326 = pyproj.CRS.from_epsg(4326)
-    transformer = Transformer.from_crs(
-        crs_from=crs_from, crs_to=epsg4326, always_xy=True
+    # the edges are densified, so that the box covers the curved edges of the reprojected box
+    return crs_util.transform_bounds(
+        bbox=(lonmin, latmin, lonmax, latmax),
+        crs_from=crs_from,
+        crs_to=4326,
+        densify_pts=crs_util.DENSIFY_PTS,
     )
-    east, north = transformer.transform(lonmax, latmax)
-    west, south = transformer.transform(lonmin, latmin)
-    return west, south, east, north
 
 
 def _get_start_and_endtime(
@@ -254,7 +268,7 @@ def save_result(
     # support NETCDF format
     assert isinstance(format, str), f"Error! Unexpected type of format var: {format}"
     format = format.upper()
-    if format == NETCDF:
+    if format in [NETCDF, ZARR]:
         assert isinstance(
             data, xr.DataArray
         ), f"Error! data is not a xarray.Dataset: {type(data)}"
@@ -285,7 +299,7 @@ def save_result(
         return GeoDNImageCollectionResult(
             cube=TensorLakehouseDataCube(data=data), format=format, options=options
         )
-    elif format == PARQUET:
+    elif format in [PARQUET, GEOJSON]:
         return GeoDNImageCollectionResult(
             cube=TensorLakehouseDataCube(data=data), format=format, options=options
         )
@@ -366,6 +380,57 @@ def load_collection(
         raise e
 
 
+def load_result(
+    id: str,
+    spatial_extent: Optional[BoundingBox] = None,
+    temporal_extent: Optional[TemporalInterval] = None,
+    bands: Optional[List[str]] = None,
+) -> RasterCube:
+    """load the result of a batch job that has been saved as a zarr store on the output bucket.
+    The store is opened lazily, so that only the chunks of the selection are read
+
+    Args:
+        id (str): job ID
+        spatial_extent (Optional[BoundingBox], optional): bounding box. Defaults to None.
+        temporal_extent (Optional[TemporalInterval], optional): time interval. Defaults to None.
+        bands (Optional[List[str]], optional): band names. Defaults to None.
+
+    Raises:
+        ProcessParameterInvalidException: if the job has no zarr result or the result does not
+            have the bands
+
+    Returns:
+        RasterCube: data cube with the dimensions of the result and a bands dimension
+    """
+    url = get_result_store_url(job_id=id)
+    logger.debug(f"Running load_result process: job ID={id} {url=}")
+    try:
+        # local stores, e.g., in tests, do not accept storage options
+        storage_options = get_storage_options(url=url) or None
+        ds = xr.open_zarr(url, consolidated=True, storage_options=storage_options)
+    except (FileNotFoundError, KeyError) as e:
+        raise ProcessParameterInvalidException(
+            parameter="id",
+            process="load_result",
+            reason=f"Job {id} does not have a zarr result: {e!r}",
+        )
+    if bands is not None:
+        missing = [band for band in bands if band not in ds.data_vars]
+        if len(missing) > 0:
+            raise ProcessParameterInvalidException(
+                parameter="bands",
+                process="load_result",
+                reason=f"The result of job {id} does not have the bands {missing}",
+            )
+        ds = ds[bands]
+    data = ds.to_array(dim=DEFAULT_BANDS_DIMENSION)
+    if spatial_extent is not None:
+        data = _filter.filter_bbox(data=data, extent=spatial_extent)
+    if temporal_extent is not None:
+        data = _filter.filter_temporal(data=data, extent=temporal_extent)
+    return data
+
+
 def _load_collection_from_external_openeo_instance(
     collection_id: str,
     spatial_extent: BoundingBox,
@@ -412,22 +477,20 @@ def aggregate_spatial(
     the iterable geometries argument which is a List[ (Geojson representation: Polygon, Line, Multipolygon,...).
     The clipping operation is defined in the rasterio function described here:
     https://corteva.github.io/rioxarray/html/rioxarray.html#rioxarray.raster_array.RasterArray
-    The function returns a stacked GeoDataFrame object time	bands	spatial_ref	count	reduced	geometry
-0	2022-01-02 19:12:02	B02	0	42736	2049.484650	POLYGON ((-2716931.681 5751311.779, -2713046.0...
-1	2022-01-02 19:12:16	B02	0	45230	2030.256644	POLYGON ((-2716931.681 5751311.779, -2713046.0...
-.
-.
-6	2022-01-02 19:12:02	B8A	0	42736	2732.596616	POLYGON ((-2716931.681 5751311.779, -2713046.0...
-7	2022-01-02 19:12:16	B8A	0	45230	2701.098806	POLYGON ((-2716931.681 5751311.779, -2713046.0..
+    The function returns a lazy (dask_geopandas) stacked GeoDataFrame object time	bands	spatial_ref	count	reduced	geometry
+    0	2022-01-02 19:12:02	B02	0	42736	2049.484650	POLYGON ((-2716931.681 5751311.779, -2713046.0...
+    1	2022-01-02 19:12:16	B02	0	45230	2030.256644	POLYGON ((-2716931.681 5751311.779, -2713046.0...
+    .
+    .
+    6	2022-01-02 19:12:02	B8A	0	42736	2732.596616	POLYGON ((-2716931.681 5751311.779, -2713046.0...
+    7	2022-01-02 19:12:16	B8A	0	45230	2701.098806	POLYGON ((-2716931.681 5751311.779, -2713046.0..
 
     The 'reduced' column is the stacked timeseries of applying the reducer for each band
-    The 'count' column is the count of NaN pixels in each band at each timestamp in the clipped geometry
+    The 'count' column is the count of non-NaN pixels in each band at each timestamp in the geometry
 
-    Currently, this function clips over the Union of shapes in the geometries, and the entries in the 'geometry'\
-    column is simply the first on in the List of input geometries.
-    This will be improved in a subsequent version of the function that will iterate over the geometries,
-    returning a stacked dataframe having the (reducer & count) timeseries for each band and geometry in the
-    stacked GDF
+    The geometries are rasterized once into label rasters on the grid of the data and the statistics
+    of all geometries are computed by a single pass over the data (see util/zonal_statistics.py), so
+    the result has the (reducer & count) timeseries for each band and geometry
 
     Notes:
     When the CRS of the the clip area differs from that of the data, the clip area is
@@ -446,7 +509,7 @@ def aggregate_spatial(
         target_dimension (str, optional): _description_. Defaults to "result".
 
     Returns:
-        VectorCube: GeopandasDataFrame
+        VectorCube: dask_geopandas.GeoDataFrame
     """
     logger.debug(f"Running aggregate_spatial process; geometries: {geometries}")
     logger.debug(f"kwargs: {kwargs}")
@@ -474,7 +537,7 @@ def aggregate_spatial(
     # If no crs associated with geometries, set to 4326
     if not hasattr(clip_area, "crs") or clip_area.crs is None:
         clip_area.set_crs(crs=CRS_EPSG_4326, inplace=True)
-    print(f"clip_area.crs: {clip_area.crs}")
+    logger.debug(f"clip_area.crs: {clip_area.crs}")
 
     y_dim = data.openeo.y_dim
     x_dim = data.openeo.x_dim
@@ -482,8 +545,9 @@ def aggregate_spatial(
     applicable_band_dim = band_dims[0]
 
     time_dims = data.openeo.temporal_dims[0]
-    logger.debug(f"Dimensions: y={y_dim} x={x_dim} band={applicable_band_dim}")
-    print(f"agg_spatial_data dimensions: {[band_dims, time_dims, x_dim, y_dim]}")
+    logger.debug(
+        f"Dimensions: y={y_dim} x={x_dim} band={applicable_band_dim} time={time_dims}"
+    )
 
     # Reproject Clip area CRS to match Data CRS
     clip_crs = clip_area.crs.to_string()
@@ -496,69 +560,104 @@ def aggregate_spatial(
         # check if clipping area is within bbox
         _check_geometries_within_data_boundaries(clip_area=clip_area, data=data)
 
-        clipped = data.rio.clip(clip_area.geometry.values, clip_area.crs)
-        count = clipped.count(dim=[x_dim, y_dim])
-        count.name = "count"
-        print(f"count_data_array: {count}")
-
-        aggdata = clipped.reduce(
-            reducer, dim=[x_dim, y_dim], keepdims=False, data=clipped
+        # common reducers (e.g., mean) are computed by the engine, which reduces each chunk
+        # on its own instead of calling the reducer on all pixels of each geometry
+        reducer_name = grouped_reduction.get_reducer_name(reducer=reducer)
+        aggdata = zonal_statistics.zonal_statistics(
+            data=data,
+            geometries=clip_area.geometry,
+            statistics={
+                "count": zonal_statistics.COUNT,
+                "reduced": reducer_name if reducer_name is not None else reducer,
+            },
+            x_dim=x_dim,
+            y_dim=y_dim,
         )
-        aggdata.name = "reduced"
-        print(f"aggdata_data_array: {aggdata}")
-
-        aggdata = xr.merge([count, aggdata])
-        print(f"merge result: {aggdata}")
+        logger.debug(f"aggregate_spatial - zonal statistics: {dict(aggdata.sizes)}")
 
-        result = _dataset_to_GPDF(aggdata, clip_area, [applicable_band_dim, time_dims])
+        result = _dataset_to_vector_cube(
+            aggdata, clip_area, [applicable_band_dim, time_dims]
+        )
 
     else:
         raise Exception(
             f"Invalid argument value for target_dimension: {target_dimension}, default is: {applicable_band_dim}"
         )
 
-    # r = [type(x) for x in result.columns]
-    # print(f"GDF columns: {r}, {result.columns}")
-    print(f"spatial_aggregation result:\n{result.to_dict()}")
+    # the result is lazy, so only its structure is logged
+    logger.debug(
+        f"spatial_aggregation result: columns={list(result.columns)} partitions={result.npartitions}"
+    )
 
     return result
 
 
-def _dataset_to_GPDF(
+def _dataset_to_vector_cube(
     dataset: xr.Dataset,
     geometries: gpd.GeoDataFrame,
     dims: List[str],
-) -> gpd.GeoDataFrame:
+) -> dask_geopandas.GeoDataFrame:
     """
-    Convert the xarray.Dataset to Geopandas as this is the format expected on the openeo_client side.
-    This GDF is serialized to a temp file on the backend as part of the sae_result/download processing of
-    the process graph. The temp file is streamed to the client as part of the download() process graph operation
-    The columns of the DataFrame will be ['time', 'geometry'] + [bands]
+    Convert the xarray.Dataset to a lazy GeoDataFrame, as this is the format expected on the
+    openeo_client side. Nothing is computed here: GeoDNImageCollectionResult computes and writes
+    the partitions one by one as part of the save_result/download processing of the process graph,
+    so that the whole table never has to fit in memory.
+    The columns of the DataFrame will be dims + ['geometry'] + [statistics], and the rows are
+    ordered by dims
 
     Args:
-        data (RasterCube): _description_
-        geometries (VectorCube): Multipolygon GeoJson
+        dataset (xr.Dataset): one variable per statistic and a geometry dimension
+        geometries (gpd.GeoDataFrame): geometries in the order of the geometry dimension
+        dims (List[str]): dimensions that define the order of the rows
 
     Returns:
-        VectorCube: GeopandasDataFrame
+        dask_geopandas.GeoDataFrame: one row per geometry and combination of dims
 
     """
-    logger.debug("Converting dataarray to GeoDataFrame")
+    logger.debug("Converting dataset to dask_geopandas.GeoDataFrame")
 
-    # pdf = dataarray.to_pandas()
-    df = dataset.to_dataframe().reset_index()
-    # print(f"xarray2pandas: {pdf}")
-    print(f"dataset2df: {df}")
+    geometry_dim = zonal_statistics.GEOMETRY_DIM
+    # object columns would be converted to strings by dask, so the geometry dimension is
+    # replaced by its position and each partition looks up its geometries
+    dataset = dataset.drop_vars(geometry_dim).assign_coords(
+        {geometry_dim: np.arange(dataset.sizes[geometry_dim])}
+    )
+    dim_order = dims + [geometry_dim]
+    dim_order += [str(d) for d in dataset.dims if d not in dim_order]
+    ddf = dataset.to_dask_dataframe(dim_order=dim_order)
 
+    geometry_values = np.asarray(geometries.geometry.values)
     crs = geometries.crs.to_string()
-    geometry = [geometries.iloc[0][0]] * len(df)
-    gpdf = gpd.GeoDataFrame(df, crs=crs, geometry=geometry)
+    meta = _attach_geometries(ddf._meta, geometries=geometry_values, crs=crs)
+    return ddf.map_partitions(
+        _attach_geometries, geometries=geometry_values, crs=crs, meta=meta
+    )
 
-    gpdf = gpdf.sort_values(by=dims).reset_index(drop=True)
 
-    # gpdf.columns.name = 'statistic'
+def _attach_geometries(
+    df: pd.DataFrame, geometries: np.ndarray, crs: str
+) -> gpd.GeoDataFrame:
+    """replace the positions of the geometry column by the geometries
 
-    return gpdf
+    Args:
+        df (pd.DataFrame): partition of the vector cube
+        geometries (np.ndarray): shapely geometries
+        crs (str): CRS of the geometries
+
+    Returns:
+        gpd.GeoDataFrame: partition of the vector cube
+    """
+    geometry_dim = zonal_statistics.GEOMETRY_DIM
+    df = df.assign(
+        **{
+            geometry_dim: gpd.GeoSeries(
+                geometries.take(df[geometry_dim].to_numpy()),
+                index=df.index,
+                crs=crs,
+            )
+        }
+    )
+    return gpd.GeoDataFrame(df, geometry=geometry_dim, crs=crs)
 
 
 def _check_geometries_within_data_boundaries(
@@ -585,10 +684,11 @@ def _check_geometries_within_data_boundaries(
     boundaries = Polygon(
         [[min_x, min_y], [max_x, min_y], [max_x, max_y], [min_x, max_y], [min_x, min_y]]
     )
-    for aoi in clip_area.geometry:
-        # aoi = Polygon(geom["coordinates"][0])
-        if not aoi.within(boundaries):
-            raise ValueError(f"Error! {aoi.wkt} is not within {boundaries.wkt}")
+    # a single vectorised predicate over all geometries instead of a loop
+    within = shapely.within(np.asarray(clip_area.geometry.values), boundaries)
+    if not within.all():
+        aoi = clip_area.geometry.iloc[int(np.argmin(within))]
+        raise ValueError(f"Error! {aoi.wkt} is not within {boundaries.wkt}")
 
     return True
 
@@ -655,13 +755,28 @@ def temporal_aggregation(
         )
 
     # Convert the pandas.IntervalIndex into an array of bin edges
-    bin_edges = np.concatenate(([intervals.left[0]], intervals.right))
-
-    # Group by bins using xarray's groupby_bins
-    binned = data.groupby_bins("time", bins=bin_edges, labels=intervals, right=False)
+    bin_edges = intervals.left[:1].append(intervals.right)
+
+    def group_by(d: xr.DataArray):
+        # Group by bins using xarray's groupby_bins
+        return d.groupby_bins("time", bins=bin_edges, labels=intervals, right=False)
+
+    # common reducers are computed by the grouped reduction engine (flox)
+    reducer_name = grouped_reduction.get_reducer_name(reducer=reducer)
+    if reducer_name is not None:
+        codes = intervals.get_indexer(data.indexes["time"])
+        reduced = grouped_reduction.reduce_groups(
+            data=data,
+            dim="time",
+            codes=codes,
+            group_by=group_by,
+            reducer_name=reducer_name,
+        )
+        if reduced is not None:
+            return reduced
 
     # Apply the reducer to each bin
-    aggregated = binned.reduce(reducer)
+    aggregated: xr.DataArray = group_by(data).reduce(reducer)
 
     return aggregated
 
@@ -788,52 +903,42 @@ def merge_cubes(
 
     if len(differing_dims) == 0:
         # Check whether all of the shared dims have exactly the same labels
-        dims_have_no_label_diff = all(
-            [
-                len(overlap.only_in_cube1) == 0 and len(overlap.only_in_cube2) == 0
-                for overlap in overlap_per_shared_dim.values()
-            ]
-        )
-        if dims_have_no_label_diff:
+        dims_with_label_diff = [
+            dim
+            for dim, overlap in overlap_per_shared_dim.items()
+            if len(overlap.only_in_cube1) > 0 or len(overlap.only_in_cube2) > 0
+        ]
+        if len(dims_with_label_diff) == 0:
             # Example 3: All dimensions and their labels are equal
-            concat_both_cubes = xr.concat([cube1, cube2], dim=NEW_DIM_NAME).reindex(
-                {NEW_DIM_NAME: NEW_DIM_COORDS}
-            )
-
-            # Need to rechunk here to ensure that the cube dimension isn't chunked and the chunks for the other dimensions are not too large.
-            concat_both_cubes_rechunked = concat_both_cubes.chunk(
-                {NEW_DIM_NAME: -1}
-                | {dim: "auto" for dim in cube1.dims if dim != NEW_DIM_NAME}
-            )
             if overlap_resolver is None:
                 # Example 3.1: Concat along new "cubes" dimension
-                merged_cube = concat_both_cubes_rechunked
+                merged_cube = xr.concat(
+                    [cube1, cube2.transpose(*cube1.dims)], dim=NEW_DIM_NAME
+                ).reindex({NEW_DIM_NAME: NEW_DIM_COORDS})
             else:
-                # Example 3.2: Elementwise operation
-                positional_parameters: Dict = {}
-                named_parameters = {
-                    x_dim: cube1.data,
-                    y_dim: cube2.data,
-                    "context": context,
-                }
-
-                merged_cube = concat_both_cubes_rechunked.reduce(
-                    overlap_resolver,
-                    dim=NEW_DIM_NAME,
-                    keep_attrs=True,
-                    positional_parameters=positional_parameters,
-                    named_parameters=named_parameters,
+                # Example 3.2: Elementwise operation on cubes with the same chunk grid
+                merged_cube = cube_merge.resolve_overlap(
+                    x=cube1, y=cube2, overlap_resolver=overlap_resolver, context=context
                 )
         else:
             # Example 1 & 2
             dims_requiring_resolve = [
                 dim
-                for dim, overlap in overlap_per_shared_dim.items()
-                if len(overlap.in_both) > 0
-                and (len(overlap.only_in_cube1) > 0 or len(overlap.only_in_cube2) > 0)
+                for dim in dims_with_label_diff
+                if len(overlap_per_shared_dim[dim].in_both) > 0
             ]
 
-            if len(dims_requiring_resolve) == 0:
+            if len(dims_requiring_resolve) == 0 and len(dims_with_label_diff) == 1:
+                # Example 1: No overlap and labels differ on a single dimension, e.g., bands,
+                # so the cubes are concatenated along it without rechunking. The labels of
+                # cube1 come first on the band dimension
+                merge_dim = dims_with_label_diff[0]
+                merged_cube = cube_merge.concat_parts(
+                    parts=[cube1, cube2.transpose(*cube1.dims)],
+                    dim=merge_dim,
+                    keep_order=merge_dim == bands_dim,
+                )
+            elif len(dims_requiring_resolve) == 0:
                 # Example 1: No overlap on any dimensions, can just combine by coords
 
                 # We need to convert to dataset before calling `combine_by_coords` in order to avoid the bug raised in https://github.com/Open-EO/openeo-processes-dask/issues/102
@@ -859,7 +964,6 @@ def merge_cubes(
                 merged_cube = xr.combine_by_coords(
                     [cube1, cube2], combine_attrs="drop_conflicts"
                 )
-                # merged_cube = xr.concat([cube1, cube2], dim=BANDS, compat="override", combine_attrs="drop_conflicts", coords="minimal")
                 if isinstance(merged_cube, xr.Dataset):
                     merged_cube = merged_cube.to_array(dim=bands_dim)
                     merged_cube = merged_cube.reindex({bands_dim: previous_band_order})
@@ -868,7 +972,8 @@ def merge_cubes(
 
             elif len(dims_requiring_resolve) == 1:
                 # Example 2: Overlap on one dimension, resolve these pixels with overlap resolver
-                # and combine the rest by coords
+                # and concatenate the rest, so that only the overlapping region is aligned and
+                # passed to the overlap resolver
 
                 if overlap_resolver is None or not callable(overlap_resolver):
                     raise OverlapResolverMissing(
@@ -876,73 +981,20 @@ def merge_cubes(
                     )
 
                 overlapping_dim = dims_requiring_resolve[0]
-
-                stacked_conflicts = xr.concat(
-                    [
-                        cube1.sel(
-                            **{
-                                overlapping_dim: overlap_per_shared_dim[
-                                    overlapping_dim
-                                ].in_both
-                            }
-                        ),
-                        cube2.sel(
-                            **{
-                                overlapping_dim: overlap_per_shared_dim[
-                                    overlapping_dim
-                                ].in_both
-                            }
-                        ),
-                    ],
-                    dim=NEW_DIM_NAME,
-                ).reindex({NEW_DIM_NAME: NEW_DIM_COORDS})
-
-                # Need to rechunk here to ensure that the cube dimension isn't chunked and the chunks for the other dimensions are not too large.
-                stacked_conflicts_rechunked = stacked_conflicts.chunk(
-                    {NEW_DIM_NAME: -1}
-                    | {dim: "auto" for dim in cube1.dims if dim != NEW_DIM_NAME}
-                )
-
-                conflicts_cube_1 = cube1.sel(
-                    **{overlapping_dim: overlap_per_shared_dim[overlapping_dim].in_both}
-                )
-
-                conflicts_cube_2 = cube2.sel(
-                    **{overlapping_dim: overlap_per_shared_dim[overlapping_dim].in_both}
-                )
-
-                positional_parameters = {}
-                named_parameters = {
-                    x_dim: conflicts_cube_1.data,
-                    y_dim: conflicts_cube_2.data,
-                    "context": context,
-                }
-
-                merge_conflicts = stacked_conflicts_rechunked.reduce(
-                    overlap_resolver,
-                    dim=NEW_DIM_NAME,
-                    keep_attrs=True,
-                    positional_parameters=positional_parameters,
-                    named_parameters=named_parameters,
-                )
-
-                rest_of_cube_1 = cube1.sel(
-                    **{
-                        overlapping_dim: overlap_per_shared_dim[
-                            overlapping_dim
-                        ].only_in_cube1
-                    }
+                overlap = overlap_per_shared_dim[overlapping_dim]
+                merge_conflicts = cube_merge.resolve_overlap(
+                    x=cube1.sel({overlapping_dim: overlap.in_both}),
+                    y=cube2.sel({overlapping_dim: overlap.in_both}),
+                    overlap_resolver=overlap_resolver,
+                    context=context,
                 )
+                rest_of_cube_1 = cube1.sel({overlapping_dim: overlap.only_in_cube1})
                 rest_of_cube_2 = cube2.sel(
-                    **{
-                        overlapping_dim: overlap_per_shared_dim[
-                            overlapping_dim
-                        ].only_in_cube2
-                    }
-                )
-                merged_cube = xr.combine_by_coords(
-                    [merge_conflicts, rest_of_cube_1, rest_of_cube_2],
-                    combine_attrs="drop_conflicts",
+                    {overlapping_dim: overlap.only_in_cube2}
+                ).transpose(*cube1.dims)
+                merged_cube = cube_merge.concat_parts(
+                    parts=[rest_of_cube_1, merge_conflicts, rest_of_cube_2],
+                    dim=overlapping_dim,
                 )
 
             else:
@@ -967,35 +1019,17 @@ def merge_cubes(
             higher_dim_cube = cube1
             is_cube1_lower_dim = False
 
-        lower_dim_cube_broadcast = lower_dim_cube.broadcast_like(higher_dim_cube)
+        lower_dim_cube_broadcast = lower_dim_cube.broadcast_like(
+            higher_dim_cube
+        ).transpose(*higher_dim_cube.dims)
 
-        # Stack both cubes and use overlap resolver to resolve each pixel
-        both_stacked = xr.concat(
-            [higher_dim_cube, lower_dim_cube_broadcast], dim=NEW_DIM_NAME
-        ).reindex({NEW_DIM_NAME: NEW_DIM_COORDS})
-
-        # Need to rechunk here to ensure that the cube dimension isn't chunked and the chunks for the other dimensions are not too large.
-        both_stacked_rechunked = both_stacked.chunk(
-            {NEW_DIM_NAME: -1}
-            | {dim: "auto" for dim in cube1.dims if dim != NEW_DIM_NAME}
-        )
-
-        positional_parameters = {}
-
-        named_parameters = {"context": context}
+        # resolve each pixel without stacking both cubes
         if is_cube1_lower_dim:
-            named_parameters["x"] = lower_dim_cube_broadcast.data
-            named_parameters["y"] = higher_dim_cube.data
+            x, y = lower_dim_cube_broadcast, higher_dim_cube
         else:
-            named_parameters["x"] = higher_dim_cube.data
-            named_parameters["y"] = lower_dim_cube_broadcast.data
-
-        merged_cube = both_stacked_rechunked.reduce(
-            overlap_resolver,
-            dim=NEW_DIM_NAME,
-            keep_attrs=True,
-            positional_parameters=positional_parameters,
-            named_parameters=named_parameters,
+            x, y = higher_dim_cube, lower_dim_cube_broadcast
+        merged_cube = cube_merge.resolve_overlap(
+            x=x, y=y, overlap_resolver=overlap_resolver, context=context
         )
     else:
         raise ValueError("Number of differing dimensions is >2, merge not possible.")
@@ -1008,65 +1042,33 @@ def _reproject_cube_match(
     match_data_array: xr.DataArray,
     resampling: Resampling,
 ) -> xr.DataArray:
-    # We collect all available dimensions
-    band_dims = list(data_cube.openeo.band_dims)
-    temporal_dims = list(data_cube.openeo.temporal_dims)
-    non_spatial_dimension_names = band_dims + temporal_dims
-    # non_spatial_dimension_names = [
-    #     dim for dim in data_cube.dims if dim not in ["y", "x"]
-    # ]
-    # This code assumes that all dimensions have coordinates.
-    # I'm not aware of a use case we have where they not.
-    # So we raise an exception if this fails.
-    for dim in non_spatial_dimension_names:
-        if dim not in data_cube.coords:
-            raise ValueError(f"Dimension {dim} does not appear to have coordinates.")
-
-    if "__unified_non_spatial_dimension__" in data_cube.dims:
-        raise ValueError(
-            "The data array must not contain a dimension with name `__unified_dimension__`."
-        )
+    """warp data_cube onto the grid of match_data_array (see geospatial_utils.warp_cube)
 
-    # To reproject, we stack along a new dimension
-    data_cube_stacked = data_cube.stack(
-        dimensions={"__unified_non_spatial_dimension__": non_spatial_dimension_names},
-        create_index=True,
-    )
-    # If we do not assign a no data value, we will get funny results
-    if data_cube_stacked.rio.nodata is None:
-        data_cube_stacked.rio.write_nodata(np.nan, inplace=True)
-    assert data_cube_stacked.rio.nodata is not None
+    Args:
+        data_cube (RasterCube): data cube
+        match_data_array (xr.DataArray): data cube that defines the destination grid
+        resampling (Resampling): resampling method
 
-    # So we can finally reproject
+    Returns:
+        xr.DataArray: warped data cube
+    """
+    geobox = match_data_array.odc.geobox
+    assert geobox is not None, "Error! Unable to find the grid of the target data cube"
+    data_cube_reprojected = warp_cube(
+        data_cube=data_cube, geobox=geobox, resampling=resampling
+    )
+    # use the coordinates of the target instead of those recomputed from the geobox, so that
+    # both cubes can be aligned without floating point mismatches
     y_dim = data_cube.openeo.y_dim
     x_dim = data_cube.openeo.x_dim
-    data_cube_stacked_reprojected = data_cube_stacked.transpose(
-        "__unified_non_spatial_dimension__", y_dim, x_dim
-    ).rio.reproject_match(
-        match_data_array=match_data_array,
-        resampling=resampling,
-    )
-
-    # In theory we would simply call `.unstack` to bring things back to the original form.
-    # However, there seems to be a bug in rioxarray that multiindexes become indexes.
-    # So we simply re-assign the old index since we did not touch it in the first place.
-    data_cube_stacked_reprojected = data_cube_stacked_reprojected.assign_coords(
+    data_cube_reprojected = data_cube_reprojected.assign_coords(
         {
-            "__unified_non_spatial_dimension__": data_cube_stacked.indexes[
-                "__unified_non_spatial_dimension__"
-            ]
+            y_dim: match_data_array[match_data_array.openeo.y_dim].values,
+            x_dim: match_data_array[match_data_array.openeo.x_dim].values,
         }
     )
-    # Now we can unstack
-    data_cube_stacked_reprojected = data_cube_stacked_reprojected.unstack(
-        "__unified_non_spatial_dimension__"
-    )
-    # And we bring the dimensions back to the original order
-    data_cube_stacked_reprojected = data_cube_stacked_reprojected.transpose(
-        *data_cube.dims
-    )
 
-    return data_cube_stacked_reprojected  # type: ignore[no-any-return]
+    return data_cube_reprojected
 
 
 def resample_spatial(
@@ -1166,8 +1168,10 @@ def run_udf(
     runtime: str,
     version: Optional[str] = None,
     context: Any = {},
-) -> UdfData:
-    """run an user-defined function
+) -> RasterCube:
+    """run an user-defined function. The function f(data, context) is applied to each chunk of
+    the raster cube, so it must return an array with the shape of its input, e.g., it cannot
+    reduce dimensions (see udf_runtime.run_udf)
 
     Args:
         data (RasterCube): raster cube
@@ -1175,26 +1179,25 @@ def run_udf(
         runtime (str): e.g., python
         version (Optional[str], optional): _description_. Defaults to None.
 
+    Raises:
+        ProcessParameterInvalidException: if the UDF does not define a function or changes the
+            shape of its input
+
     Returns:
-        UdfData: _description_
+        RasterCube: raster cube with the same dimensions and coordinates as data
     """
     logger.debug(
         f"processes::run_udf {udf=}\n{data=}\n{runtime=}\n{version=}\n{context=}"
     )
-    # find function name - assumption: there is a def so it is not a lambda function
-    def_str = "def "
-    def_index = udf.find(def_str)
-    parenthesis_index = udf.find("(", def_index)
-    func_name = udf[def_index + len(def_str) : parenthesis_index]
-    logger.debug(f"name of the function that will be executed: {func_name}")
-    # TODO sanitize the udf before using it
-    exec(udf, globals())
-    f = globals()[func_name]
     # for some reason, when context is an emptdy dict it raises an exception. So I assign it to None
     if len(context) == 0:
         context = None
-    new_data = xr.apply_ufunc(f, data, context, dask="allowed")
-    return new_data
+    try:
+        return udf_runtime.run_udf(data=data, source=udf, context=context)
+    except ValueError as e:
+        raise ProcessParameterInvalidException(
+            parameter="udf", process="run_udf", reason=str(e)
+        )
 
 
 def aggregate_temporal_period(
@@ -1238,12 +1241,33 @@ def aggregate_temporal_period(
             f"The provided period '{period})' is not implemented yet. The available ones are {list(periods_to_frequency.keys())}."
         )
 
-    resampled_data = data.resample({applicable_temporal_dimension: frequency})
+    def group_by(d: xr.DataArray):
+        return d.resample({applicable_temporal_dimension: frequency})
+
+    resampled_data = None
+    # common reducers are computed by the grouped reduction engine (flox)
+    reducer_name = grouped_reduction.get_reducer_name(reducer=reducer)
+    if reducer_name is not None:
+        time_index = data.indexes[applicable_temporal_dimension]
+        codes = (
+            pd.Series(np.arange(len(time_index)), index=time_index)
+            .groupby(pd.Grouper(freq=frequency))
+            .ngroup()
+            .to_numpy()
+        )
+        resampled_data = grouped_reduction.reduce_groups(
+            data=data,
+            dim=applicable_temporal_dimension,
+            codes=codes,
+            group_by=group_by,
+            reducer_name=reducer_name,
+        )
 
-    positional_parameters = {"data": 0}
-    resampled_data = resampled_data.reduce(
-        reducer, keep_attrs=True, positional_parameters=positional_parameters
-    )
+    if resampled_data is None:
+        positional_parameters = {"data": 0}
+        resampled_data = group_by(data).reduce(
+            reducer, keep_attrs=True, positional_parameters=positional_parameters
+        )
 
     resampled_data = resampled_data.dropna(dim=applicable_temporal_dimension, how="all")
 
@@ -5,7 +5,6 @@ from openeo_driver.ProcessGraphDeserializer import ConcreteProcessing
 from openeo_driver.dry_run import SourceConstraint
 from tensorlakehouse_openeo_driver.save_result import GeoDNImageCollectionResult
 from openeo_driver.utils import EvalEnv
-from openeo_pg_parser_networkx import OpenEOProcessGraph
 from openeo_pg_parser_networkx import ProcessRegistry, Process
 from tensorlakehouse_openeo_driver.geodn_process_registry import (
     TensorLakehouseProcessRegistry,
@@ -19,6 +18,7 @@ from tensorlakehouse_openeo_driver.get_openeo_process_implementations import (
     get_openeo_impls,
 )
 from tensorlakehouse_openeo_driver.get_process_implementations import get_impls
+from tensorlakehouse_openeo_driver.util.callback_compiler import CompilingProcessGraph
 from openeo_processes_dask.process_implementations import _max, _min
 from openeo_processes_dask.specs import _max as max_spec, _min as min_spec
 from openeo_processes_dask.process_implementations.core import process
@@ -42,7 +42,12 @@ class TensorlakehouseProcessing(ConcreteProcessing):
         openeo_process_specs = (
             Path() / "tensorlakehouse_openeo_driver" / "process_specifications"
         )
-        for proc_name in ["rename_dimension", "rename_labels", "run_udf"]:
+        for proc_name in [
+            "rename_dimension",
+            "rename_labels",
+            "run_udf",
+            "load_result",
+        ]:
             proc_path = openeo_process_specs / f"{proc_name}.json"
 
             assert proc_path.exists()
@@ -113,7 +118,7 @@ class TensorlakehouseProcessing(ConcreteProcessing):
         return self.process_registry
 
     def evaluate(self, process_graph: dict, env: EvalEnv = None):
-        parsed_graph = OpenEOProcessGraph(pg_data=process_graph)
+        parsed_graph = CompilingProcessGraph(pg_data=process_graph)
 
         # get process graph
         pg_callable = parsed_graph.to_callable(process_registry=self.process_registry)
@@ -1,32 +1,63 @@
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+import json
+import shutil
 from numbers import Number
 from pathlib import Path
-import uuid
+import dask
 import dask_geopandas
 import geopandas
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from rasterio.io import MemoryFile
 from openeo_driver.save_result import ImageCollectionResult
 import xarray as xr
-from typing import Optional
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
 from tensorlakehouse_openeo_driver.driver_data_cube import TensorLakehouseDataCube
+from tensorlakehouse_openeo_driver.util.reference_index import get_storage_options
 from tensorlakehouse_openeo_driver.constants import (
+    COG_BLOCKSIZE,
+    COG_COMPRESSION,
+    COG_MAX_WORKERS,
     DEFAULT_BANDS_DIMENSION,
+    EPSG_4326,
     FILE_DATETIME_FORMAT,
+    GEOJSON,
+    GEOPARQUET_VERSION,
     GEOTIFF_PREFIX,
     GTIFF,
     NETCDF,
+    NETCDF_COMPRESSION,
+    NETCDF_COMPRESSION_LEVEL,
+    OUTPUT_BUCKET_NAME,
     DEFAULT_TIME_DIMENSION,
     PARQUET,
+    ZARR,
 )
 import logging
 import logging.config
 import zipfile
-import os
 
 logging.config.fileConfig(fname="logging.conf", disable_existing_loggers=False)
 logger = logging.getLogger("geodnLogger")
 
 
+def get_result_store_url(job_id: str) -> str:
+    """link to the zarr store that holds the result of a batch job, which is written directly
+    to the output bucket and opened lazily by clients and by load_result
+
+    Args:
+        job_id (str): job ID
+
+    Returns:
+        str: link to the store, e.g., s3://bucket/job-id.zarr
+    """
+    return f"s3://{OUTPUT_BUCKET_NAME}/{job_id}.zarr"
+
+
 class GeoDNImageCollectionResult(ImageCollectionResult):
     def __init__(
         self,
@@ -60,87 +91,238 @@ class GeoDNImageCollectionResult(ImageCollectionResult):
 
         if PARQUET == self.format.upper():
             if isinstance(self.cube.data, (dask_geopandas.GeoDataFrame)):
-                try:
-                    data: dask_geopandas.GeoDataFrame = self.cube.data.compute()
-                    data.to_parquet(filename)
-                except FileExistsError as e:
-                    raise e
+                self._save_as_parquet(filename=filename)
             elif isinstance(self.cube.data, (geopandas.GeoDataFrame)):
                 self.cube.data.to_parquet(filename)
             else:
                 data_type = type(self.cube.data)
                 raise ValueError(f"Error! Unexpected data format: {data_type}")
+        elif GEOJSON == self.format.upper():
+            self._save_as_geojson(filename=filename)
         elif GTIFF == self.format.upper():
             return self._save_as_geotiff(filename=filename)
         elif NETCDF == self.format.upper():
-            array = self.cube.data
-
-            assert isinstance(
-                array, xr.DataArray
-            ), f"Error! Not a xr.DataArray: {type(self.cube.data)}"
-            try:
-                logger.debug(f"Storing xarray as netcdf file called {filename}")
-
-                # explicitly convert from DataArray to Dataset because xarray would do it anyway
-                dimensions = array.dims
-                assert all(
-                    isinstance(d, str) for d in dimensions
-                ), f"Error! Unexpected dimension name: {dimensions=}"
-                if DEFAULT_BANDS_DIMENSION in dimensions:
-                    ds = array.to_dataset(dim=DEFAULT_BANDS_DIMENSION)
-                else:
-                    ds = array.to_dataset(name="variable")
-                logger.debug(f"DataSet dimensions {dimensions}")
-                # convert attributes of the xarray.Dataset
-                valid_types = (str, Number, np.ndarray, np.number, list, tuple)
-                for attr_key, attr_value in ds.attrs.items():
-                    if not isinstance(attr_value, valid_types) or isinstance(
-                        attr_value, bool
-                    ):
-                        logger.debug(f"Invalid attr: {attr_key}")
-                        ds.attrs[attr_key] = str(attr_value)
-                # convert attributes of the variables
-                for variable in list(ds):
-                    for attr_key, attr_value in ds[variable].attrs.items():
-                        if not isinstance(attr_value, valid_types) or isinstance(
-                            attr_value, bool
-                        ):
-                            logger.debug(f"Invalid attr: {attr_key}")
-                            ds[variable].attrs[attr_key] = str(attr_value)
-                assert ds.rio.crs is not None
-                # ds = ds.compute()
-                ds.to_netcdf(path=filename, engine="netcdf4")  # type: ignore[call-overload]
-            except TypeError as e:
-                logger.error(
-                    f"TypeError: Invalid attr. Exception handling: trying to convert invalid attrs to str: {e}"
-                )
-                valid_types = (str, Number, np.ndarray, np.number, list, tuple)
-                # convert attributes of the xarray.Dataset
-                for attr_key, attr_value in ds.attrs.items():
-                    if not isinstance(attr_value, valid_types) or isinstance(
-                        attr_value, bool
-                    ):
-                        logger.debug(f"Invalid attr: {attr_key}")
-                        ds.attrs[attr_key] = str(attr_value)
-                # convert attributes of the variables
-                for variable in list(ds):
-                    for attr_key, attr_value in ds[variable].attrs.items():
-                        if not isinstance(attr_value, valid_types) or isinstance(
-                            attr_value, bool
-                        ):
-                            logger.debug(f"Invalid attr: {attr_key}")
-                            ds[variable].attrs[attr_key] = str(attr_value)
-
-                ds.to_netcdf(path=filename, engine="netcdf4")  # type: ignore[call-overload]
-            except Exception as e:
-                logger.error(e)
-                raise e
-
+            self._save_as_netcdf(filename=filename)
+        elif ZARR == self.format.upper():
+            self._save_as_zarr(filename=filename)
         else:
             raise NotImplementedError(f"Support for {format} is not implemented")
         logger.debug(f"save_result process: {filename=}")
         return filename
 
+    def _to_dataset(self) -> xr.Dataset:
+        """convert the raster cube to a Dataset with one variable per band and attributes that
+        can be stored in a NetCDF file"""
+        array = self.cube.data
+        assert isinstance(
+            array, xr.DataArray
+        ), f"Error! Not a xr.DataArray: {type(self.cube.data)}"
+        # explicitly convert from DataArray to Dataset because xarray would do it anyway
+        dimensions = array.dims
+        assert all(
+            isinstance(d, str) for d in dimensions
+        ), f"Error! Unexpected dimension name: {dimensions=}"
+        if DEFAULT_BANDS_DIMENSION in dimensions:
+            ds = array.to_dataset(dim=DEFAULT_BANDS_DIMENSION)
+        else:
+            ds = array.to_dataset(name="variable")
+        logger.debug(f"DataSet dimensions {dimensions}")
+        ds.attrs = _to_netcdf_attrs(ds.attrs)
+        for name in list(ds.variables):
+            ds[name].attrs = _to_netcdf_attrs(ds[name].attrs)
+        return ds
+
+    def _get_netcdf_encoding(self, ds: xr.Dataset) -> Dict[str, Dict[str, Any]]:
+        """compression and chunking of each variable. The options compression (zlib, zstd or
+        None), compression_level and chunks (size per dimension) override the defaults. By
+        default, NetCDF chunks match the dask chunks, so that each task writes whole chunks
+
+        Args:
+            ds (xr.Dataset): dataset
+
+        Returns:
+            Dict[str, Dict[str, Any]]: encoding per variable
+        """
+        options = self.options or dict()
+        compression = options.get("compression", NETCDF_COMPRESSION)
+        level = int(options.get("compression_level", NETCDF_COMPRESSION_LEVEL))
+        chunks = options.get("chunks") or dict()
+        encoding: Dict[str, Dict[str, Any]] = dict()
+        for name, variable in ds.data_vars.items():
+            if variable.dtype.kind not in "biuf" or variable.ndim == 0:
+                continue
+            variable_encoding: Dict[str, Any] = dict()
+            if compression is not None:
+                variable_encoding.update(
+                    {"compression": compression, "complevel": level, "shuffle": True}
+                )
+            if 0 not in variable.shape and (
+                variable.chunks is not None or len(chunks) > 0
+            ):
+                chunksizes = list()
+                for dim, size in variable.sizes.items():
+                    if dim in chunks:
+                        chunksize = int(chunks[dim])
+                    elif variable.chunks is not None:
+                        chunksize = max(variable.chunksizes[dim])
+                    else:
+                        chunksize = size
+                    chunksizes.append(min(chunksize, size))
+                variable_encoding["chunksizes"] = tuple(chunksizes)
+            encoding[str(name)] = variable_encoding
+        return encoding
+
+    def _save_as_netcdf(self, filename: str) -> str:
+        """write the raster cube to a NetCDF file. Dask arrays are not gathered by this process:
+        each task writes its chunk under the lock that xarray picks for the active scheduler,
+        e.g., a distributed lock on a dask cluster
+
+        Args:
+            filename (str): full path to the file
+
+        Returns:
+            str: full path to the file
+        """
+        ds = self._to_dataset()
+        assert ds.rio.crs is not None
+        encoding = self._get_netcdf_encoding(ds=ds)
+        logger.debug(f"Storing xarray as netcdf file called {filename} {encoding=}")
+        write = ds.to_netcdf(  # type: ignore[call-overload]
+            path=filename, engine="netcdf4", encoding=encoding, compute=False
+        )
+        write.compute()
+        return filename
+
+    @property
+    def zipped(self) -> bool:
+        """zarr stores are zipped unless the option zipped is False"""
+        return bool((self.options or dict()).get("zipped", True))
+
+    def _save_as_zarr(self, filename: str) -> str:
+        """write the raster cube to a zarr store with consolidated metadata. Each dask task
+        writes its chunks directly to the store, so that chunks are written in parallel. The
+        store is a directory if the option zipped is False, which might be on object storage,
+        e.g., s3://bucket/result.zarr. Otherwise, it is a local zip file, which is created
+        after all chunks have been written, because a zip file cannot be written in parallel
+
+        Args:
+            filename (str): full path or link to the store
+
+        Raises:
+            ValueError: if a zipped store is not a local file
+
+        Returns:
+            str: full path or link to the store
+        """
+        is_local = urlparse(filename).scheme == ""
+        if self.zipped and not is_local:
+            raise ValueError(
+                f"Error! Zipped zarr stores must be local files: {filename}"
+            )
+        ds = self._to_dataset()
+        options = self.options or dict()
+        chunks = options.get("chunks") or dict()
+        for name in ds.variables:
+            # encoding of the source (e.g., netcdf chunk sizes) might conflict with zarr chunks
+            ds[name].encoding = dict()
+        # zarr chunks have the same size, except the last one along each dimension
+        regular_chunks: Dict[str, Any] = dict(chunks)
+        for dim, sizes in ds.chunksizes.items():
+            if str(dim) in regular_chunks:
+                continue
+            if len(set(sizes[:-1])) > 1 or sizes[-1] > sizes[0]:
+                regular_chunks[str(dim)] = max(sizes)
+        if len(regular_chunks) > 0:
+            ds = ds.chunk(regular_chunks)
+        store = filename if not self.zipped else f"{filename}.tmp"
+        storage_options = None if is_local else get_storage_options(url=filename)
+        logger.debug(f"Storing xarray as zarr store {store} {regular_chunks=}")
+        write = ds.to_zarr(
+            store,
+            mode="w",
+            consolidated=True,
+            compute=False,
+            storage_options=storage_options,
+        )
+        write.compute()
+        if self.zipped:
+            # chunks are compressed already
+            with zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED) as zipf:
+                for path in sorted(Path(store).rglob("*")):
+                    if path.is_file():
+                        zipf.write(path, arcname=path.relative_to(store).as_posix())
+            shutil.rmtree(store)
+        return filename
+
+    def _iter_partitions(self) -> Iterator[geopandas.GeoDataFrame]:
+        """compute the partitions of the vector cube one at a time, so that only one of them is
+        in memory
+
+        Yields:
+            Iterator[geopandas.GeoDataFrame]: partition
+        """
+        data = self.cube.data
+        if isinstance(data, geopandas.GeoDataFrame):
+            yield data
+            return
+        assert isinstance(
+            data, dask_geopandas.GeoDataFrame
+        ), f"Error! Unexpected data format: {type(data)}"
+        for index in range(data.npartitions):
+            yield data.get_partition(index).compute()
+
+    def _save_as_parquet(self, filename: str) -> str:
+        """stream a lazy vector cube to a single GeoParquet file, one row group per partition
+
+        Args:
+            filename (str): full path to the file
+
+        Returns:
+            str: full path to the file
+        """
+        writer: Optional[pq.ParquetWriter] = None
+        num_rows = 0
+        try:
+            for partition in self._iter_partitions():
+                table = _to_geoparquet_table(data=partition)
+                if writer is None:
+                    writer = pq.ParquetWriter(filename, schema=table.schema)
+                writer.write_table(table.cast(writer.schema))
+                num_rows += len(partition)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            # no partitions, write the (empty) schema
+            self.cube.data._meta.to_parquet(filename)
+        logger.debug(f"Stored {num_rows} rows as parquet file called {filename}")
+        return filename
+
+    def _save_as_geojson(self, filename: str) -> str:
+        """stream a vector cube to a GeoJSON FeatureCollection partition by partition. GeoJSON
+        coordinates are WGS84, so each partition is reprojected if needed
+
+        Args:
+            filename (str): full path to the file
+
+        Returns:
+            str: full path to the file
+        """
+        num_rows = 0
+        with open(filename, "w") as f:
+            f.write('{"type": "FeatureCollection", "features": [')
+            for partition in self._iter_partitions():
+                if partition.crs is not None and not partition.crs.equals(EPSG_4326):
+                    partition = partition.to_crs(EPSG_4326)
+                for feature in partition.iterfeatures(drop_id=True):
+                    if num_rows > 0:
+                        f.write(", ")
+                    json.dump(feature, f, default=_to_json_value)
+                    num_rows += 1
+            f.write("]}")
+        logger.debug(f"Stored {num_rows} features as geojson file called {filename}")
+        return filename
+
     def _save_as_geotiff(self, filename: str) -> str:
         """save files as geotiff
 
@@ -170,41 +352,145 @@ class GeoDNImageCollectionResult(ImageCollectionResult):
 
         # Note: The rio.to_raster() method only works on a 2-dimensional
         # or 3-dimensional xarray.DataArray or a 2-dimensional xarray.Dataset.
-        if time_size == 1:
-            # destroy time dimension
-            data = data.isel({time_dim: 0})
+        if time_size <= 1:
+            if time_size == 1:
+                # destroy time dimension
+                data = data.isel({time_dim: 0})
             data.rio.to_raster(
                 filename,
                 driver=driver,  # Write driver
                 reading_driver=driver,  # Read driver
+                compress=COG_COMPRESSION,
+                blocksize=COG_BLOCKSIZE,
             )
         else:
-            path = Path(filename)
-            parent_dir = path.parent
             # save as zip instead of tif
             filename = filename.replace(".gtiff", ".zip")
             self.format = "ZIP"
-            geotiff_files = list()
-            time_list = list(data[time_dim].values)
-            for index in range(0, time_size):
-                t: np.datetime64
-                t = time_list[index]
-                timestamp = pd.Timestamp(t)
-                timestamp_str = timestamp.strftime(FILE_DATETIME_FORMAT)
-                unique_id = uuid.uuid4().hex
-                output_filename = (
-                    parent_dir / f"{GEOTIFF_PREFIX}_{timestamp_str}_{unique_id}.tif"
-                )
+            tasks = dict()
+            for index, t in enumerate(data[time_dim].values):
+                timestamp_str = pd.Timestamp(t).strftime(FILE_DATETIME_FORMAT)
+                name = f"{GEOTIFF_PREFIX}_{timestamp_str}.tif"
+                # timestamps that differ by less than a second have the same name
+                count = 1
+                while name in tasks:
+                    name = f"{GEOTIFF_PREFIX}_{timestamp_str}_{count}.tif"
+                    count += 1
                 slice_array = data.isel({time_dim: index})
-                if not np.isnan(slice_array.data).all():
-                    slice_array.rio.to_raster(output_filename)
-                    geotiff_files.append(output_filename)
-            # Create a zip file and add GeoTIFF files to it
+                tasks[name] = dask.delayed(_encode_cog)(slice_array)
+            # add the GeoTIFF files to the zip file as soon as they are encoded
+            num_files = 0
             with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as zipf:
-                for geotiff_file in geotiff_files:
-                    zipf.write(geotiff_file)
-            # Remove the temporary GeoTIFF files
-            for geotiff_file in geotiff_files:
-                os.remove(geotiff_file)
+                for name, content in _as_completed(tasks):
+                    if content is not None:
+                        zipf.writestr(name, content)
+                        num_files += 1
+            logger.debug(
+                f"Stored {num_files} of {time_size} time slices in zip file {filename}"
+            )
 
         return filename
+
+
+def _encode_cog(slice_array: xr.DataArray) -> Optional[bytes]:
+    """encode a time slice, which has been computed by dask, as a COG in memory
+
+    Args:
+        slice_array (xr.DataArray): data cube without time dimension
+
+    Returns:
+        Optional[bytes]: content of the GeoTIFF file or None if all values are nodata
+    """
+    if np.isnan(slice_array.values).all():
+        return None
+    with MemoryFile() as memfile:
+        slice_array.rio.to_raster(
+            memfile.name,
+            driver="COG",
+            compress=COG_COMPRESSION,
+            blocksize=COG_BLOCKSIZE,
+        )
+        content: bytes = memfile.read()
+        return content
+
+
+def _as_completed(tasks: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+    """compute delayed tasks in parallel and yield their results in the order they finish. The
+    tasks run on the cluster if a distributed client is active and on at most COG_MAX_WORKERS
+    local threads otherwise
+
+    Args:
+        tasks (Dict[str, Any]): delayed tasks by name
+
+    Yields:
+        Iterator[Tuple[str, Any]]: name and result of each task
+    """
+    try:
+        from distributed import as_completed, default_client
+
+        client = default_client()
+    except (ImportError, ValueError):
+        client = None
+    if client is not None:
+        futures = client.compute(list(tasks.values()))
+        names = {future.key: name for future, name in zip(futures, tasks)}
+        for future, result in as_completed(futures, with_results=True):
+            yield names[future.key], result
+            # release the result on the cluster
+            future.release()
+        return
+    with ThreadPoolExecutor(max_workers=COG_MAX_WORKERS) as executor:
+        local_futures = {
+            executor.submit(task.compute): name for name, task in tasks.items()
+        }
+        for local_future in concurrent.futures.as_completed(local_futures):
+            yield local_futures[local_future], local_future.result()
+
+
+def _to_netcdf_attrs(attrs: Dict[str, Any]) -> Dict[str, Any]:
+    """convert attribute values that NetCDF does not support, e.g., booleans and dicts, to str"""
+    valid_types = (str, Number, np.ndarray, np.number, list, tuple)
+    converted = dict()
+    for attr_key, attr_value in attrs.items():
+        if not isinstance(attr_value, valid_types) or isinstance(attr_value, bool):
+            logger.debug(f"Invalid attr: {attr_key}")
+            attr_value = str(attr_value)
+        converted[attr_key] = attr_value
+    return converted
+
+
+def _to_json_value(value: Any) -> Any:
+    """convert values that the json module does not support, e.g., timestamps and numpy scalars"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    return str(value)
+
+
+def _to_geoparquet_table(data: geopandas.GeoDataFrame) -> pa.Table:
+    """convert a partition of a vector cube to an Arrow table with WKB geometries and GeoParquet
+    metadata. The metadata does not have the bbox and geometry types, because the schema of the
+    file is set by the first partition
+
+    Args:
+        data (geopandas.GeoDataFrame): partition
+
+    Returns:
+        pa.Table: table
+    """
+    geometry_column = data.geometry.name
+    table = pa.Table.from_pandas(data.to_wkb(), preserve_index=False)
+    geo = {
+        "version": GEOPARQUET_VERSION,
+        "primary_column": geometry_column,
+        "columns": {
+            geometry_column: {
+                "encoding": "WKB",
+                "geometry_types": [],
+                "crs": data.crs.to_json_dict() if data.crs is not None else None,
+            }
+        },
+    }
+    metadata = {**(table.schema.metadata or dict()), b"geo": json.dumps(geo).encode()}
+    return table.replace_schema_metadata(metadata)
@@ -1,4 +1,4 @@
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import planetary_computer
 from tensorlakehouse_openeo_driver.model.item import Item, make_item
@@ -126,6 +126,44 @@ class STAC:
         assert isinstance(item, dict)
         return item
 
+    def iter_items(
+        self, collection_id: str, limit: Optional[int] = None, page_size: int = 100
+    ) -> Iterator[Dict[str, Any]]:
+        """iterate over the items of the collection, following the "next" links of the pages
+
+        Args:
+            collection_id (str): collection ID
+            limit (Optional[int], optional): max number of items. Defaults to None, i.e., all
+                items.
+            page_size (int, optional): number of items per request. Defaults to 100.
+
+        Yields:
+            Iterator[Dict[str, Any]]: items as dicts
+        """
+        url: Optional[str] = f"{self._url}/collections/{collection_id}/items/"
+        params: Optional[Dict[str, Any]] = {"limit": page_size}
+        counter = 0
+        while url is not None:
+            resp = rest.get(url=url, params=params, headers=self.headers)
+            page = resp.json()
+            assert isinstance(page, dict)
+            features = page.get("features", [])
+            if len(features) == 0:
+                return
+            for item in features:
+                if limit is not None and counter >= limit:
+                    return
+                counter += 1
+                yield item
+            if limit is not None and counter >= limit:
+                return
+            next_links = [
+                link for link in page.get("links", []) if link.get("rel") == "next"
+            ]
+            # the link of the next page already contains the query parameters
+            url = next_links[0]["href"] if len(next_links) > 0 else None
+            params = None
+
     def list_collections(self):
         resp = rest.get(url=f"{self._url}/collections", headers=self.headers)
         return resp.json()
@@ -259,6 +297,12 @@ class STAC:
 
         return (start, end)
 
+    def update_item(self, item: Dict[str, Any], collection_id: str):
+        item_id = item["id"]
+        url = f"{self._url}/collections/{collection_id}/items/{item_id}"
+        rest.put(url=url, headers=self.headers, payload=item)
+        logger.debug(f"Updated item: {item_id}")
+
     def delete_item(self, item_id: str, collection_id: str):
         url = f"{self._url}/collections/{collection_id}/items/{item_id}"
         rest.delete(url=url, headers=self.headers)
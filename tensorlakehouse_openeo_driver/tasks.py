@@ -1,14 +1,17 @@
 import os
 from pathlib import Path
-from openeo_pg_parser_networkx import OpenEOProcessGraph
 from typing import Any, Dict
 from celery import Celery
 from celery import states
 from tensorlakehouse_openeo_driver.constants import (
+    GEOJSON,
     GTIFF,
     NETCDF,
+    OUTPUT_BUCKET_NAME,
     PARQUET,
     TENSORLAKEHOUSE_OPENEO_DRIVER_DATA_DIR,
+    ZARR,
+    ZARR_MEDIA_TYPE,
     logger,
 )
 from shapely.geometry.polygon import Polygon
@@ -18,13 +21,16 @@ from tensorlakehouse_openeo_driver.file_reader.cos_parser import COSConnector
 import pandas as pd
 
 from tensorlakehouse_openeo_driver.processing import TensorlakehouseProcessing
-from tensorlakehouse_openeo_driver.save_result import GeoDNImageCollectionResult
+from tensorlakehouse_openeo_driver.save_result import (
+    GeoDNImageCollectionResult,
+    get_result_store_url,
+)
+from tensorlakehouse_openeo_driver.util import prefetch
+from tensorlakehouse_openeo_driver.util.callback_compiler import CompilingProcessGraph
 
 app = Celery("tasks")
 
 app.config_from_object("tensorlakehouse_openeo_driver.celeryconfig")
-# TODO replace this by environment variable
-OUTPUT_BUCKET_NAME = "openeo-geodn-driver-output"
 
 
 @app.task(bind=True)
@@ -72,10 +78,8 @@ def create_batch_jobs(
     )
     # parse process graph
     processing = TensorlakehouseProcessing()
-    parsed_graph = OpenEOProcessGraph(pg_data=process)
+    parsed_graph = CompilingProcessGraph(pg_data=process)
     pg_callable = parsed_graph.to_callable(process_registry=processing.process_registry)
-    # execute the process graph, i.e., traverse all nodes and execute each one of them
-    datacube = pg_callable()
     # store result into COS
     media_type = metadata["media_type"]
     assert media_type is not None, f"Error! invalid media type = {media_type}"
@@ -86,6 +90,11 @@ def create_batch_jobs(
         extension = "tif"
     elif media_type.upper() == PARQUET:
         extension = "parquet"
+    elif media_type.upper() == GEOJSON:
+        extension = "geojson"
+    elif media_type.upper() == ZARR:
+        # zarr store on the output bucket or, if the option zipped is True, zip file
+        extension = "zarr.zip"
     else:
         raise ValueError(
             f"Error! Media type {media_type} is not supported! (tasks::create_batch_jobs)"
@@ -93,9 +102,25 @@ def create_batch_jobs(
     # set filename
     now = pd.Timestamp.now().strftime("%Y%m%dT%H%M%S")
     path = str(TENSORLAKEHOUSE_OPENEO_DRIVER_DATA_DIR / f"{now}-{job_id}.{extension}")
-    assert isinstance(datacube, GeoDNImageCollectionResult)
-    # save file locally
-    datacube.save_result(filename=path)
+    # the readahead of the job is cancelled once the (lazy) result is saved or the job is revoked
+    with prefetch.job_context(job_id=job_id):
+        # execute the process graph, i.e., traverse all nodes and execute each one of them
+        datacube = pg_callable()
+        assert isinstance(datacube, GeoDNImageCollectionResult)
+        options = datacube.options or dict()
+        if media_type.upper() == ZARR and not options.get("zipped", False):
+            # unless a zip file is requested, the chunks are written in parallel to a zarr
+            # store on the output bucket, which clients and load_result open lazily
+            datacube.options = dict(options, zipped=False)
+            store_url = get_result_store_url(job_id=job_id)
+            datacube.save_result(filename=store_url)
+            metadata["filename"] = store_url.split("/")[-1]
+            metadata["href"] = store_url
+            metadata["media_type"] = ZARR_MEDIA_TYPE
+            logger.debug(f"{job_id=} has been successfully finished: {metadata=}")
+            return metadata
+        # save file locally
+        datacube.save_result(filename=path)
     filename = path.split("/")[-1]
     metadata["filename"] = filename  # required by get_result_assets
     # upload file to COS
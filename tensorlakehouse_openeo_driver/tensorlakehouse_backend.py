@@ -40,6 +40,7 @@ from openeo_driver.save_result import (
 )
 from openeo_driver.users import User
 from openeo_driver.utils import EvalEnv
+from openeo_pg_parser_networkx.pg_schema import BoundingBox, TemporalInterval
 from tensorlakehouse_openeo_driver.batch_jobs import TensorLakeHouseBatchJobs
 from tensorlakehouse_openeo_driver.catalog import TensorLakehouseCollectionCatalog
 from tensorlakehouse_openeo_driver.config.geodn_config import (
@@ -50,6 +51,7 @@ from tensorlakehouse_openeo_driver.constants import (
     OPENEO_AUTH_CLIENT_SECRET,
     APPID_ISSUER,
 )
+from tensorlakehouse_openeo_driver import processes
 from tensorlakehouse_openeo_driver.processing import TensorlakehouseProcessing
 from tensorlakehouse_openeo_driver.driver_data_cube import TensorLakehouseDataCube
 
@@ -514,11 +516,21 @@ class TensorLakeHouseBackendImplementation(OpenEoBackendImplementation):
                     "gis_data_types": ["raster"],
                     "parameters": {},
                 },
+                "ZARR": {
+                    "title": "Zarr",
+                    "gis_data_types": ["raster"],
+                    "parameters": {},
+                },
                 "PARQUET": {
                     "title": "Parquet",
                     "gis_data_types": ["vector"],
                     "parameters": {},
                 },
+                "GeoJSON": {
+                    "title": "GeoJSON",
+                    "gis_data_types": ["vector"],
+                    "parameters": {},
+                },
             },
         }
 
@@ -539,9 +551,24 @@ class TensorLakeHouseBackendImplementation(OpenEoBackendImplementation):
         user_id: Optional[str],
         load_params: LoadParameters,
         env: EvalEnv,
-    ) -> DummyDataCube:
-        _register_load_collection_call(job_id, load_params)
-        return DummyDataCube()
+    ) -> TensorLakehouseDataCube:
+        """open the zarr store of the result of the batch job lazily (see processes.load_result)"""
+        if user_id is not None:
+            # raises JobNotFoundException if the job does not belong to the user
+            self.batch_jobs.get_job_info(job_id=job_id, user_id=user_id)
+        spatial_extent = None
+        if load_params.spatial_extent:
+            spatial_extent = BoundingBox(**load_params.spatial_extent)
+        temporal_extent = None
+        if any(t is not None for t in load_params.temporal_extent):
+            temporal_extent = TemporalInterval(list(load_params.temporal_extent))
+        data = processes.load_result(
+            id=job_id,
+            spatial_extent=spatial_extent,
+            temporal_extent=temporal_extent,
+            bands=load_params.bands,
+        )
+        return TensorLakehouseDataCube(data=data)
 
     def visit_process_graph(self, process_graph: dict) -> ProcessGraphVisitor:
         return DummyVisitor().accept_process_graph(process_graph)
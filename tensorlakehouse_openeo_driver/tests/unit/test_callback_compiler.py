@@ -0,0 +1,212 @@
+import inspect
+
+import numpy as np
+import pytest
+import xarray as xr
+from openeo_pg_parser_networkx import OpenEOProcessGraph
+
+from tensorlakehouse_openeo_driver.processing import TensorlakehouseProcessing
+from tensorlakehouse_openeo_driver.util import grouped_reduction
+from tensorlakehouse_openeo_driver.util.callback_compiler import (
+    CompiledCallback,
+    CompilingProcessGraph,
+)
+
+DATA = {"from_parameter": "data"}
+X = {"from_parameter": "x"}
+NDVI = {
+    "red": {
+        "process_id": "array_element",
+        "arguments": {"data": DATA, "label": "B04"},
+    },
+    "nir": {
+        "process_id": "array_element",
+        "arguments": {"data": DATA, "index": 1},
+    },
+    "ndvi": {
+        "process_id": "normalized_difference",
+        "arguments": {"x": {"from_node": "nir"}, "y": {"from_node": "red"}},
+        "result": True,
+    },
+}
+
+
+def _make_cube() -> xr.DataArray:
+    np.random.seed(2)
+    data = np.random.rand(3, 4, 20, 30)
+    data[0, 1, :4, :4] = np.nan
+    return xr.DataArray(
+        data,
+        dims=["bands", "t", "y", "x"],
+        coords={"bands": ["B04", "B08", "B11"]},
+    )
+
+
+def _callback(process_id: str, argument: str, callback: dict, compile: bool):
+    """build the callable of a callback the way the process graph parser does"""
+    captured = dict()
+    registry = TensorlakehouseProcessing().process_registry
+
+    def implementation(**kwargs):
+        captured["callback"] = kwargs[argument]
+
+    registry[process_id].implementation = implementation
+    process_graph = {
+        "process_graph": {
+            "parent": {
+                "process_id": process_id,
+                "arguments": {"data": 1, argument: {"process_graph": callback}},
+                "result": True,
+            }
+        }
+    }
+    graph_class = CompilingProcessGraph if compile else OpenEOProcessGraph
+    graph_class(pg_data=process_graph).to_callable(process_registry=registry)()
+    return captured["callback"]
+
+
+def _reduce(cube: xr.DataArray, callback: dict, compile: bool) -> xr.DataArray:
+    reducer = _callback("reduce_dimension", "reducer", callback, compile=compile)
+    return cube.reduce(
+        reducer,
+        dim="bands",
+        keep_attrs=True,
+        positional_parameters={"data": 0},
+        named_parameters={"context": None},
+        dim_labels=cube["bands"].values,
+    )
+
+
+def test_parser_calls_hook(monkeypatch):
+    """CompilingProcessGraph overrides a private method of openeo_pg_parser_networkx, so a new
+    version of the parser that renames it or no longer calls it must fail here"""
+    parameters = list(
+        inspect.signature(OpenEOProcessGraph._map_node_to_callable).parameters
+    )
+    assert parameters == [
+        "self",
+        "node",
+        "process_registry",
+        "results_cache",
+        "named_parameters",
+    ], f"Error! The signature of the parser's _map_node_to_callable changed: {parameters}"
+    calls = list()
+    hook = CompilingProcessGraph._map_node_to_callable
+
+    def spy(self, node, *args, **kwargs):
+        calls.append(node)
+        return hook(self, node, *args, **kwargs)
+
+    monkeypatch.setattr(CompilingProcessGraph, "_map_node_to_callable", spy)
+    callback = _callback("reduce_dimension", "reducer", NDVI, compile=True)
+    assert len(calls) > 0, "Error! The parser no longer calls _map_node_to_callable"
+    assert isinstance(callback, CompiledCallback)
+
+
+@pytest.mark.parametrize("chunks", [None, {"t": 1, "y": 10}])
+def test_reduce_dimension(chunks):
+    cube = _make_cube()
+    if chunks is not None:
+        cube = cube.chunk(chunks)
+    assert isinstance(
+        _callback("reduce_dimension", "reducer", NDVI, compile=True), CompiledCallback
+    )
+    expected = _reduce(cube, NDVI, compile=False)
+    result = _reduce(cube, NDVI, compile=True)
+    assert result.dims == expected.dims
+    np.testing.assert_allclose(result.values, expected.values)
+
+
+@pytest.mark.parametrize("reducer", ["mean", "median", "max", "sd"])
+def test_reduce_dimension_reducer(reducer: str):
+    cube = _make_cube().chunk({"t": 2})
+    callback = {
+        "r": {
+            "process_id": reducer,
+            "arguments": {"data": DATA, "ignore_nodata": False},
+            "result": True,
+        }
+    }
+    expected = _reduce(cube, callback, compile=False)
+    result = _reduce(cube, callback, compile=True)
+    np.testing.assert_allclose(result.values, expected.values)
+
+
+def test_apply():
+    cube = _make_cube().chunk({"t": 1})
+    callback = {
+        "scale": {
+            "process_id": "multiply",
+            "arguments": {"x": X, "y": 10000},
+        },
+        "offset": {
+            "process_id": "add",
+            "arguments": {"x": {"from_node": "scale"}, "y": -1000},
+        },
+        "clip": {
+            "process_id": "clip",
+            "arguments": {"x": {"from_node": "offset"}, "min": 0, "max": 5000},
+            "result": True,
+        },
+    }
+    results = list()
+    for compile in [False, True]:
+        process = _callback("apply", "process", callback, compile=compile)
+        results.append(
+            xr.apply_ufunc(
+                process,
+                cube,
+                dask="allowed",
+                kwargs={
+                    "positional_parameters": {"x": 0},
+                    "named_parameters": {"context": None},
+                },
+            )
+        )
+    expected, result = results
+    # a single blockwise layer replaces the layers of the three processes
+    assert len(result.data.dask.layers) < len(expected.data.dask.layers)
+    np.testing.assert_allclose(result.values, expected.values)
+
+
+def test_unsupported_callback():
+    callback = {
+        "r": {
+            "process_id": "first",
+            "arguments": {"data": DATA},
+            "result": True,
+        }
+    }
+    reducer = _callback("reduce_dimension", "reducer", callback, compile=True)
+    assert not isinstance(reducer, CompiledCallback)
+    cube = _make_cube()
+    np.testing.assert_allclose(
+        _reduce(cube, callback, compile=True).values,
+        _reduce(cube, callback, compile=False).values,
+    )
+
+
+def test_missing_label():
+    # the label does not exist, so the interpreted process reports the error
+    callback = {
+        "r": {
+            "process_id": "array_element",
+            "arguments": {"data": DATA, "label": "B99"},
+            "result": True,
+        }
+    }
+    reducer = _callback("reduce_dimension", "reducer", callback, compile=True)
+    assert isinstance(reducer, CompiledCallback)
+    with pytest.raises(Exception):
+        _reduce(_make_cube(), callback, compile=True)
+
+
+def test_get_reducer_name():
+    callback = {
+        "r": {"process_id": "median", "arguments": {"data": DATA}, "result": True}
+    }
+    reducer = _callback("reduce_dimension", "reducer", callback, compile=True)
+    assert isinstance(reducer, CompiledCallback)
+    assert grouped_reduction.get_reducer_name(reducer) == "median"
+    reducer = _callback("reduce_dimension", "reducer", NDVI, compile=True)
+    assert grouped_reduction.get_reducer_name(reducer) is None
@@ -0,0 +1,169 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Tuple
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from tensorlakehouse_openeo_driver.constants import DEFAULT_BANDS_DIMENSION
+from tensorlakehouse_openeo_driver.file_reader.cog_file_reader import COGFileReader
+from tensorlakehouse_openeo_driver.util import object_storage_util
+from pystac import Item
+
+
+def _make_item(
+    item_id: str, dt: str, bands: Tuple[str, ...], root: str = "s3://bucket"
+) -> Item:
+    return Item.from_dict(
+        {
+            "type": "Feature",
+            "stac_version": "1.0.0",
+            "id": item_id,
+            "links": [],
+            "bbox": [10.0, 45.0, 11.0, 46.0],
+            "geometry": None,
+            "properties": {
+                "datetime": dt,
+                "proj:epsg": 4326,
+                "cube:dimensions": {
+                    "x": {
+                        "type": "spatial",
+                        "axis": "x",
+                        "extent": [10.0, 11.0],
+                        "step": 0.01,
+                        "reference_system": 4326,
+                    },
+                    "y": {
+                        "type": "spatial",
+                        "axis": "y",
+                        "extent": [45.0, 46.0],
+                        "step": -0.01,
+                        "reference_system": 4326,
+                    },
+                },
+                "cube:variables": {b: {"type": "data"} for b in bands},
+            },
+            "assets": {
+                b: {"href": f"{root}/{item_id}_{b}.tif", "roles": ["data"]}
+                for b in bands
+            },
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "bbox, resolution, expected_width, expected_height",
+    [
+        ((10.005, 45.005, 10.005, 45.005), 0.01, 1, 1),
+        ((10.0, 45.0, 10.05, 45.02), 0.01, 5, 2),
+        ((500010.0, 10.0, 500040.0, 20.0), 10.0, 3, 1),
+    ],
+)
+def test_count_pixels(
+    bbox: Tuple[float, float, float, float],
+    resolution: float,
+    expected_width: int,
+    expected_height: int,
+):
+    snapped, width, height = COGFileReader._count_pixels(
+        bbox=bbox, resolution=resolution
+    )
+    assert (width, height) == (expected_width, expected_height)
+    left, bottom, right, top = snapped
+    assert left <= bbox[0] and bottom <= bbox[1]
+    assert right >= bbox[2] and top >= bbox[3]
+
+
+def test_load_items_using_windows(monkeypatch):
+    bands = ("B02", "B03")
+    items = [
+        _make_item("tile_a", "2020-01-01T10:00:00Z", bands),
+        _make_item("tile_b", "2020-01-01T10:00:00Z", bands),
+        _make_item("tile_c", "2020-01-02T10:00:00Z", bands),
+    ]
+    monkeypatch.setattr(
+        object_storage_util,
+        "get_credentials_by_bucket",
+        lambda bucket: {"access_key_id": "", "secret_access_key": "", "endpoint": ""},
+    )
+    monkeypatch.setattr(object_storage_util, "parse_region", lambda endpoint: "us-east")
+    reader = COGFileReader(
+        items=items,
+        bands=list(bands),
+        bbox=(10.005, 45.005, 10.005, 45.005),
+        temporal_extent=(datetime(2020, 1, 1), datetime(2020, 1, 3)),
+        properties=None,
+    )
+
+    nodata = -1
+
+    def fake_read_window(href, bounds, width, height):
+        # tile_a has no data, so the pixel of tile_b is selected for the first timestamp
+        if "tile_a" in href:
+            return np.full((height, width), nodata, dtype=np.int16), nodata
+        value = 2 if "B02" in href else 3
+        if "tile_c" in href:
+            value *= 10
+        return np.full((height, width), value, dtype=np.int16), nodata
+
+    monkeypatch.setattr(reader, "_read_window", fake_read_window)
+    assert reader._can_read_windows()
+    arr = reader.load_items()
+    assert arr.sizes[DEFAULT_BANDS_DIMENSION] == len(bands)
+    assert arr.sizes["time"] == 2
+    assert arr.sizes["x"] == 1 and arr.sizes["y"] == 1
+    np.testing.assert_array_equal(
+        arr.sel({DEFAULT_BANDS_DIMENSION: "B02"}).values.ravel(), [2, 20]
+    )
+    np.testing.assert_array_equal(
+        arr.sel({DEFAULT_BANDS_DIMENSION: "B03"}).values.ravel(), [3, 30]
+    )
+
+
+def test_read_window_from_cog(tmp_path: Path, monkeypatch):
+    bands = ("B02", "B03")
+    item = _make_item("tile", "2020-01-01T10:00:00Z", bands, root=str(tmp_path))
+    # 100 x 100 pixels of 0.01 degrees, whose value is their position
+    data = np.arange(100 * 100, dtype=np.int16).reshape(100, 100)
+    for i, band in enumerate(bands):
+        with rasterio.open(
+            tmp_path / f"tile_{band}.tif",
+            mode="w",
+            driver="COG",
+            width=100,
+            height=100,
+            count=1,
+            dtype="int16",
+            crs="EPSG:4326",
+            transform=from_origin(10.0, 46.0, 0.01, 0.01),
+            nodata=-1,
+            blocksize=16,
+        ) as dst:
+            dst.write(data + i, 1)
+    monkeypatch.setattr(
+        object_storage_util,
+        "get_credentials_by_bucket",
+        lambda bucket: {"access_key_id": "", "secret_access_key": "", "endpoint": ""},
+    )
+    monkeypatch.setattr(object_storage_util, "parse_region", lambda endpoint: "us-east")
+    reader = COGFileReader(
+        items=[item],
+        bands=list(bands),
+        bbox=(10.005, 45.005, 10.025, 45.015),
+        temporal_extent=(datetime(2020, 1, 1), datetime(2020, 1, 3)),
+        properties=None,
+    )
+    assert reader._can_read_windows()
+    arr = reader.load_items()
+    assert arr.sizes["x"] == 3 and arr.sizes["y"] == 2
+    # the window is the pixels of the snapped bbox, i.e., the last two rows
+    np.testing.assert_array_equal(
+        arr.sel({DEFAULT_BANDS_DIMENSION: "B02"}).values[0], data[98:100, 0:3]
+    )
+    np.testing.assert_array_equal(
+        arr.sel({DEFAULT_BANDS_DIMENSION: "B03"}).values[0], data[98:100, 0:3] + 1
+    )
+    np.testing.assert_allclose(arr["x"].values, [10.005, 10.015, 10.025])
+    np.testing.assert_allclose(arr["y"].values, [45.015, 45.005])
+    assert arr.attrs["nodata"] == -1
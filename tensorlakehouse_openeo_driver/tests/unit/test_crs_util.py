@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pyproj
+import pytest
+
+from tensorlakehouse_openeo_driver.geospatial_utils import reproject_bbox
+from tensorlakehouse_openeo_driver.util import crs_util
+
+
+@pytest.fixture
+def empty_registry():
+    crs_util.clear_registry()
+    yield
+    crs_util.clear_registry()
+
+
+def test_get_crs(empty_registry):
+    crs_obj = crs_util.get_crs(crs_code=32633)
+    assert crs_obj.to_epsg() == 32633
+    assert crs_util.get_crs(crs_code=32633) is crs_obj
+    assert crs_util.get_crs(crs_code=32633.0) is crs_obj
+    assert crs_util.get_crs(crs_code="EPSG:4326").to_epsg() == 4326
+    other = pyproj.CRS.from_epsg(3857)
+    assert crs_util.get_crs(crs_code=other) is other
+
+
+def test_get_transformer(empty_registry):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        transformers = list(
+            executor.map(
+                lambda _: crs_util.get_transformer(crs_from=4326, crs_to=32633),
+                range(32),
+            )
+        )
+    assert all(t is transformers[0] for t in transformers)
+    assert (
+        crs_util.get_transformer(crs_from=pyproj.CRS.from_epsg(4326), crs_to=32633)
+        is transformers[0]
+    )
+    x, y = transformers[0].transform(15.0, 0.0)
+    assert x == pytest.approx(500000.0)
+    assert y == pytest.approx(0.0, abs=1e-6)
+
+
+def test_transform_bounds(empty_registry):
+    bbox = (10.0, 40.0, 20.0, 50.0)
+    corners = crs_util.transform_bounds(
+        bbox=bbox, crs_from=4326, crs_to=32633, densify_pts=None
+    )
+    densified = crs_util.transform_bounds(
+        bbox=bbox, crs_from=4326, crs_to=32633, densify_pts=21
+    )
+    # the densified box contains the box of the corners, because the edges bulge
+    assert densified[0] <= corners[0] and densified[1] <= corners[1]
+    assert densified[2] >= corners[2] and densified[3] >= corners[3]
+    assert densified[1] < corners[1]
+
+
+def test_reproject_bbox_densified(empty_registry):
+    bbox = (10.0, 40.0, 20.0, 50.0)
+    reprojected = reproject_bbox(bbox=bbox, src_crs=4326, dst_crs=32633)
+    assert reprojected == crs_util.transform_bounds(
+        bbox=bbox, crs_from=4326, crs_to=32633
+    )
+    corners = reproject_bbox(bbox=bbox, src_crs=4326, dst_crs=32633, densify_pts=None)
+    assert reprojected[1] < corners[1]
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from tensorlakehouse_openeo_driver.processes import merge_cubes
+from tensorlakehouse_openeo_driver.util import cube_merge
+
+
+def _make_cube(
+    bands=("B02", "B03"), start: str = "2020-01-01", periods: int = 10, seed: int = 0
+) -> xr.DataArray:
+    np.random.seed(seed)
+    return xr.DataArray(
+        np.random.rand(len(bands), periods, 12, 16),
+        dims=["bands", "t", "y", "x"],
+        coords={
+            "bands": list(bands),
+            "t": pd.date_range(start, periods=periods, freq="D"),
+            "y": np.arange(12)[::-1] + 0.5,
+            "x": np.arange(16) + 0.5,
+        },
+    )
+
+
+def _resolver(positional_parameters: dict, named_parameters: dict):
+    return named_parameters["x"] - named_parameters["y"]
+
+
+def test_resolve_overlap_chunks():
+    cube1 = _make_cube().chunk({"t": 2, "x": 8})
+    cube2 = _make_cube(seed=1).chunk({"t": 5}).transpose("t", "bands", "x", "y")
+    result = cube_merge.resolve_overlap(
+        x=cube1, y=cube2, overlap_resolver=_resolver, context=None
+    )
+    # cube2 follows the chunk grid of cube1, so each output chunk depends on two chunks
+    assert result.chunks == cube1.chunks
+    np.testing.assert_allclose(
+        result.values, cube1.values - cube2.transpose(*cube1.dims).values
+    )
+
+
+def test_merge_cubes_same_labels():
+    cube1 = _make_cube().chunk({"t": 2})
+    cube2 = _make_cube(seed=1).chunk({"t": 3})
+    merged = merge_cubes(cube1=cube1, cube2=cube2, overlap_resolver=_resolver)
+    assert merged.dims == cube1.dims
+    np.testing.assert_allclose(merged.values, cube1.values - cube2.values)
+
+
+def test_merge_cubes_partial_overlap():
+    # cubes overlap on 3 days
+    cube1 = _make_cube(periods=10).chunk({"t": 2})
+    cube2 = _make_cube(start="2020-01-08", periods=10, seed=1).chunk({"t": 2})
+    merged = merge_cubes(cube1=cube1, cube2=cube2, overlap_resolver=_resolver)
+    assert merged.sizes["t"] == 17
+    assert merged.indexes["t"].is_monotonic_increasing
+    # the chunks of the disjoint regions are kept as they are
+    assert merged.chunks[1][:3] == (2, 2, 2)
+    np.testing.assert_allclose(
+        merged.sel(t=slice("2020-01-01", "2020-01-07")).values,
+        cube1.isel(t=slice(0, 7)).values,
+    )
+    np.testing.assert_allclose(
+        merged.sel(t=slice("2020-01-08", "2020-01-10")).values,
+        cube1.isel(t=slice(7, 10)).values - cube2.isel(t=slice(0, 3)).values,
+    )
+    np.testing.assert_allclose(
+        merged.sel(t=slice("2020-01-11", None)).values,
+        cube2.isel(t=slice(3, None)).values,
+    )
+
+
+def test_merge_cubes_bands():
+    cube1 = _make_cube(bands=["B04", "B02"]).chunk({"t": 2})
+    cube2 = _make_cube(bands=["B03"], seed=1).chunk({"t": 5})
+    merged = merge_cubes(cube1=cube1, cube2=cube2)
+    # bands of cube1 come first
+    assert list(merged["bands"].values) == ["B04", "B02", "B03"]
+    np.testing.assert_allclose(
+        merged.sel(bands="B03").values, cube2.isel(bands=0).values
+    )
+
+
+def test_merge_cubes_broadcast():
+    cube1 = _make_cube().chunk({"t": 2})
+    cube2 = _make_cube(seed=1).isel(t=0, drop=True)
+    merged = merge_cubes(cube1=cube1, cube2=cube2, overlap_resolver=_resolver)
+    assert merged.dims == cube1.dims
+    np.testing.assert_allclose(merged.values, cube1.values - cube2.values[:, None])
+
+
+def test_resolve_overlap_invalid_resolver():
+    cube = _make_cube()
+    with pytest.raises(ValueError):
+        cube_merge.resolve_overlap(
+            x=cube,
+            y=cube,
+            overlap_resolver=lambda positional_parameters, named_parameters: 1.0,
+            context=None,
+        )
@@ -0,0 +1,43 @@
+from typing import Any, Dict
+
+import dask.array
+import numpy as np
+import pytest
+import xarray as xr
+
+from tensorlakehouse_openeo_driver.util import decode_executor
+from tensorlakehouse_openeo_driver.util.decode_executor import map_items
+
+
+def load_item(item: Dict[str, Any]) -> xr.DataArray:
+    data = dask.array.full((1, 2, 2), item["value"], chunks=1)
+    return xr.DataArray(data, dims=["time", "y", "x"], coords={"time": [item["value"]]})
+
+
+@pytest.mark.parametrize("mode", ["serial", "processes", "dask"])
+def test_map_items(mode: str):
+    items = [{"value": i} for i in range(3)]
+    data_arrays = map_items(load_item=load_item, items=items, mode=mode, max_workers=2)
+    assert len(data_arrays) == 3
+    da = xr.concat(data_arrays, dim="time")
+    np.testing.assert_array_equal(da.time.values, [0, 1, 2])
+    np.testing.assert_array_equal(da.isel(x=0, y=0).values, [0, 1, 2])
+    if mode != "serial":
+        # subsets are returned as in-memory arrays
+        assert all(isinstance(d.data, np.ndarray) for d in data_arrays)
+
+
+def test_map_items_invalid_mode():
+    with pytest.raises(AssertionError):
+        map_items(load_item=load_item, items=[{"value": 0}], mode="threads")
+
+
+def test_map_items_reuses_pool():
+    items = [{"value": i} for i in range(2)]
+    map_items(load_item=load_item, items=items, mode="processes", max_workers=2)
+    executor = decode_executor._executor
+    assert executor is not None
+    map_items(load_item=load_item, items=items, mode="processes", max_workers=2)
+    assert decode_executor._executor is executor
+    decode_executor._shutdown_executor()
+    assert decode_executor._executor is None
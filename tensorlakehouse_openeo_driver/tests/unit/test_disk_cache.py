@@ -0,0 +1,103 @@
+import os
+import pickle
+from pathlib import Path
+
+import fsspec
+
+from tensorlakehouse_openeo_driver.util.disk_cache import DiskCache, fingerprint
+
+
+def test_fingerprint(tmp_path: Path):
+    path = tmp_path / "file.grb2"
+    path.write_bytes(b"GRIB")
+    key = fingerprint(path_or_url=str(path))
+    assert key == fingerprint(path_or_url=str(path))
+    # a new version of the file has a different key
+    path.write_bytes(b"GRIB2")
+    assert key != fingerprint(path_or_url=str(path))
+    # remote objects are identified by ETag
+    url = "s3://bucket/file.grb2"
+    key_a = fingerprint(path_or_url=url, info={"ETag": '"a"', "size": 4})
+    key_b = fingerprint(path_or_url=url, info={"ETag": '"b"', "size": 4})
+    assert key_a != key_b
+
+
+def test_evict(tmp_path: Path):
+    cache = DiskCache(cache_dir=tmp_path / "cache", max_bytes=10)
+    for i, key in enumerate(["a", "b", "c"]):
+        path = cache.get_path(key=key)
+        path.with_suffix(".idx").write_bytes(b"12345")
+        os.utime(path.with_suffix(".idx"), (i, i))
+    # the least recently used entry is removed
+    assert cache.evict() == 1
+    assert not cache.contains(key="a")
+    assert cache.contains(key="b") and cache.contains(key="c")
+    assert cache.size() <= 10
+
+
+def test_evict_ignores_downloads(tmp_path: Path):
+    cache = DiskCache(cache_dir=tmp_path / "cache", max_bytes=10)
+    cache.get_path(key="a").with_suffix(".idx").write_bytes(b"12345")
+    # a download in progress is neither counted nor removed
+    tmp_file = cache.cache_dir / ".b.1234.tmp"
+    tmp_file.write_bytes(b"1234567890")
+    assert cache.size() == 5
+    assert cache.evict() == 0
+    assert tmp_file.exists() and cache.contains(key="a")
+
+
+def test_fetch(tmp_path: Path):
+    fs = fsspec.filesystem("memory")
+    url = "memory://bucket/file.fst"
+    fs.pipe(url, b"FSTD")
+    cache = DiskCache(cache_dir=tmp_path / "cache", max_bytes=100)
+    path = cache.fetch(fs=fs, url=url, suffix=".fst").path
+    assert path.suffix == ".fst"
+    assert path.read_bytes() == b"FSTD"
+    # the second request reads the local copy
+    assert cache.fetch(fs=fs, url=url, suffix=".fst").path == path
+    # no temporary files are left
+    assert len(list(cache.cache_dir.iterdir())) == 1
+
+
+def test_fetch_evicts_after_download(tmp_path: Path):
+    fs = fsspec.filesystem("memory")
+    cache = DiskCache(cache_dir=tmp_path / "cache", max_bytes=10)
+    for i in range(3):
+        url = f"memory://bucket/file{i}.fst"
+        fs.pipe(url, b"123456")
+        lease = cache.fetch(fs=fs, url=url, suffix=".fst")
+        # the cache never exceeds max_bytes, but keeps the entry that was just downloaded
+        assert cache.size() <= 10
+        assert lease.path.exists()
+        lease.release()
+    # a file larger than the cache is kept until the next download
+    fs.pipe("memory://bucket/large.fst", b"0123456789ABCDEF")
+    lease = cache.fetch(fs=fs, url="memory://bucket/large.fst", suffix=".fst")
+    assert lease.path.exists()
+
+
+def test_fetch_keeps_leased_entries(tmp_path: Path):
+    fs = fsspec.filesystem("memory")
+    cache = DiskCache(cache_dir=tmp_path / "cache", max_bytes=10)
+    leases = list()
+    for i in range(3):
+        url = f"memory://bucket/file{i}.fst"
+        fs.pipe(url, b"123456")
+        leases.append(cache.fetch(fs=fs, url=url, suffix=".fst"))
+    # entries that are leased are not evicted, even if the cache exceeds max_bytes
+    assert all(lease.path.exists() for lease in leases)
+    assert cache.size() == 18
+    # a copy of the lease, e.g., in a pickled dask task, does not hold the lock
+    copy = pickle.loads(pickle.dumps(leases[0]))
+    assert copy.path == leases[0].path
+    for lease in leases[:2]:
+        lease.release()
+    assert cache.evict() == 2
+    assert leases[2].path.exists()
+    # a lease that is garbage collected is released
+    del leases
+    assert cache.evict() == 0
+    fs.pipe("memory://bucket/file3.fst", b"123456")
+    cache.fetch(fs=fs, url="memory://bucket/file3.fst", suffix=".fst")
+    assert cache.size() <= 10
@@ -1,19 +1,37 @@
+import bisect
+import os
+import time
 import pytest
-from typing import Dict, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 from tensorlakehouse_openeo_driver.constants import (
+    DEFAULT_BANDS_DIMENSION,
     DEFAULT_TIME_DIMENSION,
     DEFAULT_X_DIMENSION,
     DEFAULT_Y_DIMENSION,
 )
 from tensorlakehouse_openeo_driver.geospatial_utils import (
+    _to_datetime64,
+    filter_by_time,
     remove_repeated_time_coords,
     clip_box,
+    reproject_cube,
 )
 import numpy as np
 import pandas as pd
 import xarray as xr
-from datetime import datetime
+from datetime import datetime, timezone
+import pytz
+import cftime
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
 from tensorlakehouse_openeo_driver.tests.unit.unit_test_util import generate_xarray
+from tensorlakehouse_openeo_driver.util import crs_util
+
+# benchmarks are opt-in, because wall-clock ratios depend on the machine
+benchmark = pytest.mark.skipif(
+    os.getenv("RUN_BENCHMARKS") is None,
+    reason="benchmark - set RUN_BENCHMARKS to run it",
+)
 
 
 def test_squeeze():
@@ -33,6 +51,54 @@ def test_squeeze():
     assert len(da["space"].values) == 3
 
 
+def test_remove_repeated_time_coords_first_valid_value():
+    times = [
+        pd.Timestamp(2000, 1, 2),
+        pd.Timestamp(2000, 1, 1),
+        pd.Timestamp(2000, 1, 2),
+        pd.Timestamp(2000, 1, 2),
+        pd.Timestamp(2000, 1, 3),
+    ]
+    data = np.array(
+        [
+            [np.nan, 1.0, np.nan],
+            [5.0, np.nan, 6.0],
+            [2.0, 7.0, np.nan],
+            [8.0, 8.0, 3.0],
+            [np.nan, np.nan, np.nan],
+        ]
+    )
+    foo = xr.DataArray(
+        data, coords=[times, ["IA", "IL", "IN"]], dims=[DEFAULT_TIME_DIMENSION, "space"]
+    )
+    da = remove_repeated_time_coords(foo)
+    # timestamps keep the order of first appearance
+    assert list(da[DEFAULT_TIME_DIMENSION].values) == [
+        np.datetime64(t) for t in [times[0], times[1], times[4]]
+    ]
+    np.testing.assert_array_equal(
+        da.values,
+        [[2.0, 1.0, 3.0], [5.0, np.nan, 6.0], [np.nan, np.nan, np.nan]],
+    )
+
+
+def test_remove_repeated_time_coords_graph_size():
+    num_scenes = 2000
+    # each timestamp is repeated by 2 adjacent tiles
+    times = pd.date_range("2000-01-01", periods=num_scenes // 2, freq="D").repeat(2)
+    foo = xr.DataArray(
+        np.random.rand(num_scenes, 8, 8),
+        coords={DEFAULT_TIME_DIMENSION: times},
+        dims=[DEFAULT_TIME_DIMENSION, "y", "x"],
+    ).chunk({DEFAULT_TIME_DIMENSION: 100})
+    da = remove_repeated_time_coords(foo)
+    assert da.sizes[DEFAULT_TIME_DIMENSION] == num_scenes // 2
+    # the graph grows with the number of chunks, not with the number of scenes
+    assert len(da.__dask_graph__()) < num_scenes
+    expected = foo.isel({DEFAULT_TIME_DIMENSION: slice(0, None, 2)}).values
+    np.testing.assert_array_equal(da.values, expected)
+
+
 @pytest.mark.parametrize(
     "bbox, filter_bbox, expected_dim_size",
     [
@@ -85,3 +151,298 @@ def test_clip_box(
         ), f"Error! {filter_bbox[1]=} {miny=} {maxy=} {filter_bbox[3]=}"
     for dim_name, dim_size in expected_dim_size.items():
         assert dim_size == array_clipped[dim_name].size
+
+
+def _convert_to_datetime(
+    datetime_index: Union[np.ndarray, Sequence[Any]],
+) -> List[datetime]:
+    """previous conversion of datetime values to native datetime, which is the reference of
+    _to_datetime64
+
+    Args:
+        datetime_index (Union[np.ndarray, Sequence[Any]]): datetime values
+
+    Returns:
+        List[datetime]: list of timezone aware datetime objects
+    """
+    dt = datetime_index[0]
+    timestamps: List[datetime] = list()
+    if isinstance(dt, str) or isinstance(dt, datetime) or isinstance(dt, np.datetime64):
+        for dt in datetime_index:
+            ts = pd.Timestamp(dt)
+            if ts.tzinfo is None:
+                ts = ts.tz_localize(tz="UTC")
+            timestamps.append(ts.to_pydatetime())
+    elif isinstance(dt, cftime.Datetime360Day):
+        for dt in datetime_index:
+            julian = (dt.month - 1) * 30 + dt.day
+
+            ts = pd.to_datetime(
+                f"{dt.year}-{julian}T{dt.hour}:{dt.minute}:{dt.second}",
+                format="%Y-%jT%H:%M:%S",
+            )
+            if ts.tzinfo is None:
+                ts = ts.tz_localize(tz="UTC")
+            timestamps.append(ts.to_pydatetime())
+    elif isinstance(dt, int):
+        for dt in datetime_index:
+            assert isinstance(dt, int)
+            timestamps.append(
+                pd.Timestamp.fromtimestamp(dt / 1e9, tz="UTC").to_pydatetime()
+            )
+    return timestamps
+
+
+def _filter_by_time_bisect(
+    data: xr.DataArray,
+    temporal_extent: Tuple[datetime, Optional[datetime]],
+    temporal_dim: str,
+) -> xr.DataArray:
+    """previous implementation of filter_by_time, which is the reference for behaviour and speed"""
+    start_datetime, end_datetime = temporal_extent
+    ts = data[temporal_dim].values
+    if end_datetime is None:
+        end_datetime = pd.Timestamp(sorted(ts)[-1]).to_pydatetime()
+    if start_datetime.tzinfo is None:
+        start_datetime = pytz.UTC.localize(start_datetime)
+    if end_datetime.tzinfo is None:
+        end_datetime = pytz.UTC.localize(end_datetime)
+    timestamps = _convert_to_datetime(datetime_index=ts)
+    start_index = bisect.bisect_left(timestamps, start_datetime)
+    end_index = bisect.bisect_right(timestamps, end_datetime)
+    if start_index == end_index:
+        return data.isel({temporal_dim: [start_index]})
+    return data.isel({temporal_dim: slice(start_index, end_index)})
+
+
+def _make_time_series(num_periods: int, freq: str = "h") -> xr.DataArray:
+    times = pd.date_range(start="2000-01-01", periods=num_periods, freq=freq)
+    return xr.DataArray(
+        np.arange(num_periods),
+        coords={DEFAULT_TIME_DIMENSION: times},
+        dims=[DEFAULT_TIME_DIMENSION],
+    )
+
+
+@pytest.mark.parametrize(
+    "temporal_extent",
+    [
+        (datetime(2000, 1, 2), datetime(2000, 1, 3)),
+        (datetime(2000, 1, 2, 5, tzinfo=timezone.utc), None),
+        (datetime(2000, 1, 2, 0, 30), datetime(2000, 1, 2, 0, 45)),
+        (datetime(1999, 1, 1), datetime(1999, 2, 1)),
+        (
+            pytz.timezone("America/Sao_Paulo").localize(datetime(2000, 1, 2)),
+            pytz.timezone("America/Sao_Paulo").localize(datetime(2000, 1, 3)),
+        ),
+    ],
+)
+def test_filter_by_time(temporal_extent: Tuple[datetime, Optional[datetime]]):
+    data = _make_time_series(num_periods=24 * 5)
+    expected = _filter_by_time_bisect(
+        data=data, temporal_extent=temporal_extent, temporal_dim=DEFAULT_TIME_DIMENSION
+    )
+    filtered = filter_by_time(
+        data=data, temporal_extent=temporal_extent, temporal_dim=DEFAULT_TIME_DIMENSION
+    )
+    xr.testing.assert_identical(filtered, expected)
+
+
+@pytest.mark.parametrize(
+    "datetime_index",
+    [
+        np.array(["2000-01-01T00:00:00", "2000-03-01T12:00:00"], dtype="datetime64[s]"),
+        ["2000-01-01T00:00:00Z", "2000-03-01T09:00:00-03:00"],
+        [datetime(2000, 1, 1), datetime(2000, 3, 1, 12, tzinfo=timezone.utc)],
+        [946684800 * 10**9, 951912000 * 10**9],
+        [
+            cftime.Datetime360Day(2000, 1, 1),
+            cftime.Datetime360Day(2000, 3, 1, 12),
+        ],
+    ],
+)
+def test_to_datetime64(datetime_index):
+    expected = [
+        pd.Timestamp(dt).tz_convert("UTC").tz_localize(None).to_datetime64()
+        for dt in _convert_to_datetime(datetime_index=list(datetime_index))
+    ]
+    np.testing.assert_array_equal(_to_datetime64(datetime_index), expected)
+
+
+@benchmark
+def test_filter_by_time_benchmark():
+    data = _make_time_series(num_periods=100_000, freq="min")
+    temporal_extent = (datetime(2000, 1, 10), datetime(2000, 2, 10))
+    begin = time.perf_counter()
+    expected = _filter_by_time_bisect(
+        data=data, temporal_extent=temporal_extent, temporal_dim=DEFAULT_TIME_DIMENSION
+    )
+    bisect_elapsed = time.perf_counter() - begin
+    begin = time.perf_counter()
+    filtered = filter_by_time(
+        data=data, temporal_extent=temporal_extent, temporal_dim=DEFAULT_TIME_DIMENSION
+    )
+    searchsorted_elapsed = time.perf_counter() - begin
+    print(f"filter_by_time: {bisect_elapsed=:.4f}s {searchsorted_elapsed=:.4f}s")
+    xr.testing.assert_identical(filtered, expected)
+    assert searchsorted_elapsed * 10 < bisect_elapsed
+
+
+@benchmark
+def test_clip_box_benchmark():
+    size = 2000
+    array = xr.DataArray(
+        np.zeros((size, size), dtype=np.uint8),
+        coords={
+            DEFAULT_Y_DIMENSION: np.linspace(40.0, 41.0, size),
+            DEFAULT_X_DIMENSION: np.linspace(0.0, 1.0, size),
+        },
+        dims=[DEFAULT_Y_DIMENSION, DEFAULT_X_DIMENSION],
+    )
+    bbox = (0.25, 40.25, 0.75, 40.75)
+    begin = time.perf_counter()
+    for _ in range(10):
+        expected = _clip_box_rename(
+            data=array, bbox=bbox, x_dim=DEFAULT_X_DIMENSION, y_dim=DEFAULT_Y_DIMENSION
+        )
+    rename_elapsed = time.perf_counter() - begin
+    begin = time.perf_counter()
+    for _ in range(10):
+        clipped = clip_box(
+            data=array, bbox=bbox, x_dim=DEFAULT_X_DIMENSION, y_dim=DEFAULT_Y_DIMENSION
+        )
+    clip_box_elapsed = time.perf_counter() - begin
+    print(f"clip_box: {rename_elapsed=:.4f}s {clip_box_elapsed=:.4f}s")
+    xr.testing.assert_identical(clipped, expected)
+    assert clip_box_elapsed < rename_elapsed
+
+
+def test_filter_by_time_long_series():
+    data = _make_time_series(num_periods=100_000, freq="min")
+    temporal_extent = (datetime(2000, 1, 10), datetime(2000, 2, 10))
+    expected = _filter_by_time_bisect(
+        data=data, temporal_extent=temporal_extent, temporal_dim=DEFAULT_TIME_DIMENSION
+    )
+    filtered = filter_by_time(
+        data=data, temporal_extent=temporal_extent, temporal_dim=DEFAULT_TIME_DIMENSION
+    )
+    xr.testing.assert_identical(filtered, expected)
+
+
+def _clip_box_rename(
+    data: xr.DataArray,
+    bbox: Tuple[float, float, float, float],
+    x_dim: str,
+    y_dim: str,
+    crs: int = 4326,
+) -> xr.DataArray:
+    """previous implementation of clip_box, which renamed the spatial dimensions to x and y"""
+    data = data.rio.write_crs(crs_util.get_crs(crs_code=crs))
+    minx, miny, maxx, maxy = bbox
+    minx = max(minx, min(data[x_dim].values))
+    maxx = min(maxx, max(data[x_dim].values))
+    miny = max(miny, min(data[y_dim].values))
+    maxy = min(maxy, max(data[y_dim].values))
+    data = data.rename({x_dim: "x", y_dim: "y"})
+    data = data.rio.clip_box(minx=minx, miny=miny, maxx=maxx, maxy=maxy, crs=crs)
+    return data.rename({"x": x_dim, "y": y_dim})
+
+
+@pytest.mark.parametrize(
+    "bbox",
+    [
+        (0.25, 40.25, 0.75, 40.75),
+        (-10.0, 30.0, 0.5, 40.5),
+        (0.1, 40.1, 10.0, 50.0),
+    ],
+)
+def test_clip_box_dimension_names(bbox: Tuple[float, float, float, float]):
+    size = 200
+    array = xr.DataArray(
+        np.arange(size * size, dtype=np.float32).reshape(size, size),
+        coords={
+            "lat": np.linspace(40.0, 41.0, size),
+            "lon": np.linspace(0.0, 1.0, size),
+        },
+        dims=["lat", "lon"],
+    )
+    original = array.copy(deep=True)
+    expected = _clip_box_rename(data=array, bbox=bbox, x_dim="lon", y_dim="lat")
+    clipped = clip_box(data=array, bbox=bbox, x_dim="lon", y_dim="lat")
+    assert clipped.dims == array.dims
+    np.testing.assert_array_equal(clipped.lon.values, expected.lon.values)
+    np.testing.assert_array_equal(clipped.lat.values, expected.lat.values)
+    np.testing.assert_array_equal(clipped.values, expected.values)
+    # the data cube of the caller is not modified, e.g., its CRS is not set
+    xr.testing.assert_identical(array, original)
+    assert array.rio.crs is None
+
+
+def test_reproject_cube_chunked():
+    data = generate_xarray(
+        bands=["B02", "B03"],
+        latmax=41,
+        latmin=40,
+        lonmax=-90,
+        lonmin=-91,
+        size_x=120,
+        size_y=100,
+        temporal_extent=(pd.Timestamp(2020, 1, 1), pd.Timestamp(2020, 1, 4)),
+        num_periods=4,
+        freq=None,
+    )
+    target = CRS.from_epsg(32616)
+    expected = reproject_cube(
+        data_cube=data,
+        target_projection=target,
+        resolution=1000.0,
+        resampling=Resampling.nearest,
+    )
+    chunks = {
+        DEFAULT_TIME_DIMENSION: 1,
+        DEFAULT_Y_DIMENSION: 40,
+        DEFAULT_X_DIMENSION: 40,
+    }
+    warped = reproject_cube(
+        data_cube=data.chunk(chunks),
+        target_projection=target,
+        resolution=1000.0,
+        resampling=Resampling.nearest,
+    )
+    # the result is lazy and its tiles are not larger than the source chunks
+    assert warped.chunks is not None
+    assert max(warped.chunksizes[DEFAULT_Y_DIMENSION]) <= 40
+    assert max(warped.chunksizes[DEFAULT_X_DIMENSION]) <= 40
+    assert warped.dims == data.dims
+    assert warped.rio.crs == target
+    np.testing.assert_array_equal(warped.x.values, expected.x.values)
+    np.testing.assert_array_equal(warped.y.values, expected.y.values)
+    np.testing.assert_array_equal(
+        warped[DEFAULT_TIME_DIMENSION].values, data[DEFAULT_TIME_DIMENSION].values
+    )
+    # GDAL approximates the transformation per tile, so a few pixels at the edge of a source
+    # pixel may pick its neighbour
+    values = warped.values
+    same = (values == expected.values) | (np.isnan(values) & np.isnan(expected.values))
+    assert same.mean() > 0.95
+    # the previous implementation warped the whole cube with rio.reproject, which is the
+    # reference on the same grid
+    geobox = warped.odc.geobox
+    previous = xr.concat(
+        [
+            data.sel({DEFAULT_BANDS_DIMENSION: band}).rio.reproject(
+                dst_crs=target,
+                shape=geobox.shape,
+                transform=geobox.affine,
+                resampling=Resampling.nearest,
+                nodata=np.nan,
+            )
+            for band in data[DEFAULT_BANDS_DIMENSION].values
+        ],
+        dim=DEFAULT_BANDS_DIMENSION,
+    ).transpose(*data.dims)
+    np.testing.assert_allclose(warped.x.values, previous.x.values)
+    np.testing.assert_allclose(warped.y.values, previous.y.values)
+    previous_values = previous.values
+    same = (values == previous_values) | (np.isnan(values) & np.isnan(previous_values))
+    assert same.mean() > 0.95
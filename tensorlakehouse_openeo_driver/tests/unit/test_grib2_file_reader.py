@@ -1,5 +1,6 @@
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
 import pytest
 import xarray as xr
 
@@ -8,11 +9,20 @@ from tensorlakehouse_openeo_driver.constants import (
     TEST_DATA_ROOT,
 )
 from tensorlakehouse_openeo_driver.file_reader.grib2_file_reader import Grib2FileReader
+from tensorlakehouse_openeo_driver.util.disk_cache import DiskCache
 from datetime import datetime
 from rasterio.crs import CRS
 from openeo_pg_parser_networkx.pg_schema import ParameterReference
 
 
+@pytest.fixture(autouse=True)
+def index_cache(tmp_path: Path, monkeypatch):
+    """cfgrib indexes created by the tests are written to a temporary directory"""
+    cache = DiskCache(cache_dir=tmp_path / "grib_index", max_bytes=2**30)
+    monkeypatch.setattr(Grib2FileReader, "index_cache", cache)
+    return cache
+
+
 @pytest.mark.parametrize(
     "items, spatial_extent, temporal_extent, properties, bands, crs, expected_dim_size",
     [
@@ -554,3 +564,51 @@ def test_load_items(
     ds.to_netcdf(path=path, engine="netcdf4")  # type: ignore[call-overload]
     if Path(path).exists():
         Path(path).unlink()
+
+
+def test_get_references_href():
+    assets = {
+        "data": {"href": "s3://bucket/file.grb2", "type": "application/x-grib2"},
+        "references": {
+            "href": "s3://bucket/file.grb2.references.json",
+            "type": "application/json; profile=kerchunk",
+        },
+    }
+    data_asset = Grib2FileReader._get_data_asset(assets=assets)
+    assert data_asset["href"] == "s3://bucket/file.grb2"
+    href = Grib2FileReader._get_references_href(assets=assets)
+    assert href == "s3://bucket/file.grb2.references.json"
+    assets.pop("references")
+    assert Grib2FileReader._get_references_href(assets=assets) is None
+
+
+def test_squeeze():
+    ds = xr.Dataset(
+        {"t2m": (("step", "latitude", "longitude"), np.zeros((1, 1, 3)))},
+        coords={"step": [0], "latitude": [10.0], "longitude": [0.0, 0.5, 1.0]},
+    )
+    squeezed = Grib2FileReader._squeeze(ds=ds, x_dim="longitude", y_dim="latitude")
+    assert set(squeezed.sizes.keys()) == {"latitude", "longitude"}
+    assert "step" in squeezed.coords
+
+
+@pytest.mark.parametrize(
+    "bands, extra_dims_filter, expected",
+    [
+        (
+            ["t"],
+            {"isobaricInhPa": 500},
+            {"cfVarName": "t", "typeOfLevel": "isobaricInhPa"},
+        ),
+        (["t", "u"], {"isobaricInhPa": 500}, {"typeOfLevel": "isobaricInhPa"}),
+        (["t2m"], {"step": 3}, {"cfVarName": "t2m"}),
+        (["t", "u"], {"isobaricInhPa": 500, "heightAboveGround": 2}, {}),
+    ],
+)
+def test_get_filter_by_keys(
+    bands: List[str], extra_dims_filter: Dict[str, Any], expected: Dict[str, Any]
+):
+    filter_by_keys = Grib2FileReader._get_filter_by_keys(
+        bands=bands, extra_dims_filter=extra_dims_filter
+    )
+    assert filter_by_keys == expected
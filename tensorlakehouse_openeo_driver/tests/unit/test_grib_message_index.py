@@ -0,0 +1,107 @@
+import fsspec
+
+from tensorlakehouse_openeo_driver.util.grib_message_index import (
+    coalesce_ranges,
+    fetch_messages,
+    parse_idx,
+    parse_json_index,
+    read_message_index,
+    select_messages,
+)
+
+IDX = """1:0:d=2019010100:PRMSL:mean sea level:anl:
+2:100:d=2019010100:TMP:2 m above ground:anl:
+3:250:d=2019010100:UGRD:10 m above ground:anl:
+4:300:d=2019010100:TMP:500 mb:anl:
+"""
+
+
+def test_parse_idx():
+    messages = parse_idx(text=IDX, file_size=400)
+    assert [m.offset for m in messages] == [0, 100, 250, 300]
+    assert [m.length for m in messages] == [100, 150, 50, 100]
+    # wgrib2 variables and levels are translated to cfgrib names
+    assert [m.variable for m in messages] == ["prmsl", "t2m", "u10", "t"]
+    assert messages[1].keys == {
+        "typeOfLevel": "heightAboveGround",
+        "level": 2.0,
+        "step": 0,
+        "wgrib2_name": "TMP",
+    }
+    assert messages[3].keys["typeOfLevel"] == "isobaricInhPa"
+    assert messages[3].keys["level"] == 500.0
+
+
+def test_select_messages():
+    messages = parse_idx(text=IDX, file_size=400)
+    selected = select_messages(
+        messages=messages, variables=["tmp"], extra_dims_filter={}
+    )
+    assert [m.offset for m in selected] == [100, 300]
+    selected = select_messages(
+        messages=messages,
+        variables=["TMP"],
+        extra_dims_filter={"isobaricInhPa": [500]},
+    )
+    assert [m.offset for m in selected] == [300]
+    # cfgrib names select the message of the corresponding level
+    selected = select_messages(
+        messages=messages, variables=["t2m"], extra_dims_filter={}
+    )
+    assert [m.offset for m in selected] == [100]
+    # numbers are compared as numbers, e.g., 2 and 2.0
+    selected = select_messages(
+        messages=messages,
+        variables=["t2m"],
+        extra_dims_filter={"heightAboveGround": 2, "step": "0"},
+    )
+    assert [m.offset for m in selected] == [100]
+    selected = select_messages(
+        messages=messages,
+        variables=["t2m"],
+        extra_dims_filter={"heightAboveGround": 10},
+    )
+    assert len(selected) == 0
+
+
+def test_parse_json_index():
+    content = [
+        {
+            "offset": 10,
+            "length": 5,
+            "shortName": "2t",
+            "cfVarName": "t2m",
+            "typeOfLevel": "heightAboveGround",
+            "level": 2,
+        },
+        {"offset": 0, "length": 10, "shortName": "prmsl"},
+    ]
+    messages = parse_json_index(content=content)
+    assert [m.variable for m in messages] == ["prmsl", "t2m"]
+    assert messages[1].keys == {"typeOfLevel": "heightAboveGround", "level": 2}
+
+
+def test_coalesce_ranges():
+    messages = parse_idx(text=IDX, file_size=400)
+    selected = [messages[0], messages[1], messages[3]]
+    assert coalesce_ranges(messages=selected, max_gap=0) == [(0, 250), (300, 400)]
+    assert coalesce_ranges(messages=selected, max_gap=50) == [(0, 400)]
+
+
+def test_fetch_messages():
+    fs = fsspec.filesystem("memory")
+    url = "memory://bucket/file.grb2"
+    content = bytes(range(256)) + bytes(range(144))
+    fs.pipe(url, content)
+    fs.pipe(f"{url}.idx", IDX.encode())
+    messages = read_message_index(fs=fs, url=url)
+    assert messages is not None
+    selected = select_messages(
+        messages=messages, variables=["TMP"], extra_dims_filter={}
+    )
+    data = fetch_messages(fs=fs, url=url, messages=selected, max_gap=0)
+    assert data == content[100:250] + content[300:400]
+    # the message in between is fetched by the same request, but it is not returned
+    data = fetch_messages(fs=fs, url=url, messages=selected, max_gap=100)
+    assert data == content[100:250] + content[300:400]
+    assert read_message_index(fs=fs, url="memory://bucket/missing.grb2") is None
@@ -0,0 +1,147 @@
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from tensorlakehouse_openeo_driver.constants import DEFAULT_TIME_DIMENSION
+from tensorlakehouse_openeo_driver.processes import (
+    aggregate_temporal_period,
+    mean,
+    temporal_aggregation,
+)
+from tensorlakehouse_openeo_driver.processing import TensorlakehouseProcessing
+from tensorlakehouse_openeo_driver.util import grouped_reduction
+from tensorlakehouse_openeo_driver.util.callback_compiler import CompilingProcessGraph
+
+NUMPY_REDUCERS: Dict[str, Callable] = {
+    "mean": np.nanmean,
+    "median": np.nanmedian,
+    "min": np.nanmin,
+    "max": np.nanmax,
+    "sum": np.nansum,
+    "count": lambda data, axis: np.sum(~np.isnan(data), axis=axis),
+}
+
+
+def _make_cube(
+    num_periods: int = 400, time_dim: str = DEFAULT_TIME_DIMENSION
+) -> xr.DataArray:
+    np.random.seed(1)
+    data = np.random.rand(num_periods, 2, 6, 5)
+    data[10:40, 0] = np.nan
+    return xr.DataArray(
+        data,
+        dims=[time_dim, "bands", "y", "x"],
+        coords={
+            time_dim: pd.date_range("2019-01-01", periods=num_periods, freq="D"),
+            "bands": ["B04", "B08"],
+        },
+    )
+
+
+def _callback(process_id: str, arguments: dict):
+    """build the callable of a reducer callback the way the driver parses process graphs"""
+    captured = dict()
+    registry = TensorlakehouseProcessing().process_registry
+
+    def implementation(reducer=None, **kwargs):
+        captured["reducer"] = reducer
+
+    registry["reduce_dimension"].implementation = implementation
+    process_graph = {
+        "process_graph": {
+            "reduce": {
+                "process_id": "reduce_dimension",
+                "arguments": {
+                    "data": 1,
+                    "dimension": "t",
+                    "reducer": {
+                        "process_graph": {
+                            "r": {
+                                "process_id": process_id,
+                                "arguments": arguments,
+                                "result": True,
+                            }
+                        }
+                    },
+                },
+                "result": True,
+            }
+        }
+    }
+    CompilingProcessGraph(pg_data=process_graph).to_callable(
+        process_registry=registry
+    )()
+    return captured["reducer"]
+
+
+def test_get_reducer_name():
+    data = {"from_parameter": "data"}
+    assert grouped_reduction.get_reducer_name("Mean") == "mean"
+    assert grouped_reduction.get_reducer_name(np.nanmax) == "max"
+    assert grouped_reduction.get_reducer_name(mean) == "mean"
+    assert grouped_reduction.get_reducer_name(np.nanstd) is None
+    assert (
+        grouped_reduction.get_reducer_name(_callback("median", {"data": data}))
+        == "median"
+    )
+    assert (
+        grouped_reduction.get_reducer_name(
+            _callback("sum", {"data": data, "ignore_nodata": True})
+        )
+        == "sum"
+    )
+    # nodata is not ignored, which the engine does not support
+    assert (
+        grouped_reduction.get_reducer_name(
+            _callback("min", {"data": data, "ignore_nodata": False})
+        )
+        is None
+    )
+    assert grouped_reduction.get_reducer_name(_callback("sd", {"data": data})) is None
+
+
+@pytest.mark.parametrize("chunks", [None, {DEFAULT_TIME_DIMENSION: 7}])
+@pytest.mark.parametrize("reducer", list(NUMPY_REDUCERS))
+def test_aggregate_temporal_period(reducer: str, chunks):
+    data = _make_cube()
+    expected = data.resample({DEFAULT_TIME_DIMENSION: "M"}).reduce(
+        NUMPY_REDUCERS[reducer]
+    )
+    if chunks is not None:
+        data = data.chunk(chunks)
+    result = aggregate_temporal_period(data=data, reducer=reducer, period="month")
+    assert result.sizes == expected.sizes
+    np.testing.assert_allclose(result.values, expected.values)
+
+
+@pytest.mark.parametrize("reducer", ["mean", "median", "count"])
+def test_temporal_aggregation(reducer: str):
+    # temporal_aggregation expects a dimension called time
+    data = _make_cube(time_dim="time")
+    edges = pd.date_range("2019-01-01", periods=6, freq="60D")
+    intervals = pd.IntervalIndex.from_breaks(edges, closed="left")
+    expected = data.groupby_bins(
+        "time", bins=edges, labels=intervals, right=False
+    ).reduce(NUMPY_REDUCERS[reducer])
+    result = temporal_aggregation(
+        data=data.chunk({"time": 11}),
+        intervals=intervals,
+        reducer=reducer,
+    )
+    assert result.dims == expected.dims
+    np.testing.assert_array_equal(
+        result["time_bins"].values,
+        expected["time_bins"].values,
+    )
+    np.testing.assert_allclose(result.values, expected.values)
+
+
+def test_aggregate_temporal_period_graph_size():
+    # the number of tasks grows with the number of chunks, not with the number of groups
+    data = _make_cube(num_periods=3000).chunk({DEFAULT_TIME_DIMENSION: 500})
+    monthly = aggregate_temporal_period(data=data, reducer="mean", period="month")
+    daily = aggregate_temporal_period(data=data, reducer="mean", period="day")
+    assert len(daily.data.__dask_graph__()) < 2 * len(monthly.data.__dask_graph__())
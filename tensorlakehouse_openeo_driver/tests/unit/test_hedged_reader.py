@@ -0,0 +1,189 @@
+import asyncio
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, List
+
+import fsspec
+import pytest
+from fsspec.asyn import AsyncFileSystem
+from moto.server import ThreadedMotoServer
+
+from tensorlakehouse_openeo_driver.util.hedged_reader import (
+    AIMDLimiter,
+    EndpointStats,
+    HedgedReadMixin,
+    HedgedS3FileSystem,
+    LatencyHistogram,
+    get_latency_histograms,
+    is_throttling_error,
+)
+
+
+class ThrottlingError(Exception):
+    def __init__(self) -> None:
+        super().__init__("SlowDown")
+        self.response = {
+            "Error": {"Code": "SlowDown"},
+            "ResponseMetadata": {"HTTPStatusCode": 503},
+        }
+
+
+class SlowFileSystem(AsyncFileSystem):
+    """local stand-in of S3 that delays or throttles reads"""
+
+    def __init__(self, latencies: List[float], errors: int = 0) -> None:
+        super().__init__(skip_instance_cache=True)
+        # each fs has its own endpoint, so that tests do not share statistics
+        self.endpoint_url = f"http://{uuid.uuid4().hex}"
+        self.latencies = latencies
+        self.errors = errors
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.content: Dict[str, bytes] = dict()
+
+    async def _cat_file(self, path, start=None, end=None, **kwargs):
+        call = self.calls
+        self.calls += 1
+        if call < self.errors:
+            raise ThrottlingError()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latencies[call % len(self.latencies)])
+        finally:
+            self.in_flight -= 1
+        return self.content[path][start:end]
+
+
+class LatencyInjectingFileSystem(HedgedReadMixin, SlowFileSystem):
+    pass
+
+
+@pytest.fixture
+def s3_endpoint():
+    """local S3 server, which is accessed by HedgedS3FileSystem"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(0.95) is None
+    for _ in range(95):
+        histogram.observe(0.01)
+    for _ in range(5):
+        histogram.observe(1.0)
+    assert histogram.percentile(0.5) == pytest.approx(0.01, rel=0.2)
+    assert histogram.percentile(0.99) == pytest.approx(1.0, rel=0.2)
+    assert histogram.snapshot()["count"] == 100
+
+
+def test_aimd_limiter():
+    limiter = AIMDLimiter(max_limit=8)
+    limiter.on_throttle()
+    assert limiter.limit == 4
+    limiter.on_throttle()
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.limit == 1
+    for _ in range(10):
+        limiter.on_success()
+    assert 1 < limiter.limit <= 8
+
+
+def test_hedged_read():
+    # the first request is slow, the hedged request is fast
+    fs = LatencyInjectingFileSystem(latencies=[0.5, 0.0])
+    fs.hedge_default_deadline = 0.05
+    fs.content["/bucket/file"] = b"0123456789"
+    begin = time.perf_counter()
+    assert fs.cat_file("/bucket/file", start=2, end=5) == b"234"
+    assert time.perf_counter() - begin < 0.3
+    assert fs.calls == 2
+    assert get_latency_histograms()[fs.endpoint_url]["hedged"] == 1
+    # the slow request is cancelled, so that it releases its slot
+    assert fs.endpoint_stats.limiter.in_flight == 0
+
+
+def test_throttled_read():
+    fs = LatencyInjectingFileSystem(latencies=[0.0], errors=2)
+    fs.read_backoff = 0.001
+    fs.content["/bucket/file"] = b"0123456789"
+    data = fs.cat_ranges(["/bucket/file"] * 2, [0, 5], [2, 7])
+    assert data == [b"01", b"56"]
+    stats = get_latency_histograms()[fs.endpoint_url]
+    assert stats["throttled"] == 2
+    assert stats["concurrency_limit"] < fs.endpoint_stats.limiter.max_limit
+
+
+def test_concurrency_limit():
+    fs = LatencyInjectingFileSystem(latencies=[0.02])
+    fs.content["/bucket/file"] = b"0123456789"
+    limiter = fs.endpoint_stats.limiter
+    limiter.limit = limiter.max_limit = 2
+    # reads of all filesystems of the endpoint share the limit, even from other threads
+    other = threading.Thread(
+        target=fs.cat_ranges, args=(["/bucket/file"] * 8, list(range(8)), [9] * 8)
+    )
+    other.start()
+    data = fs.cat_ranges(["/bucket/file"] * 8, list(range(8)), [9] * 8)
+    other.join()
+    assert data[0] == b"012345678"
+    assert fs.max_in_flight <= 2
+    assert limiter.in_flight == 0
+
+
+def test_hedged_s3_filesystem(s3_endpoint: str):
+    fs = HedgedS3FileSystem(
+        key="key", secret="secret", endpoint_url=s3_endpoint, skip_instance_cache=True
+    )
+    fs.mkdir("bucket")
+    fs.pipe("bucket/file", b"0123456789")
+    # range reads of files, cat_ranges and mappers, e.g., Zarr stores, are all hedged reads
+    with fs.open("bucket/file", block_size=4) as file_obj:
+        file_obj.seek(3)
+        assert file_obj.read(4) == b"3456"
+    assert fs.cat_ranges(["bucket/file"] * 2, [0, 5], [2, 7]) == [b"01", b"56"]
+    assert fs.get_mapper("bucket")["file"] == b"0123456789"
+    assert get_latency_histograms()[s3_endpoint]["count"] == 4
+    # s3 links opened by fsspec, e.g., by xarray, are read by the same filesystem class
+    from tensorlakehouse_openeo_driver.util import object_storage_util  # noqa: F401
+
+    assert fsspec.get_filesystem_class("s3") is HedgedS3FileSystem
+
+
+def test_is_throttling_error():
+    assert is_throttling_error(ThrottlingError())
+    try:
+        try:
+            raise ThrottlingError()
+        except ThrottlingError as e:
+            raise OSError("request failed") from e
+    except OSError as e:
+        assert is_throttling_error(e)
+    assert not is_throttling_error(FileNotFoundError("missing"))
+
+
+def test_endpoint_stats_counters():
+    stats = EndpointStats(max_concurrency=1)
+
+    def add():
+        for _ in range(1000):
+            stats.add_hedged()
+            stats.add_throttled()
+
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.hedged == 8000
+    assert stats.throttled == 8000
@@ -1,4 +1,6 @@
+import io
 from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
 import pytest
 import xarray as xr
 from tensorlakehouse_openeo_driver.constants import (
@@ -233,3 +235,45 @@ def test_load_items(
                             actual_size == expected_size
                         ), f"Error! {dim=} {actual_size=} {expected_size=}"
                     assert array.rio.crs == CRS.from_epsg(crs)
+
+
+@pytest.mark.parametrize(
+    "signature, expected_engine",
+    [
+        (b"\x89HDF\r\n\x1a\n\x00\x00", "h5netcdf"),
+        (b"CDF\x01\x00\x00\x00\x00", "scipy"),
+        (b"CDF\x02\x00\x00\x00\x00", "scipy"),
+    ],
+)
+def test_get_engine(signature: bytes, expected_engine: str):
+    file_obj = io.BytesIO(signature)
+    assert NetCDFFileReader._get_engine(file_obj=file_obj) == expected_engine
+    # the file object must be rewound so that xarray can read it from the beginning
+    assert file_obj.tell() == 0
+
+
+def test_get_engine_invalid_signature():
+    with pytest.raises(ValueError):
+        NetCDFFileReader._get_engine(file_obj=io.BytesIO(b"GRIB\x00\x00\x00\x02"))
+
+
+def test_get_on_disk_chunks():
+    ds = xr.Dataset(
+        {
+            "tas": (
+                (DEFAULT_TIME_DIMENSION, "y", "x"),
+                np.zeros((10, 20, 30)),
+            ),
+            "pr": (
+                (DEFAULT_TIME_DIMENSION, "y", "x"),
+                np.zeros((10, 20, 30)),
+            ),
+            "contiguous": (("y", "x"), np.zeros((20, 30))),
+        }
+    )
+    ds["tas"].encoding["chunksizes"] = (1, 10, 15)
+    ds["pr"].encoding["chunksizes"] = (2, 10, 10)
+    chunks = NetCDFFileReader._get_on_disk_chunks(
+        ds=ds, bands=["tas", "pr", "contiguous"]
+    )
+    assert chunks == {DEFAULT_TIME_DIMENSION: 2, "y": 10, "x": 15}
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tensorlakehouse_openeo_driver.util import object_storage_util
+
+
+@pytest.fixture
+def bucket_credentials(monkeypatch):
+    monkeypatch.setenv("TLH_MYBUCKET_ACCESS_KEY_ID", "my-access-key")
+    monkeypatch.setenv("TLH_MYBUCKET_SECRET_ACCESS_KEY", "my-secret-key")
+    monkeypatch.setenv(
+        "TLH_MYBUCKET_ENDPOINT", "s3.us-south.cloud-object-storage.appdomain.cloud"
+    )
+    monkeypatch.setenv("TLH_OTHERBUCKET_ACCESS_KEY_ID", "my-access-key")
+    monkeypatch.setenv("TLH_OTHERBUCKET_SECRET_ACCESS_KEY", "my-secret-key")
+    monkeypatch.setenv(
+        "TLH_OTHERBUCKET_ENDPOINT", "s3.us-south.cloud-object-storage.appdomain.cloud"
+    )
+    object_storage_util.clear_registry()
+    yield
+    object_storage_util.clear_registry()
+
+
+def test_get_s3filesystem(bucket_credentials):
+    fs = object_storage_util.get_s3filesystem(bucket="my-bucket")
+    # the same instance is reused by all buckets that share endpoint and credentials
+    assert object_storage_util.get_s3filesystem(bucket="my-bucket") is fs
+    assert object_storage_util.get_s3filesystem(bucket="other-bucket") is fs
+    options = object_storage_util.get_s3filesystem_options(bucket="my-bucket")
+    assert options["endpoint_url"].startswith("https://")
+    assert "max_pool_connections" in options["config_kwargs"]
+
+
+def test_get_boto3_session(bucket_credentials):
+    session = object_storage_util.get_boto3_session(bucket="my-bucket")
+    assert object_storage_util.get_boto3_session(bucket="my-bucket") is session
+    assert session.region_name == "us-south"
+    object_storage_util.clear_registry()
+    assert object_storage_util.get_boto3_session(bucket="my-bucket") is not session
+
+
+def test_get_boto3_session_per_thread(bucket_credentials):
+    session = object_storage_util.get_boto3_session(bucket="my-bucket")
+    # boto3 sessions are not thread-safe, so other threads get their own session
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        other = executor.submit(
+            object_storage_util.get_boto3_session, "my-bucket"
+        ).result()
+        assert other is not session
+        assert (
+            executor.submit(object_storage_util.get_boto3_session, "my-bucket").result()
+            is other
+        )
+        # sessions of all threads are discarded when the registry is cleared
+        object_storage_util.clear_registry()
+        assert (
+            executor.submit(object_storage_util.get_boto3_session, "my-bucket").result()
+            is not other
+        )
+    credentials = session.get_credentials()
+    assert credentials.access_key == other.get_credentials().access_key
@@ -0,0 +1,173 @@
+import pickle
+import time
+from typing import Dict, Tuple
+
+import dask
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from distributed import Client, LocalCluster
+from fsspec.implementations.memory import MemoryFileSystem
+
+from tensorlakehouse_openeo_driver.util import prefetch
+from tensorlakehouse_openeo_driver.util.prefetch import (
+    Prefetcher,
+    get_index_ranges,
+    plan_chunk_keys,
+)
+
+
+def _create_store(path: str):
+    fs = MemoryFileSystem(skip_instance_cache=True)
+    store = fs.get_mapper(path)
+    ds = xr.Dataset(
+        {
+            band: (("time", "y", "x"), np.random.rand(6, 4, 4))
+            for band in ["B02", "B03"]
+        },
+        coords={
+            "time": pd.date_range("2024-01-01", periods=6),
+            "y": np.arange(4),
+            "x": np.arange(4),
+        },
+    )
+    ds.chunk({"time": 1, "y": 2, "x": 2}).to_zarr(store, mode="w")
+    return store, ds
+
+
+def test_plan_chunk_keys():
+    store, ds = _create_store(path="/plan.zarr")
+    source = xr.open_zarr(store)
+    subset = source["B02"].isel(time=slice(1, 3), y=slice(0, 2), x=slice(2, 4))
+    index_ranges = get_index_ranges(source=source, subset=subset)
+    assert index_ranges == {"time": (1, 3), "y": (0, 2), "x": (2, 4)}
+    keys = plan_chunk_keys(
+        store=store, variables=["B02", "B03"], index_ranges=index_ranges
+    )
+    # chunks that intersect the selection in temporal order, variables interleaved
+    assert keys == ["B02/1.0.1", "B03/1.0.1", "B02/2.0.1", "B03/2.0.1"]
+
+
+def test_prefetcher():
+    store, ds = _create_store(path="/prefetch.zarr")
+    prefetcher = Prefetcher(window=2, max_bytes=2**20)
+    prefetching_store = prefetcher.wrap(store=store)
+    source = xr.open_zarr(prefetching_store)
+    subset = source[["B02", "B03"]].isel(y=slice(0, 2)).to_array(dim="bands")
+    keys = plan_chunk_keys(
+        store=prefetching_store,
+        variables=["B02", "B03"],
+        index_ranges=get_index_ranges(source=source, subset=subset),
+    )
+    prefetcher.add_keys(store=prefetching_store, keys=keys)
+    # dask reads the chunks one after another in its own order
+    with dask.config.set(scheduler="synchronous"):
+        values = subset.values
+    np.testing.assert_array_equal(values[0], ds["B02"].values[:, 0:2])
+    np.testing.assert_array_equal(values[1], ds["B03"].values[:, 0:2])
+    assert prefetcher.hits > 0
+    assert prefetcher.hits + prefetcher.misses == len(keys)
+    assert len(prefetcher.futures) == 0 and prefetcher.buffered_bytes == 0
+    prefetcher.cancel()
+
+
+def test_max_bytes():
+    store, ds = _create_store(path="/max_bytes.zarr")
+    # the first chunk exceeds the cap, so that no other chunk is fetched before it is consumed
+    prefetcher = Prefetcher(window=1, max_bytes=1)
+    prefetching_store = prefetcher.wrap(store=store)
+    keys = ["B02/0.0.0", "B02/1.0.0", "B02/2.0.0"]
+    prefetcher.add_keys(store=prefetching_store, keys=keys)
+    assert prefetching_store["B02/2.0.0"] == store["B02/2.0.0"]
+    for _ in range(100):
+        if prefetcher.buffered_bytes > 0:
+            break
+        time.sleep(0.01)
+    assert prefetcher.in_flight == 0
+    assert list(prefetcher.futures) == [0]
+    assert prefetching_store["B02/0.0.0"] == store["B02/0.0.0"]
+    assert prefetcher.hits == 1
+    prefetcher.cancel()
+
+
+def test_cancel_job():
+    with prefetch.job_context(job_id="job-1"):
+        prefetcher = prefetch.create_prefetcher()
+        assert prefetcher is not None
+        assert not prefetcher.cancelled
+    assert prefetcher.cancelled
+    assert prefetch.cancel_job(job_id="job-1") == 0
+
+
+def test_plan_chunks_best_effort():
+    # stores that do not behave like Zarr stores are read without prefetching
+    prefetcher = Prefetcher(window=1)
+    prefetching_store = prefetcher.wrap(store=None)  # type: ignore[arg-type]
+    source = xr.Dataset({"B02": ("x", np.zeros(2))}, coords={"x": [0, 1]})
+    planned = prefetcher.plan_chunks(
+        store=prefetching_store,
+        variables=["B02"],
+        source=source,
+        subset=source["B02"],
+    )
+    assert planned == 0 and len(prefetcher.plan) == 0
+    prefetcher.cancel()
+
+
+def test_pickle():
+    store = {f"B02/{i}.0.0": bytes([i]) for i in range(2)}
+    prefetcher = Prefetcher(window=1)
+    prefetching_store = prefetcher.wrap(store=store)
+    prefetcher.add_keys(store=prefetching_store, keys=["B02/0.0.0", "B02/1.0.0"])
+    # other processes read the store through a replica of the prefetcher
+    unpickled_store = pickle.loads(pickle.dumps(prefetching_store))
+    assert isinstance(unpickled_store, prefetch.PrefetchingStore)
+    replica = unpickled_store.prefetcher
+    assert replica is not prefetcher and replica.replica
+    assert replica.plan == prefetcher.plan
+    assert unpickled_store["B02/0.0.0"] == store["B02/0.0.0"]
+    assert unpickled_store["B02/1.0.0"] == store["B02/1.0.0"]
+    assert replica.hits == 1
+    # stores that are unpickled later share the replica
+    assert pickle.loads(pickle.dumps(prefetching_store)).prefetcher is replica
+    with pytest.raises(PermissionError):
+        unpickled_store["B02/0.0.0"] = b""
+    replica.cancel()
+    prefetcher.cancel()
+
+
+def _read_chunks(
+    store: prefetch.PrefetchingStore, keys
+) -> Tuple[Dict[str, bytes], int, int]:
+    chunks = {key: store[key] for key in keys}
+    return chunks, store.prefetcher.hits, store.prefetcher.misses
+
+
+def _is_cancelled(prefetcher_id: str) -> bool:
+    return prefetch._replicas[prefetcher_id].cancelled
+
+
+def test_distributed():
+    store = {f"B02/{i}.0.0": bytes([i]) * 1024 for i in range(8)}
+    keys = list(store)
+    with prefetch.job_context(job_id="job-distributed"):
+        prefetcher = prefetch.create_prefetcher()
+        assert prefetcher is not None
+        prefetching_store = prefetcher.wrap(store=store)
+        prefetcher.add_keys(store=prefetching_store, keys=keys)
+        with LocalCluster(
+            n_workers=1, threads_per_worker=1, processes=True, dashboard_address=None
+        ) as cluster, Client(cluster) as client:
+            # the store is pickled and the chunks are read by the worker process
+            store_future = client.scatter(prefetching_store)
+            chunks, hits, misses = client.submit(
+                _read_chunks, store_future, keys
+            ).result()
+            assert chunks == store
+            # the first read starts the replica on the worker, which prefetches the others
+            assert hits == len(keys) - 1 and misses == 1
+            assert prefetcher.hits == 0 and prefetcher.misses == 0
+            # the job cancels the replicas of the workers
+            assert prefetch.cancel_job(job_id="job-distributed") == 2
+            assert all(client.run(_is_cancelled, prefetcher.prefetcher_id).values())
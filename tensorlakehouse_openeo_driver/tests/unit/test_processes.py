@@ -8,7 +8,11 @@ from tensorlakehouse_openeo_driver.constants import (
     DEFAULT_X_DIMENSION,
     DEFAULT_Y_DIMENSION,
 )
+from tensorlakehouse_openeo_driver.process_implementations.load_collection import (
+    AbstractLoadCollection,
+)
 from tensorlakehouse_openeo_driver.processes import (
+    to_epsg4326,
     rename_dimension,
     rename_labels,
     aggregate_temporal,
@@ -16,16 +20,22 @@ from tensorlakehouse_openeo_driver.processes import (
     resample_cube_spatial,
     merge_cubes,
     aggregate_temporal_period,
+    aggregate_spatial,
+    mean,
 )
 from tensorlakehouse_openeo_driver.processing import TensorlakehouseProcessing
 from tensorlakehouse_openeo_driver.tests.unit.unit_test_util import (
     generate_xarray,
     validate_raster_datacube,
 )
+import dask_geopandas
+import geopandas as gpd
 import pandas as pd
 import pytest
 import numpy as np
 from rasterio import crs
+from shapely.geometry import box
+from tensorlakehouse_openeo_driver.util import crs_util
 
 
 @pytest.mark.parametrize("source,target", [(DEFAULT_X_DIMENSION, "x_new")])
@@ -279,3 +289,63 @@ def test_resample_cube_spatial(source_data, target_data):
         aligned_coords = aligned[dim].values
         target_coords = target[dim].values
         assert np.array_equal(aligned_coords, target_coords)
+
+
+@pytest.mark.parametrize("chunks", [None, {DEFAULT_TIME_DIMENSION: 2}])
+def test_aggregate_spatial(chunks):
+    array = generate_xarray(
+        temporal_extent=(pd.Timestamp(2020, 1, 1), pd.Timestamp(2020, 1, 5)),
+        latmax=50,
+        latmin=40,
+        lonmax=-80,
+        lonmin=-90,
+        bands=["B02", "B03"],
+        num_periods=5,
+        freq=None,
+    )
+    # the last polygon overlaps the first one
+    polygons = [
+        box(-89.0, 41.0, -87.0, 43.0),
+        box(-85.0, 45.0, -84.5, 45.5),
+        box(-82.0, 41.0, -81.0, 49.0),
+        box(-88.0, 42.0, -86.0, 44.0),
+    ]
+    geometries = gpd.GeoDataFrame(geometry=polygons, crs="EPSG:4326")
+    if chunks is not None:
+        array = array.chunk(chunks)
+    result = aggregate_spatial(data=array, geometries=geometries, reducer=mean)
+    assert isinstance(result, dask_geopandas.GeoDataFrame)
+    result = result.compute()
+    assert isinstance(result, gpd.GeoDataFrame)
+    assert result.crs == geometries.crs
+    assert len(result) == len(polygons) * array.sizes[DEFAULT_BANDS_DIMENSION] * 5
+    for polygon in polygons:
+        rows = result[result.geometry == polygon]
+        clipped = array.rio.clip([polygon], crs="EPSG:4326")
+        expected_mean = clipped.mean(dim=[DEFAULT_X_DIMENSION, DEFAULT_Y_DIMENSION])
+        expected_count = clipped.count(dim=[DEFAULT_X_DIMENSION, DEFAULT_Y_DIMENSION])
+        for _, row in rows.iterrows():
+            selection = {
+                DEFAULT_BANDS_DIMENSION: row[DEFAULT_BANDS_DIMENSION],
+                DEFAULT_TIME_DIMENSION: row[DEFAULT_TIME_DIMENSION],
+            }
+            assert row["count"] == int(expected_count.sel(selection))
+            assert row["reduced"] == pytest.approx(float(expected_mean.sel(selection)))
+
+
+@pytest.mark.parametrize("convert", [to_epsg4326, AbstractLoadCollection._to_epsg4326])
+def test_to_epsg4326_densified(convert):
+    # UTM zone 33N box, whose north edge bulges northwards in EPSG:4326
+    lonmin, latmin, lonmax, latmax = 300000.0, 5000000.0, 700000.0, 5500000.0
+    utm = crs_util.get_crs(crs_code=32633)
+    west, south, east, north = convert(
+        latmax=latmax, latmin=latmin, lonmax=lonmax, lonmin=lonmin, crs_from=utm
+    )
+    corners = crs_util.transform_bounds(
+        bbox=(lonmin, latmin, lonmax, latmax),
+        crs_from=utm,
+        crs_to=4326,
+        densify_pts=None,
+    )
+    assert west <= corners[0] and south <= corners[1]
+    assert east >= corners[2] and north > corners[3]
@@ -0,0 +1,73 @@
+import json
+from typing import Any, Dict, Optional
+
+import pytest
+
+from tensorlakehouse_openeo_driver.stac import rest
+from tensorlakehouse_openeo_driver.stac.stac import STAC
+from tensorlakehouse_openeo_driver.util.reference_index import _get_array_dimensions
+
+URL = "https://stac.example.com"
+
+
+class MockResponse:
+    def __init__(self, page: Dict[str, Any]) -> None:
+        self._page = page
+
+    def json(self) -> Dict[str, Any]:
+        return self._page
+
+
+def _make_pages(num_items: int, page_size: int) -> Dict[str, Dict[str, Any]]:
+    """pages of items keyed by url, linked by "next" links"""
+    pages = dict()
+    url = f"{URL}/collections/test/items/"
+    for start in range(0, num_items, page_size):
+        stop = min(start + page_size, num_items)
+        page: Dict[str, Any] = {
+            "features": [{"id": str(i)} for i in range(start, stop)],
+            "links": [],
+        }
+        if stop < num_items:
+            next_url = f"{URL}/collections/test/items/?token={stop}"
+            page["links"].append({"rel": "next", "href": next_url})
+        pages[url] = page
+        url = f"{URL}/collections/test/items/?token={stop}"
+    return pages
+
+
+@pytest.mark.parametrize(
+    "limit, expected",
+    [(None, 25), (7, 7), (20, 20)],
+)
+def test_iter_items(monkeypatch, limit: Optional[int], expected: int):
+    pages = _make_pages(num_items=25, page_size=10)
+    requested_urls = list()
+
+    def mock_get(url: str, headers: Dict, params: Optional[Dict[str, Any]] = None):
+        requested_urls.append(url)
+        return MockResponse(page=pages[url])
+
+    monkeypatch.setattr(rest, "get", mock_get)
+    items = list(STAC(url=URL).iter_items(collection_id="test", limit=limit))
+    assert [item["id"] for item in items] == [str(i) for i in range(expected)]
+    # pages after the limit are not requested
+    assert len(requested_urls) == (expected + 9) // 10
+
+
+def test_get_array_dimensions():
+    refs = {
+        "version": 1,
+        "refs": {
+            ".zattrs": json.dumps({"title": "test"}),
+            "time/.zattrs": json.dumps({"_ARRAY_DIMENSIONS": ["time"]}),
+            "lat/.zattrs": {"_ARRAY_DIMENSIONS": ["lat"]},
+            "tas/.zattrs": json.dumps({"_ARRAY_DIMENSIONS": ["time", "lat"]}),
+            "tas/0.0": ["s3://bucket/file.nc", 100, 200],
+        },
+    }
+    assert _get_array_dimensions(refs=refs) == {
+        "time": ["time"],
+        "lat": ["lat"],
+        "tas": ["time", "lat"],
+    }
@@ -0,0 +1,265 @@
+import json
+import zipfile
+from pathlib import Path
+
+import dask_geopandas
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from rasterio.io import MemoryFile
+import xarray as xr
+import zarr
+from openeo_driver.errors import ProcessParameterInvalidException
+from openeo_pg_parser_networkx.pg_schema import BoundingBox, TemporalInterval
+from shapely.geometry import box
+
+from tensorlakehouse_openeo_driver import processes
+
+from tensorlakehouse_openeo_driver.constants import (
+    COG_COMPRESSION,
+    DEFAULT_BANDS_DIMENSION,
+    DEFAULT_TIME_DIMENSION,
+    GEOJSON,
+    GEOTIFF_PREFIX,
+    GTIFF,
+    NETCDF,
+    PARQUET,
+    ZARR,
+)
+from tensorlakehouse_openeo_driver.driver_data_cube import TensorLakehouseDataCube
+from tensorlakehouse_openeo_driver.save_result import GeoDNImageCollectionResult
+
+
+def _make_vector_cube(npartitions: int) -> dask_geopandas.GeoDataFrame:
+    n = 12
+    gdf = gpd.GeoDataFrame(
+        {
+            "bands": ["B02", "B03"] * (n // 2),
+            "time": pd.date_range("2020-01-01", periods=n, freq="D"),
+            "count": np.arange(n, dtype=np.float64),
+            "reduced": np.linspace(0, 1, n),
+        },
+        geometry=[box(500000 + i, 0, 500001 + i, 1) for i in range(n)],
+        crs="EPSG:32633",
+    )
+    gdf.loc[3, "reduced"] = np.nan
+    return dask_geopandas.from_geopandas(gdf, npartitions=npartitions)
+
+
+@pytest.mark.parametrize("npartitions", [1, 3])
+def test_save_result_parquet(tmp_path: Path, npartitions: int):
+    data = _make_vector_cube(npartitions=npartitions)
+    filename = str(tmp_path / "result.parquet")
+    result = GeoDNImageCollectionResult(
+        cube=TensorLakehouseDataCube(data=data), format=PARQUET
+    )
+    assert result.save_result(filename=filename) == filename
+    saved = gpd.read_parquet(filename)
+    expected = data.compute().reset_index(drop=True)
+    assert saved.crs == expected.crs
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(saved.drop(columns="geometry")),
+        pd.DataFrame(expected.drop(columns="geometry")),
+        # string columns differ by storage (python vs pyarrow) only
+        check_dtype=False,
+    )
+    assert saved.geometry.geom_equals(expected.geometry).all()
+
+
+def test_save_result_geojson(tmp_path: Path):
+    data = _make_vector_cube(npartitions=3)
+    filename = str(tmp_path / "result.geojson")
+    result = GeoDNImageCollectionResult(
+        cube=TensorLakehouseDataCube(data=data), format=GEOJSON
+    )
+    result.save_result(filename=filename)
+    with open(filename) as f:
+        collection = json.load(f)
+    assert collection["type"] == "FeatureCollection"
+    assert len(collection["features"]) == 12
+    properties = collection["features"][3]["properties"]
+    assert properties["reduced"] is None
+    assert properties["time"] == "2020-01-04T00:00:00"
+    saved = gpd.read_file(filename)
+    # coordinates are reprojected to WGS84
+    assert saved.total_bounds[0] == pytest.approx(15.0, abs=0.01)
+
+
+def _make_raster_cube() -> xr.DataArray:
+    np.random.seed(4)
+    data = np.random.rand(2, 3, 20, 30).astype(np.float32)
+    data[0, 0, :5, :5] = np.nan
+    cube = xr.DataArray(
+        data,
+        dims=[DEFAULT_BANDS_DIMENSION, DEFAULT_TIME_DIMENSION, "y", "x"],
+        coords={
+            DEFAULT_BANDS_DIMENSION: ["B02", "B03"],
+            DEFAULT_TIME_DIMENSION: pd.date_range("2020-01-01", periods=3),
+            "y": np.arange(20)[::-1] + 0.5,
+            "x": np.arange(30) + 0.5,
+        },
+        # values that NetCDF cannot store as attributes
+        attrs={"valid": True, "metadata": {"a": 1}},
+    )
+    with_crs: xr.DataArray = cube.rio.write_crs("EPSG:32633")
+    return with_crs
+
+
+@pytest.mark.parametrize(
+    "options, expected_chunks",
+    [
+        (None, (1, 10, 30)),
+        (
+            {"compression": "zlib", "compression_level": 9, "chunks": {"x": 15}},
+            (1, 10, 15),
+        ),
+        ({"compression": None}, (1, 10, 30)),
+    ],
+)
+def test_save_result_netcdf(tmp_path: Path, options, expected_chunks):
+    cube = _make_raster_cube()
+    filename = str(tmp_path / "result.nc")
+    result = GeoDNImageCollectionResult(
+        cube=TensorLakehouseDataCube(
+            data=cube.chunk({DEFAULT_TIME_DIMENSION: 1, "y": 10})
+        ),
+        format=NETCDF,
+        options=options,
+    )
+    assert result.save_result(filename=filename) == filename
+    with xr.open_dataset(filename, engine="netcdf4") as saved:
+        assert saved.attrs["valid"] == "True"
+        encoding = saved["B02"].encoding
+        assert encoding["chunksizes"] == expected_chunks
+        compressed = options is None or options.get("compression") is not None
+        assert encoding.get("zlib", False) == compressed
+        for band in ["B02", "B03"]:
+            np.testing.assert_array_equal(
+                saved[band].values, cube.sel({DEFAULT_BANDS_DIMENSION: band}).values
+            )
+
+
+def test_save_result_geotiff_zip(tmp_path: Path):
+    cube = _make_raster_cube()
+    # a slice without data is not stored
+    cube[:, 2] = np.nan
+    filename = str(tmp_path / "result.gtiff")
+    result = GeoDNImageCollectionResult(
+        cube=TensorLakehouseDataCube(data=cube.chunk({DEFAULT_TIME_DIMENSION: 1})),
+        format=GTIFF,
+    )
+    filename = result.save_result(filename=filename)
+    assert filename.endswith(".zip")
+    with zipfile.ZipFile(filename) as zipf:
+        names = sorted(zipf.namelist())
+        assert names == [
+            f"{GEOTIFF_PREFIX}_2020-01-01T00-00-00Z.tif",
+            f"{GEOTIFF_PREFIX}_2020-01-02T00-00-00Z.tif",
+        ]
+        with MemoryFile(zipf.read(names[1])) as memfile, memfile.open() as dataset:
+            assert dataset.profile["tiled"]
+            assert dataset.profile["compress"] == COG_COMPRESSION.lower()
+            np.testing.assert_array_equal(
+                dataset.read(), cube.isel({DEFAULT_TIME_DIMENSION: 1}).values
+            )
+
+
+def test_save_result_geotiff_zip_subsecond(tmp_path: Path):
+    cube = _make_raster_cube()
+    # timestamps that have the same name at a resolution of one second
+    cube = cube.assign_coords(
+        {
+            DEFAULT_TIME_DIMENSION: pd.to_datetime(
+                [
+                    "2020-01-01 00:00:00.0",
+                    "2020-01-01 00:00:00.5",
+                    "2020-01-01 00:00:00.7",
+                ]
+            )
+        }
+    )
+    filename = str(tmp_path / "result.gtiff")
+    result = GeoDNImageCollectionResult(
+        cube=TensorLakehouseDataCube(data=cube.chunk({DEFAULT_TIME_DIMENSION: 1})),
+        format=GTIFF,
+    )
+    filename = result.save_result(filename=filename)
+    with zipfile.ZipFile(filename) as zipf:
+        assert sorted(zipf.namelist()) == [
+            f"{GEOTIFF_PREFIX}_2020-01-01T00-00-00Z.tif",
+            f"{GEOTIFF_PREFIX}_2020-01-01T00-00-00Z_1.tif",
+            f"{GEOTIFF_PREFIX}_2020-01-01T00-00-00Z_2.tif",
+        ]
+
+
+@pytest.mark.parametrize("zipped", [True, False])
+def test_save_result_zarr(tmp_path: Path, zipped: bool):
+    cube = _make_raster_cube()
+    filename = str(tmp_path / ("result.zarr.zip" if zipped else "result.zarr"))
+    # irregular chunks along y are made regular
+    data = cube.chunk({DEFAULT_TIME_DIMENSION: 1, "y": (5, 10, 5)})
+    result = GeoDNImageCollectionResult(
+        cube=TensorLakehouseDataCube(data=data),
+        format=ZARR,
+        options={"zipped": zipped},
+    )
+    assert result.save_result(filename=filename) == filename
+    assert Path(filename).is_dir() != zipped
+    if zipped:
+        store = zarr.storage.ZipStore(filename, mode="r")
+    else:
+        store = filename
+    # fails if the metadata is not consolidated
+    with xr.open_zarr(store, consolidated=True) as saved:
+        assert saved["B02"].encoding["chunks"] == (1, 10, 30)
+        assert saved.attrs["valid"] == "True"
+        for band in ["B02", "B03"]:
+            np.testing.assert_array_equal(
+                saved[band].values, cube.sel({DEFAULT_BANDS_DIMENSION: band}).values
+            )
+
+
+def test_save_result_zarr_zipped_remote():
+    result = GeoDNImageCollectionResult(
+        cube=TensorLakehouseDataCube(data=_make_raster_cube()), format=ZARR
+    )
+    # a zip file cannot be written in parallel to object storage
+    with pytest.raises(ValueError):
+        result.save_result(filename="s3://bucket/result.zarr.zip")
+
+
+def test_load_result(tmp_path: Path, monkeypatch):
+    # the result of the batch job is a zarr store, which load_result opens lazily
+    monkeypatch.setattr(
+        processes,
+        "get_result_store_url",
+        lambda job_id: str(tmp_path / f"{job_id}.zarr"),
+    )
+    cube = _make_raster_cube()
+    result = GeoDNImageCollectionResult(
+        cube=TensorLakehouseDataCube(data=cube.chunk({DEFAULT_TIME_DIMENSION: 1})),
+        format=ZARR,
+        options={"zipped": False},
+    )
+    result.save_result(filename=str(tmp_path / "job-1.zarr"))
+    loaded = processes.load_result(
+        id="job-1",
+        spatial_extent=BoundingBox(west=5, south=0, east=10, north=10, crs=32633),
+        temporal_extent=TemporalInterval(["2020-01-02", "2020-01-03"]),
+        bands=["B03"],
+    )
+    assert loaded.chunks is not None
+    expected = cube.sel(
+        {
+            DEFAULT_BANDS_DIMENSION: ["B03"],
+            DEFAULT_TIME_DIMENSION: ["2020-01-02"],
+            "x": slice(5, 10),
+            "y": slice(10, 0),
+        }
+    )
+    np.testing.assert_array_equal(loaded.values, expected.values)
+    with pytest.raises(ProcessParameterInvalidException):
+        processes.load_result(id="job-1", bands=["B04"])
+    with pytest.raises(ProcessParameterInvalidException):
+        processes.load_result(id="job-2")
@@ -1,11 +1,25 @@
+import gc
+import sys
+import types
+from pathlib import Path
 from typing import Dict, List, Tuple
+
+import dask
+import dask.array
+import fsspec
+import numpy as np
+import pandas as pd
 import pytest
 import xarray as xr
 
 
+from tensorlakehouse_openeo_driver.file_reader.cloud_storage_file_reader import (
+    CloudStorageFileReader,
+)
 from tensorlakehouse_openeo_driver.file_reader.standard_file_reader import (
     FSTDFileReader,
 )
+from tensorlakehouse_openeo_driver.util.disk_cache import DiskCache
 from datetime import datetime
 from rasterio.crs import CRS
 
@@ -87,3 +101,82 @@ def test_load_items(
             actual_size == expected_size
         ), f"Error! {dim=} {actual_size=} {expected_size=}"
     assert array.rio.crs == CRS.from_epsg(crs)
+
+
+class _Buffer:
+    """minimal fstd2nc.Buffer, which reads the headers when it is opened and the records of
+    the file when the array is computed, i.e., the file must exist until then"""
+
+    def __init__(self, filename: str, vars: List[str], forecast_axis: bool):
+        self.filename = filename
+        self.vars = vars
+
+    def to_xarray(self) -> xr.Dataset:
+        day = Path(self.filename).read_bytes()[0]
+
+        def read_records(filename: str) -> np.ndarray:
+            return np.full((1, 4, 4), Path(filename).read_bytes()[0], dtype=np.float32)
+
+        records = dask.array.from_delayed(
+            dask.delayed(read_records)(self.filename), shape=(1, 4, 4), dtype=np.float32
+        )
+        return xr.Dataset(
+            {var: (("time", "rlat1", "rlon1"), records) for var in self.vars},
+            coords={
+                "time": [pd.Timestamp("2020-01-01") + pd.Timedelta(days=day)],
+                "rlat1": np.arange(4, dtype=float)[::-1],
+                "rlon1": np.arange(4, dtype=float),
+            },
+        )
+
+
+def test_load_items_more_than_cache(tmp_path: Path, monkeypatch):
+    fs = fsspec.filesystem("memory")
+    items = list()
+    for day in range(3):
+        url = f"memory://bucket/file{day}.fst"
+        fs.pipe(url, bytes([day]) * 6)
+        items.append(
+            {
+                "assets": {"data": {"href": url}},
+                "properties": {
+                    "cube:dimensions": {
+                        "rlat1": {
+                            "axis": "y",
+                            "type": "spatial",
+                            "reference_system": 4326,
+                        },
+                        "rlon1": {
+                            "axis": "x",
+                            "type": "spatial",
+                            "reference_system": 4326,
+                        },
+                        "time": {"type": "temporal"},
+                    }
+                },
+            }
+        )
+    # the cache holds a single file
+    cache = DiskCache(cache_dir=tmp_path / "fstd", max_bytes=10)
+    monkeypatch.setattr(FSTDFileReader, "file_cache", cache)
+    monkeypatch.setattr(
+        CloudStorageFileReader, "_get_s3filesystem_by_url", staticmethod(lambda url: fs)
+    )
+    monkeypatch.setitem(sys.modules, "fstd2nc", types.SimpleNamespace(Buffer=_Buffer))
+    reader = FSTDFileReader(
+        items=items,
+        bbox=(0.0, 0.0, 3.0, 3.0),
+        temporal_extent=(datetime(2020, 1, 1), datetime(2020, 1, 5)),
+        bands=["TT"],
+        properties=None,
+    )
+    array = reader.load_items()
+    # the local copies are kept until the array has been computed
+    assert cache.size() == 18
+    np.testing.assert_array_equal(
+        array.isel(rlat1=0, rlon1=0).values.ravel(), [0, 1, 2]
+    )
+    # the local copies are evicted once the array is released
+    del array
+    gc.collect()
+    assert cache.evict() == 2
@@ -0,0 +1,101 @@
+import time
+
+import dask
+import numpy as np
+import pytest
+import xarray as xr
+from distributed import Client, LocalCluster
+from openeo_driver.errors import ProcessParameterInvalidException
+
+from tensorlakehouse_openeo_driver.processes import run_udf
+from tensorlakehouse_openeo_driver.util import udf_runtime
+
+UDF = """
+import numpy as np
+
+def scale(data, context):
+    factor = 2 if context is None else context["factor"]
+    return np.where(np.isnan(data), -1, data * factor)
+"""
+
+
+def _make_cube() -> xr.DataArray:
+    np.random.seed(3)
+    data = np.random.rand(2, 3, 8, 10)
+    data[0, 0, 0, 0] = np.nan
+    return xr.DataArray(
+        data, dims=["bands", "t", "y", "x"], coords={"bands": ["B02", "B03"]}
+    )
+
+
+def test_compile_udf():
+    name, code = udf_runtime.compile_udf(UDF)
+    assert name == "scale"
+    # the code is compiled only once
+    assert udf_runtime.compile_udf(UDF)[1] is code
+    with pytest.raises(ValueError):
+        udf_runtime.compile_udf("x = 1")
+    with pytest.raises(SyntaxError):
+        udf_runtime.compile_udf("def f(:")
+
+
+@pytest.mark.parametrize("chunks", [None, {"t": 1, "x": 5}])
+def test_run_udf(chunks):
+    cube = _make_cube()
+    expected = np.where(np.isnan(cube.values), -1, cube.values * 3)
+    if chunks is not None:
+        cube = cube.chunk(chunks)
+    result = run_udf(data=cube, udf=UDF, runtime="Python", context={"factor": 3})
+    if chunks is not None:
+        # one task per chunk
+        assert result.chunks == cube.chunks
+    assert result.dims == cube.dims
+    np.testing.assert_array_equal(result["bands"].values, cube["bands"].values)
+    np.testing.assert_allclose(result.values, expected)
+
+
+@pytest.mark.parametrize("chunks", [None, {"t": 1}])
+def test_run_udf_shape(chunks):
+    udf = "def f(data, context):\n    return data.sum(axis=0)\n"
+    cube = _make_cube()
+    if chunks is not None:
+        cube = cube.chunk(chunks)
+    # reducing UDFs are rejected before any chunk is processed
+    with pytest.raises(ProcessParameterInvalidException, match="shape of its input"):
+        run_udf(data=cube, udf=udf, runtime="Python")
+
+
+def test_run_udf_timeout():
+    udf = "import time\n\ndef f(data, context):\n    time.sleep(60)\n    return data\n"
+    with pytest.raises(TimeoutError):
+        udf_runtime.run_udf(data=_make_cube(), source=udf, context=None, timeout=1)
+    # the stuck processes are replaced
+    result = udf_runtime.run_udf(data=_make_cube(), source=UDF, context=None)
+    np.testing.assert_allclose(
+        result.isel(bands=1).values, _make_cube().isel(bands=1).values * 2
+    )
+
+
+def test_run_udf_dead_process():
+    udf = "import os\n\ndef f(data, context):\n    os._exit(1)\n"
+    begin = time.monotonic()
+    with pytest.raises(RuntimeError, match="died"):
+        udf_runtime.run_udf(data=_make_cube(), source=udf, context=None, timeout=60)
+    # the caller does not wait for the timeout
+    assert time.monotonic() - begin < 30
+    # the pool is replaced
+    result = udf_runtime.run_udf(data=_make_cube(), source=UDF, context=None)
+    np.testing.assert_allclose(
+        result.isel(bands=1).values, _make_cube().isel(bands=1).values * 2
+    )
+
+
+def test_run_udf_distributed():
+    cube = _make_cube()
+    expected = np.where(np.isnan(cube.values), -1, cube.values * 2)
+    # as in local_app.make_dask_client, chunks are processed by worker processes
+    with dask.config.set(udf_runtime.DASK_CONFIG), LocalCluster(
+        n_workers=1, threads_per_worker=2, processes=True, dashboard_address=None
+    ) as cluster, Client(cluster):
+        result = run_udf(data=cube.chunk({"t": 1}), udf=UDF, runtime="Python")
+        np.testing.assert_allclose(result.values, expected)
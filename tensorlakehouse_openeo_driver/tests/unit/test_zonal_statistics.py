@@ -0,0 +1,168 @@
+import dask.array
+import geopandas as gpd
+import numpy as np
+import pytest
+import xarray as xr
+from shapely.geometry import box
+
+from tensorlakehouse_openeo_driver.util import zonal_statistics
+
+
+def _make_cube(size: int = 40) -> xr.DataArray:
+    np.random.seed(0)
+    data = np.random.rand(2, 3, size, size)
+    # some nodata pixels
+    data[0, 0, :5, :5] = np.nan
+    cube = xr.DataArray(
+        data,
+        dims=["bands", "t", "y", "x"],
+        coords={
+            "bands": ["B02", "B03"],
+            "t": np.arange(3),
+            # pixel centers, north-up
+            "y": np.arange(size)[::-1] + 0.5,
+            "x": np.arange(size) + 0.5,
+        },
+    )
+    with_crs: xr.DataArray = cube.rio.write_crs("EPSG:32633")
+    return with_crs
+
+
+def test_assign_layers():
+    geometries = [box(0, 0, 2, 2), box(1, 1, 3, 3), box(5, 5, 6, 6), box(1.5, 0, 4, 1)]
+    layers = zonal_statistics.assign_layers(geometries=geometries)
+    assert layers[0] == 0 and layers[2] == 0
+    assert layers[1] != layers[0]
+    assert layers[3] not in (layers[0], layers[1])
+
+
+@pytest.mark.parametrize("chunks", [None, {"t": 1, "x": 10, "y": 10}])
+def test_zonal_statistics(chunks):
+    cube = _make_cube()
+    # a grid of 64 parcels plus a large polygon that overlaps all of them
+    parcels = [
+        box(i * 5, j * 5, i * 5 + 4, j * 5 + 4) for i in range(8) for j in range(8)
+    ]
+    polygons = parcels + [box(2, 2, 30, 30)]
+    geometries = gpd.GeoSeries(polygons, crs="EPSG:32633")
+    if chunks is not None:
+        cube = cube.chunk(chunks)
+    result = zonal_statistics.zonal_statistics(
+        data=cube,
+        geometries=geometries,
+        statistics={
+            "count": zonal_statistics.COUNT,
+            "mean": zonal_statistics.MEAN,
+            "min": zonal_statistics.MIN,
+            "max": zonal_statistics.MAX,
+            "median": zonal_statistics.MEDIAN,
+            "std": np.nanstd,
+        },
+        x_dim="x",
+        y_dim="y",
+    )
+    assert result.sizes[zonal_statistics.GEOMETRY_DIM] == len(polygons)
+    for i in [0, 9, 63, 64]:
+        clipped = cube.rio.clip([polygons[i]], crs="EPSG:32633")
+        selected = result.isel({zonal_statistics.GEOMETRY_DIM: i})
+        np.testing.assert_array_equal(
+            selected["count"].values, clipped.count(dim=["x", "y"]).values
+        )
+        np.testing.assert_allclose(
+            selected["mean"].values, clipped.mean(dim=["x", "y"]).values
+        )
+        np.testing.assert_allclose(
+            selected["min"].values, clipped.min(dim=["x", "y"]).values
+        )
+        np.testing.assert_allclose(
+            selected["max"].values, clipped.max(dim=["x", "y"]).values
+        )
+        np.testing.assert_allclose(
+            selected["median"].values, clipped.median(dim=["x", "y"]).values
+        )
+        np.testing.assert_allclose(
+            selected["std"].values, clipped.std(dim=["x", "y"]).values
+        )
+
+
+@pytest.mark.parametrize("chunks", [None, {"t": 1, "x": 10, "y": 10}])
+def test_zonal_statistics_decomposable(chunks):
+    cube = _make_cube()
+    # the first parcel covers the nodata pixels of the first band and time, the second one
+    # spans four blocks and the third one is outside the cube
+    polygons = [box(0, 35, 5, 40), box(3, 3, 27, 17), box(50, 50, 60, 60)]
+    geometries = gpd.GeoSeries(polygons, crs="EPSG:32633")
+    if chunks is not None:
+        cube = cube.chunk(chunks)
+    names = [
+        zonal_statistics.COUNT,
+        zonal_statistics.SUM,
+        zonal_statistics.MEAN,
+        zonal_statistics.MIN,
+        zonal_statistics.MAX,
+        zonal_statistics.STD,
+    ]
+    result = zonal_statistics.zonal_statistics(
+        data=cube,
+        geometries=geometries,
+        statistics={name: name for name in names},
+        x_dim="x",
+        y_dim="y",
+    ).compute()
+    for i, polygon in enumerate(polygons[:2]):
+        clipped = cube.rio.clip([polygon], crs="EPSG:32633")
+        selected = result.isel({zonal_statistics.GEOMETRY_DIM: i})
+        for name in names:
+            with np.errstate(invalid="ignore"):
+                expected = getattr(clipped, name)(dim=["x", "y"]).values
+            np.testing.assert_allclose(selected[name].values, expected)
+    # all pixels of the first parcel are nodata in the first band and time
+    assert result["count"].values[0, 0, 0] == 0
+    assert np.isnan(result["mean"].values[0, 0, 0])
+    assert result["count"].values[1, 0, 0] == 25
+    # a geometry without pixels has no statistics
+    assert np.isnan(result.isel({zonal_statistics.GEOMETRY_DIM: 2})["count"]).all()
+
+
+def test_select_blocks():
+    cube = _make_cube().chunk({"x": 10, "y": 10})
+    # two parcels in opposite corners of the cube; y decreases from 39.5 to 0.5
+    polygons = [box(1, 1, 4, 4), box(32, 32, 38, 38)]
+    blocks = zonal_statistics.select_blocks(
+        data=cube, geometries=polygons, x_dim="x", y_dim="y"
+    )
+    np.testing.assert_array_equal(blocks, [[0, 3], [3, 0]])
+
+
+@pytest.mark.parametrize("statistic", [zonal_statistics.MEAN, zonal_statistics.MEDIAN])
+def test_zonal_statistics_reads_selected_blocks(statistic):
+    size = 40
+    read_blocks = set()
+
+    def read_block(block_info=None):
+        # records which chunks of the cube are read
+        location = block_info[None]["chunk-location"]
+        read_blocks.add(location)
+        shape = block_info[None]["chunk-shape"]
+        return np.full(shape, float(location[0] * 10 + location[1]))
+
+    array = dask.array.map_blocks(
+        read_block, chunks=((10,) * 4, (10,) * 4), dtype=np.float64
+    )
+    cube = xr.DataArray(
+        array,
+        dims=["y", "x"],
+        coords={"y": np.arange(size)[::-1] + 0.5, "x": np.arange(size) + 0.5},
+    ).rio.write_crs("EPSG:32633")
+    # two parcels in opposite corners of the cube, whose window spans all blocks
+    polygons = [box(1, 1, 4, 4), box(32, 32, 38, 38)]
+    geometries = gpd.GeoSeries(polygons, crs="EPSG:32633")
+    result = zonal_statistics.zonal_statistics(
+        data=cube,
+        geometries=geometries,
+        statistics={"reduced": statistic},
+        x_dim="x",
+        y_dim="y",
+    ).compute()
+    assert read_blocks == {(3, 0), (0, 3)}
+    np.testing.assert_array_equal(result["reduced"].values, [30.0, 3.0])
@@ -0,0 +1,476 @@
+import warnings
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+
+import dask.array as da
+import networkx as nx
+import numpy as np
+from openeo_pg_parser_networkx import OpenEOProcessGraph
+from openeo_pg_parser_networkx.pg_schema import (
+    ParameterReference,
+    PGEdgeType,
+    ResultReference,
+)
+
+from tensorlakehouse_openeo_driver.constants import logger
+
+# elementwise processes: process_id -> (argument names, ufunc)
+_UFUNCS: Dict[str, Tuple[Tuple[str, ...], np.ufunc]] = {
+    "add": (("x", "y"), np.add),
+    "subtract": (("x", "y"), np.subtract),
+    "multiply": (("x", "y"), np.multiply),
+    "divide": (("x", "y"), np.divide),
+    "power": (("base", "p"), np.power),
+    "absolute": (("x",), np.absolute),
+    "sqrt": (("x",), np.sqrt),
+    "exp": (("p",), np.exp),
+    "ln": (("x",), np.log),
+}
+# reductions along the axis of the callback: process_id -> (ignore nodata, keep nodata)
+_REDUCTIONS: Dict[str, Tuple[Callable, Callable]] = {
+    "mean": (np.nanmean, np.mean),
+    "median": (np.nanmedian, np.median),
+    "min": (np.nanmin, np.min),
+    "max": (np.nanmax, np.max),
+    "sum": (np.nansum, np.sum),
+    "sd": (np.nanstd, np.std),
+    "variance": (np.nanvar, np.var),
+}
+# reductions that use the sample (and not the population) standard deviation or variance
+_DDOF = {"sd": 1, "variance": 1}
+# arguments that callers (e.g., xarray reduce) pass to callbacks, but that are not parameters
+_SPECIAL_KWARGS = {"dim_labels", "source_transposed_axis"}
+
+Operand = Tuple[str, Any]  # ("param", name), ("const", value) or ("tmp", index)
+
+
+class _Step:
+    """one instruction of a compiled callback, which stores its result in a temporary"""
+
+    def __init__(
+        self,
+        kind: str,
+        func: Any,
+        operands: List[Operand],
+        kwargs: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.kind = kind
+        self.func = func
+        self.operands = operands
+        self.kwargs = kwargs or dict()
+        # temporary that can be overwritten by this step, because it is not used afterwards
+        self.reusable: Optional[int] = None
+
+
+class CallbackProgram:
+    """a callback process graph translated into a linear sequence of numpy operations. The
+    program is executed without the process graph interpreter, i.e., without resolving parameter
+    references and calling a wrapped process implementation per node, and the temporaries of
+    elementwise operations are overwritten in place instead of allocating one array per node
+    """
+
+    def __init__(self, steps: List[_Step], parameters: Set[str], node: dict) -> None:
+        self.steps = steps
+        self.parameters = parameters
+        # result node of the callback, e.g., to recognise single reducers
+        self.node = node
+        self.labels = [s.kwargs["label"] for s in steps if "label" in s.kwargs]
+        self.is_elementwise = all(s.kind in ("ufunc", "clip") for s in steps)
+        last_use: Dict[int, int] = dict()
+        for index, step in enumerate(steps):
+            for kind, value in step.operands:
+                if kind == "tmp":
+                    last_use[value] = index
+        for index, step in enumerate(steps):
+            if step.kind != "ufunc":
+                continue
+            for kind, value in step.operands:
+                if kind == "tmp" and last_use[value] == index:
+                    step.reusable = value
+                    break
+
+    def run(
+        self,
+        values: Dict[str, Any],
+        axis: Optional[int],
+        indices: Dict[Any, int],
+    ) -> Any:
+        """execute the program
+
+        Args:
+            values (Dict[str, Any]): value of each parameter
+            axis (Optional[int]): axis of reductions and array_element
+            indices (Dict[Any, int]): index of each label used by array_element
+
+        Returns:
+            Any: result of the callback
+        """
+        temporaries: List[Any] = list()
+        for step in self.steps:
+            operands = [
+                (
+                    values[value]
+                    if kind == "param"
+                    else temporaries[value] if kind == "tmp" else value
+                )
+                for kind, value in step.operands
+            ]
+            if step.kind == "ufunc":
+                out = None
+                if step.reusable is not None:
+                    out = _get_out(temporaries[step.reusable], operands)
+                if out is None:
+                    result = step.func(*operands)
+                else:
+                    result = step.func(*operands, out=out)
+            elif step.kind == "clip":
+                result = np.clip(operands[0], step.kwargs["min"], step.kwargs["max"])
+            elif step.kind == "element":
+                index = step.kwargs.get("index")
+                if index is None:
+                    index = indices[step.kwargs["label"]]
+                result = np.take(operands[0], index, axis=axis)
+            else:
+                result = step.func(operands[0], axis=axis, **step.kwargs)
+            temporaries.append(result)
+        return temporaries[-1]
+
+
+def _get_out(buffer: Any, operands: List[Any]) -> Optional[np.ndarray]:
+    """return the buffer if the result of an elementwise operation on the operands can be
+    written into it"""
+    if not isinstance(buffer, np.ndarray) or buffer.dtype.kind != "f":
+        return None
+    if buffer.dtype != np.result_type(*operands):
+        return None
+    shapes = [np.shape(o) for o in operands]
+    if np.broadcast_shapes(*shapes) != buffer.shape:
+        return None
+    return buffer
+
+
+def _get_constant(value: Any) -> Optional[Union[int, float, bool, np.number]]:
+    if isinstance(value, (bool, int, float, np.number)):
+        return value
+    return None
+
+
+def compile_callback(graph: nx.DiGraph, result_node: str) -> Optional[CallbackProgram]:
+    """translate a callback process graph into a CallbackProgram. Only callbacks that consist of
+    arithmetic (e.g., add, normalized_difference), array_element and reduction (e.g., mean,
+    median) processes whose arguments are parameters, constants or results of other nodes are
+    supported
+
+    Args:
+        graph (nx.DiGraph): graph of OpenEOProcessGraph
+        result_node (str): id of the result node of the callback
+
+    Returns:
+        Optional[CallbackProgram]: program or None if the callback is not supported
+    """
+    steps: List[_Step] = list()
+    parameters: Set[str] = set()
+    operand_of_node: Dict[str, Operand] = dict()
+
+    def add_step(step: _Step) -> Operand:
+        steps.append(step)
+        return ("tmp", len(steps) - 1)
+
+    def visit(node: str) -> Optional[Operand]:
+        if node in operand_of_node:
+            return operand_of_node[node]
+        data = graph.nodes[node]
+        process_id = data["process_id"]
+        kwargs = data["resolved_kwargs"]
+        sources = {
+            arg.arg_name: source
+            for _, source, edge in graph.out_edges(node, data=True)
+            if edge["reference_type"] == PGEdgeType.ResultReference
+            for arg in edge["arg_substitutions"]
+        }
+        if any(
+            edge["reference_type"] != PGEdgeType.ResultReference
+            for _, _, edge in graph.out_edges(node, data=True)
+        ):
+            return None
+
+        def argument(name: str) -> Optional[Operand]:
+            value = kwargs.get(name)
+            if isinstance(value, ParameterReference):
+                parameters.add(value.from_parameter)
+                return ("param", value.from_parameter)
+            if isinstance(value, ResultReference):
+                if name not in sources:
+                    return None
+                return visit(sources[name])
+            constant = _get_constant(value)
+            if constant is None:
+                return None
+            return ("const", constant)
+
+        operand: Optional[Operand] = None
+        if process_id in _UFUNCS:
+            names, ufunc = _UFUNCS[process_id]
+            if set(kwargs) != set(names):
+                return None
+            operands = [argument(n) for n in names]
+            if any(o is None for o in operands):
+                return None
+            operand = add_step(_Step(kind="ufunc", func=ufunc, operands=operands))  # type: ignore[arg-type]
+        elif process_id == "normalized_difference":
+            x, y = argument("x"), argument("y")
+            if x is None or y is None or set(kwargs) != {"x", "y"}:
+                return None
+            # (x - y) / (x + y), like the process implementation
+            diff = add_step(_Step(kind="ufunc", func=np.subtract, operands=[x, y]))
+            total = add_step(_Step(kind="ufunc", func=np.add, operands=[x, y]))
+            operand = add_step(
+                _Step(kind="ufunc", func=np.divide, operands=[diff, total])
+            )
+        elif process_id == "clip":
+            x = argument("x")
+            min_value = _get_constant(kwargs.get("min"))
+            max_value = _get_constant(kwargs.get("max"))
+            if x is None or min_value is None or max_value is None:
+                return None
+            if min_value > max_value or set(kwargs) != {"x", "min", "max"}:
+                return None
+            operand = add_step(
+                _Step(
+                    kind="clip",
+                    func=np.clip,
+                    operands=[x],
+                    kwargs={"min": min_value, "max": max_value},
+                )
+            )
+        elif process_id == "array_element":
+            x = argument("data")
+            if x is None or kwargs.get("return_nodata", False):
+                return None
+            if set(kwargs) - {"data", "index", "label", "return_nodata"}:
+                return None
+            index, label = kwargs.get("index"), kwargs.get("label")
+            if (index is None) == (label is None):
+                return None
+            if index is not None and not isinstance(index, int):
+                return None
+            if label is not None and not isinstance(label, (str, int)):
+                return None
+            element_kwargs = {"index": index} if index is not None else {"label": label}
+            operand = add_step(
+                _Step(kind="element", func=np.take, operands=[x], kwargs=element_kwargs)
+            )
+        elif process_id in _REDUCTIONS:
+            x = argument("data")
+            ignore_nodata = kwargs.get("ignore_nodata", True)
+            if x is None or not isinstance(ignore_nodata, bool):
+                return None
+            if set(kwargs) - {"data", "ignore_nodata"}:
+                return None
+            func = _REDUCTIONS[process_id][0 if ignore_nodata else 1]
+            reduction_kwargs = (
+                {"ddof": _DDOF[process_id]} if process_id in _DDOF else dict()
+            )
+            operand = add_step(
+                _Step(kind="reduce", func=func, operands=[x], kwargs=reduction_kwargs)
+            )
+        if operand is not None:
+            operand_of_node[node] = operand
+        return operand
+
+    result = visit(result_node)
+    if result is None or result[0] != "tmp":
+        return None
+    return CallbackProgram(
+        steps=steps, parameters=parameters, node=graph.nodes[result_node]
+    )
+
+
+class CompiledCallback:
+    """callable that replaces the interpreted callable of a callback. It accepts the arguments
+    that parent processes pass to callbacks (positional_parameters, named_parameters, axis,
+    ...). If an input is a dask array, the program is applied blockwise with map_blocks, so that
+    a single task per chunk replaces the tasks of every node of the callback"""
+
+    def __init__(self, program: CallbackProgram, interpreted: Callable) -> None:
+        self.program = program
+        self.interpreted = interpreted
+
+    @property
+    def node(self) -> dict:
+        return self.program.node
+
+    def __call__(
+        self,
+        *args,
+        positional_parameters: Optional[Dict[str, int]] = None,
+        named_parameters: Optional[Dict[str, Any]] = None,
+        axis: Optional[int] = None,
+        keepdims: bool = False,
+        **kwargs,
+    ) -> Any:
+        values = dict(named_parameters or dict())
+        axis_parameters = set()
+        for name, i in (positional_parameters or dict()).items():
+            values[name] = args[i]
+            axis_parameters.add(name)
+        for name, value in kwargs.items():
+            if name not in _SPECIAL_KWARGS:
+                values[name] = value
+                axis_parameters.add(name)
+        indices = self._get_indices(dim_labels=kwargs.get("dim_labels"))
+        if keepdims or indices is None or not self.program.parameters <= set(values):
+            return self._run_interpreted(
+                args, positional_parameters, named_parameters, axis, keepdims, kwargs
+            )
+        arrays = {
+            name: values[name]
+            for name in self.program.parameters
+            if isinstance(values[name], (np.ndarray, da.Array))
+        }
+        if not any(isinstance(a, da.Array) for a in arrays.values()):
+            return self.program.run(values=values, axis=axis, indices=indices)
+        result = self._run_blockwise(
+            values=values,
+            arrays=arrays,
+            axis_parameters=axis_parameters if axis is not None else set(),
+            axis=axis,
+            indices=indices,
+        )
+        if result is None:
+            # dask dispatches the numpy functions of the program to the whole arrays
+            return self.program.run(values=values, axis=axis, indices=indices)
+        return result
+
+    def _run_interpreted(
+        self, args, positional_parameters, named_parameters, axis, keepdims, kwargs
+    ) -> Any:
+        if axis is not None:
+            kwargs["axis"] = axis
+        if keepdims:
+            kwargs["keepdims"] = keepdims
+        return self.interpreted(
+            *args,
+            positional_parameters=positional_parameters,
+            named_parameters=named_parameters,
+            **kwargs,
+        )
+
+    def _get_indices(self, dim_labels: Optional[Any]) -> Optional[Dict[Any, int]]:
+        """positions of the labels used by array_element or None if a label is missing"""
+        indices: Dict[Any, int] = dict()
+        if len(self.program.labels) == 0:
+            return indices
+        if dim_labels is None:
+            return None
+        labels = np.asarray(dim_labels)
+        for label in self.program.labels:
+            (positions,) = np.where(labels == label)
+            if len(positions) == 0:
+                return None
+            indices[label] = int(positions[0])
+        return indices
+
+    def _run_blockwise(
+        self,
+        values: Dict[str, Any],
+        arrays: Dict[str, Any],
+        axis_parameters: Set[str],
+        axis: Optional[int],
+        indices: Dict[Any, int],
+    ) -> Optional[da.Array]:
+        """apply the program to each block of the dask arrays
+
+        Returns:
+            Optional[da.Array]: result or None if the inputs cannot be processed blockwise
+        """
+        names = list(arrays)
+        ndims = {np.ndim(a) for a in arrays.values()}
+        if len(ndims) != 1:
+            return None
+        ndim = ndims.pop()
+        reduces_axis = bool(axis_parameters & set(names))
+        if reduces_axis:
+            # the callback consumes the axis, so every input must carry it
+            if not set(names) <= axis_parameters:
+                return None
+            axis = axis % ndim  # type: ignore[operator]
+        elif not self.program.is_elementwise:
+            return None
+        constants = {k: v for k, v in values.items() if k not in arrays}
+        blocks = list()
+        for name in names:
+            array = da.asarray(arrays[name])
+            if reduces_axis:
+                array = array.rechunk({axis: -1})
+            blocks.append(array)
+
+        def kernel(*block_values):
+            with np.errstate(all="ignore"), warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                block_parameters = dict(zip(names, block_values), **constants)
+                return self.program.run(
+                    values=block_parameters,
+                    axis=axis if reduces_axis else None,
+                    indices=indices,
+                )
+
+        # infer the output dtype from a small sample with the original length of the axis
+        samples = list()
+        for array in blocks:
+            shape = [1] * ndim
+            if reduces_axis:
+                shape[axis] = array.shape[axis]  # type: ignore[index]
+            samples.append(np.ones(shape, dtype=array.dtype))
+        dtype = np.asarray(kernel(*samples)).dtype
+        result: da.Array
+        if reduces_axis:
+            result = da.map_blocks(kernel, *blocks, drop_axis=axis, dtype=dtype)
+        else:
+            result = da.map_blocks(kernel, *blocks, dtype=dtype)
+        return result
+
+
+class CompilingProcessGraph(OpenEOProcessGraph):
+    """OpenEOProcessGraph that replaces the callables of supported callbacks (e.g., the reducer
+    of reduce_dimension or the process of apply) by CompiledCallback objects. Callbacks that
+    cannot be compiled are interpreted as usual. It overrides the private method
+    _map_node_to_callable of the parser, whose version is pinned in requirements.txt"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._programs: Dict[str, CallbackProgram] = dict()
+        self._interpreting: Set[str] = set()
+
+    def _map_node_to_callable(
+        self,
+        node: str,
+        process_registry: dict,
+        results_cache: Optional[dict] = None,
+        named_parameters: Optional[dict] = None,
+    ) -> Callable:
+        for _, source_node, data in self.G.out_edges(node, data=True):
+            if (
+                data["reference_type"] == PGEdgeType.Callback
+                and source_node not in self._programs
+            ):
+                program = compile_callback(graph=self.G, result_node=source_node)
+                if program is not None:
+                    logger.debug(
+                        f"CompilingProcessGraph - compiled callback {source_node} into {len(program.steps)} steps"
+                    )
+                    self._programs[source_node] = program
+        if node in self._programs and node not in self._interpreting:
+            self._interpreting.add(node)
+            try:
+                interpreted = self._map_node_to_callable(
+                    node, process_registry, results_cache, named_parameters
+                )
+            finally:
+                self._interpreting.discard(node)
+            return CompiledCallback(
+                program=self._programs[node], interpreted=interpreted
+            )
+        callable_: Callable = super()._map_node_to_callable(
+            node, process_registry, results_cache, named_parameters
+        )
+        return callable_
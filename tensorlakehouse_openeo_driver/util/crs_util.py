@@ -0,0 +1,128 @@
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+import pyproj
+
+# process-wide registry of CRS and Transformer objects. Building them costs milliseconds, so
+# they are created once and reused across requests and items. pyproj>=3.1 objects can be
+# shared by threads
+_registry_lock = threading.Lock()
+_crs_objects: Dict[Union[int, str], pyproj.CRS] = dict()
+_transformers: Dict[
+    Tuple[Union[int, str], Union[int, str], bool], pyproj.Transformer
+] = dict()
+
+CRSCode = Union[int, float, str, pyproj.CRS]
+# number of points added to each edge of a bounding box before it is transformed
+DENSIFY_PTS = 21
+
+
+def _get_key(crs_code: CRSCode) -> Union[int, str]:
+    """hashable key of a CRS code. pyproj.CRS objects are identified by the string they were
+    created from, which is cheaper than hashing their WKT
+
+    Args:
+        crs_code (CRSCode): EPSG code, user input string (e.g., "EPSG:4326") or CRS object
+
+    Returns:
+        Union[int, str]: registry key
+    """
+    if isinstance(crs_code, pyproj.CRS):
+        crs_code = crs_code.srs
+    if isinstance(crs_code, (int, float)):
+        return int(crs_code)
+    assert isinstance(crs_code, str), f"Error! Unexpected CRS type: {type(crs_code)}"
+    # "EPSG:4326" and 4326 share the same key
+    authority, _, code = crs_code.partition(":")
+    if authority.upper() == "EPSG" and code.isdigit():
+        return int(code)
+    return crs_code
+
+
+def get_crs(crs_code: CRSCode) -> pyproj.CRS:
+    """get the CRS object of the specified code
+
+    Args:
+        crs_code (CRSCode): EPSG code, user input string (e.g., "EPSG:4326") or CRS object
+
+    Returns:
+        pyproj.CRS: CRS object
+    """
+    key = _get_key(crs_code=crs_code)
+    with _registry_lock:
+        crs_obj = _crs_objects.get(key)
+        if crs_obj is None:
+            if isinstance(crs_code, pyproj.CRS):
+                crs_obj = crs_code
+            elif isinstance(key, int):
+                crs_obj = pyproj.CRS.from_epsg(key)
+            else:
+                crs_obj = pyproj.CRS.from_user_input(key)
+            _crs_objects[key] = crs_obj
+    return crs_obj
+
+
+def get_transformer(
+    crs_from: CRSCode, crs_to: CRSCode, always_xy: bool = True
+) -> pyproj.Transformer:
+    """get the transformer between the specified CRSs
+
+    Args:
+        crs_from (CRSCode): source CRS
+        crs_to (CRSCode): destination CRS
+        always_xy (bool, optional): use x, y (lon, lat) order. Defaults to True.
+
+    Returns:
+        pyproj.Transformer: transformer
+    """
+    key = (_get_key(crs_code=crs_from), _get_key(crs_code=crs_to), always_xy)
+    with _registry_lock:
+        transformer = _transformers.get(key)
+    if transformer is None:
+        # CRS objects are fetched outside the lock, because get_crs acquires it
+        src = get_crs(crs_code=crs_from)
+        dst = get_crs(crs_code=crs_to)
+        with _registry_lock:
+            transformer = _transformers.get(key)
+            if transformer is None:
+                transformer = pyproj.Transformer.from_crs(
+                    crs_from=src, crs_to=dst, always_xy=always_xy
+                )
+                _transformers[key] = transformer
+    return transformer
+
+
+def transform_bounds(
+    bbox: Tuple[float, float, float, float],
+    crs_from: CRSCode,
+    crs_to: CRSCode,
+    densify_pts: Optional[int] = DENSIFY_PTS,
+) -> Tuple[float, float, float, float]:
+    """transform a bounding box. The edges are densified with densify_pts points each and all
+    points are transformed by a single call, so that the result covers the curved edges of the
+    reprojected box
+
+    Args:
+        bbox (Tuple[float, float, float, float]): west, south, east, north
+        crs_from (CRSCode): source CRS
+        crs_to (CRSCode): destination CRS
+        densify_pts (Optional[int], optional): number of points added to each edge. If None,
+            only the lower-left and upper-right corners are transformed. Defaults to
+            DENSIFY_PTS.
+
+    Returns:
+        Tuple[float, float, float, float]: west, south, east, north
+    """
+    transformer = get_transformer(crs_from=crs_from, crs_to=crs_to)
+    minx, miny, maxx, maxy = bbox
+    if densify_pts is None:
+        (west, east), (south, north) = transformer.transform((minx, maxx), (miny, maxy))
+        return west, south, east, north
+    return transformer.transform_bounds(minx, miny, maxx, maxy, densify_pts=densify_pts)
+
+
+def clear_registry() -> None:
+    """drop all cached CRS and Transformer objects"""
+    with _registry_lock:
+        _crs_objects.clear()
+        _transformers.clear()
@@ -0,0 +1,107 @@
+from typing import Any, Callable, List, Tuple
+
+import dask.array as da
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def align_chunks(
+    cube1: xr.DataArray, cube2: xr.DataArray
+) -> Tuple[xr.DataArray, xr.DataArray]:
+    """give both cubes the same chunk grid, so that they can be combined block by block. cube2 is
+    transposed and rechunked to match cube1, unless only cube2 is a dask array
+
+    Args:
+        cube1 (xr.DataArray): data cube
+        cube2 (xr.DataArray): data cube with the same dimensions and shape as cube1
+
+    Returns:
+        Tuple[xr.DataArray, xr.DataArray]: cube1 and cube2
+    """
+    cube2 = cube2.transpose(*cube1.dims)
+    assert (
+        cube1.shape == cube2.shape
+    ), f"Error! Cubes have different shapes: {cube1.shape} != {cube2.shape}"
+    if cube1.chunks is not None:
+        if cube2.chunks != cube1.chunks:
+            cube2 = cube2.chunk(dict(zip(cube1.dims, cube1.chunks)))
+    elif cube2.chunks is not None:
+        cube1 = cube1.chunk(dict(zip(cube2.dims, cube2.chunks)))
+    return cube1, cube2
+
+
+def resolve_overlap(
+    x: xr.DataArray,
+    y: xr.DataArray,
+    overlap_resolver: Callable,
+    context: Any,
+) -> xr.DataArray:
+    """resolve the values of two cubes that cover the same labels. The overlap resolver is applied
+    to the aligned arrays directly, so that each output chunk only depends on the corresponding
+    chunks of x and y, instead of stacking both cubes and rechunking the stack
+
+    Args:
+        x (xr.DataArray): values of the first cube
+        y (xr.DataArray): values of the second cube, with the same labels as x
+        overlap_resolver (Callable): callback with parameters x, y and context
+        context (Any): context of the overlap resolver
+
+    Raises:
+        ValueError: if the overlap resolver does not return a value per pixel
+
+    Returns:
+        xr.DataArray: resolved cube with the coordinates of x
+    """
+    x, y = align_chunks(cube1=x, cube2=y)
+    result = overlap_resolver(
+        positional_parameters={},
+        named_parameters={"x": x.data, "y": y.data, "context": context},
+    )
+    if isinstance(result, xr.DataArray):
+        result = result.data
+    if np.shape(result) != x.shape:
+        raise ValueError(
+            f"Error! The overlap resolver must return a value per pixel: {np.shape(result)} != {x.shape}"
+        )
+    if not isinstance(result, (np.ndarray, da.Array)):
+        result = np.asarray(result)
+    return x.copy(data=result)
+
+
+def _is_increasing(labels: np.ndarray) -> bool:
+    return pd.Index(labels).is_monotonic_increasing
+
+
+def concat_parts(
+    parts: List[xr.DataArray], dim: str, keep_order: bool = False
+) -> xr.DataArray:
+    """concatenate cubes with disjoint labels along dim without rechunking them, i.e., each chunk
+    of the result is a chunk of one of the parts
+
+    Args:
+        parts (List[xr.DataArray]): data cubes
+        dim (str): dimension
+        keep_order (bool, optional): if False and the labels of each part are increasing, the
+            labels of the result are sorted too. Defaults to False.
+
+    Returns:
+        xr.DataArray: merged cube
+    """
+    parts = [p for p in parts if p.sizes[dim] > 0]
+    sort = not keep_order and all(_is_increasing(p[dim].values) for p in parts)
+    if sort:
+        # parts that cover consecutive ranges of labels are concatenated in order
+        parts = sorted(parts, key=lambda p: p[dim].values[0])
+    merged = xr.concat(
+        parts,
+        dim=dim,
+        coords="minimal",
+        compat="override",
+        combine_attrs="drop_conflicts",
+    )
+    labels = merged[dim].values
+    if sort and not _is_increasing(labels):
+        # parts are interleaved, so that their elements must be reordered
+        merged = merged.isel({dim: np.argsort(labels, kind="stable")})
+    return merged
@@ -0,0 +1,93 @@
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+import dask
+import xarray as xr
+
+from tensorlakehouse_openeo_driver.constants import logger
+
+SERIAL = "serial"
+PROCESSES = "processes"
+DASK = "dask"
+EXECUTION_MODES = [SERIAL, PROCESSES, DASK]
+
+# process pool shared by all requests, which is created on first use
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _decode(
+    load_item: Callable[[Dict[str, Any]], xr.DataArray], item: Dict[str, Any]
+) -> xr.DataArray:
+    """decode and subset the item in the worker and return a compact in-memory array, so that
+    only the selected values are sent back to the caller"""
+    return load_item(item).load()
+
+
+def _get_executor(max_workers: Optional[int]) -> ProcessPoolExecutor:
+    """get the process pool, so that worker processes are spawned once instead of per request.
+    The size of the pool is set by the first caller"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # forking a process that runs threads (e.g., dask, gunicorn) might deadlock
+            context = multiprocessing.get_context("spawn")
+            _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        return _executor
+
+
+def _shutdown_executor(executor: Optional[ProcessPoolExecutor] = None) -> None:
+    """shut down the process pool, e.g., at exit or because one of its processes died. If
+    executor is specified, the pool is only shut down if it is still the current one"""
+    global _executor
+    with _executor_lock:
+        if _executor is None or (executor is not None and _executor is not executor):
+            return
+        executor, _executor = _executor, None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(_shutdown_executor)
+
+
+def map_items(
+    load_item: Callable[[Dict[str, Any]], xr.DataArray],
+    items: List[Any],
+    mode: str,
+    max_workers: Optional[int] = None,
+) -> List[xr.DataArray]:
+    """decode items either one after another in the current thread, in a pool of processes or
+    as dask delayed tasks, which run on the cluster if a distributed client is active
+
+    Args:
+        load_item (Callable[[Dict[str, Any]], xr.DataArray]): function that decodes and
+            subsets a single item. It must be picklable, e.g., a method of a reader
+        items (List[Any]): STAC items
+        mode (str): serial, processes or dask
+        max_workers (Optional[int], optional): size of the process pool, which is shared by
+            all calls and created by the first one. Defaults to None, i.e., number of CPUs
+
+    Returns:
+        List[xr.DataArray]: data arrays in the same order as items
+    """
+    assert mode in EXECUTION_MODES, f"Error! Invalid execution mode: {mode}"
+    logger.debug(f"map_items - decoding {len(items)} items {mode=}")
+    if mode == SERIAL or len(items) == 1:
+        return [load_item(item) for item in items]
+    decode = partial(_decode, load_item)
+    if mode == PROCESSES:
+        executor = _get_executor(max_workers=max_workers)
+        try:
+            return list(executor.map(decode, items))
+        except BrokenProcessPool:
+            # a worker died (e.g., out of memory), so the next call starts a new pool
+            _shutdown_executor(executor=executor)
+            raise
+    else:
+        tasks = [dask.delayed(decode)(item) for item in items]
+        return list(dask.compute(*tasks))
@@ -0,0 +1,231 @@
+import fcntl
+import hashlib
+import os
+import threading
+import uuid
+import weakref
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import fsspec
+
+from tensorlakehouse_openeo_driver.constants import logger
+
+# suffix of the files that are being downloaded
+TMP_SUFFIX = ".tmp"
+
+
+def fingerprint(path_or_url: str, info: Optional[Dict[str, Any]] = None) -> str:
+    """compute a key that identifies a version of a file. Local files are identified by path,
+    size and modification time, whereas remote objects are identified by url and ETag
+
+    Args:
+        path_or_url (str): path to local file or link to remote object
+        info (Optional[Dict[str, Any]], optional): metadata of the remote object as returned by
+            fsspec's info(). Defaults to None.
+
+    Returns:
+        str: hex digest
+    """
+    if info is None:
+        stat = os.stat(path_or_url)
+        version = f"{stat.st_size}:{stat.st_mtime_ns}"
+    else:
+        etag = info.get("ETag")
+        if etag is not None:
+            version = str(etag).strip('"')
+        else:
+            version = f"{info.get('size')}:{info.get('LastModified')}"
+    return hashlib.sha256(f"{path_or_url}:{version}".encode()).hexdigest()
+
+
+class CacheLease:
+    """shared lock on a cache entry. Entries that are leased by any process are not evicted
+    until the lease is released, either explicitly or when the lease is garbage collected
+    """
+
+    def __init__(self, path: Path, fd: Optional[int]) -> None:
+        self.path = path
+        self._finalizer = (
+            weakref.finalize(self, os.close, fd) if fd is not None else None
+        )
+
+    def release(self) -> None:
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __reduce__(self):
+        # a copy of the lease, e.g., in a dask task that is sent to a worker, does not hold the
+        # lock, which is held by the process that acquired the lease
+        return (CacheLease, (self.path, None))
+
+
+def _lock_shared(path: Path) -> Optional[int]:
+    """open the file and acquire a shared lock, which blocks its removal by evict
+
+    Args:
+        path (Path): cache entry
+
+    Returns:
+        Optional[int]: file descriptor or None if the entry does not exist (anymore)
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    if os.fstat(fd).st_nlink == 0:
+        # the entry has been removed between open and lock
+        os.close(fd)
+        return None
+    return fd
+
+
+def _remove_unleased(path: Path) -> bool:
+    """remove the file unless it is leased
+
+    Args:
+        path (Path): cache entry
+
+    Returns:
+        bool: True if the file has been removed
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    try:
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+    finally:
+        os.close(fd)
+
+
+class DiskCache:
+    """content-addressed cache of files on local disk. Entries are evicted in least recently
+    used order when the total size exceeds max_bytes, except the entries that are leased
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int) -> None:
+        assert max_bytes > 0, f"Error! Invalid cache size: {max_bytes}"
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def get_path(self, key: str) -> Path:
+        """get the path prefix of the entries associated with key. Entries that already exist
+        are marked as recently used
+
+        Args:
+            key (str): key returned by fingerprint
+
+        Returns:
+            Path: path prefix, e.g., <cache_dir>/<key>
+        """
+        for entry in self.cache_dir.glob(f"{key}*"):
+            try:
+                entry.touch(exist_ok=True)
+            except FileNotFoundError:
+                # entry has been evicted by another process
+                pass
+        return self.cache_dir / key
+
+    def contains(self, key: str) -> bool:
+        return any(self.cache_dir.glob(f"{key}*"))
+
+    def _list_entries(self) -> List[Tuple[float, int, Path]]:
+        entries = list()
+        for entry in self.cache_dir.iterdir():
+            # downloads in progress are not entries yet
+            if entry.name.endswith(TMP_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.is_file():
+                entries.append((stat.st_mtime, stat.st_size, entry))
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._list_entries())
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """remove the least recently used entries until the cache fits max_bytes. Leased
+        entries are skipped, so that the cache might exceed max_bytes until they are released
+
+        Args:
+            keep (Optional[Path], optional): entry that is never removed, e.g., a file that
+                has just been downloaded and is larger than max_bytes. Defaults to None.
+
+        Returns:
+            int: number of removed files
+        """
+        with self._lock:
+            entries = sorted(self._list_entries(), key=lambda e: e[0])
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry == keep:
+                    continue
+                if _remove_unleased(path=entry):
+                    removed += 1
+                    total -= size
+                elif not entry.exists():
+                    # entry has been evicted by another process
+                    total -= size
+            if removed > 0:
+                logger.debug(
+                    f"DiskCache::evict - removed {removed} files from {self.cache_dir}"
+                )
+            return removed
+
+    def fetch(
+        self, fs: fsspec.AbstractFileSystem, url: str, suffix: str = ""
+    ) -> CacheLease:
+        """read-through cache of remote objects: the object is downloaded once per version
+        (ETag) and later requests read the local copy. The local copy is leased, so that it
+        is not evicted while the caller reads it, e.g., by a lazy array
+
+        Args:
+            fs (fsspec.AbstractFileSystem): filesystem
+            url (str): link to remote object
+            suffix (str, optional): suffix of the local file, e.g., ".fst". Defaults to "".
+
+        Returns:
+            CacheLease: lease of the local copy
+        """
+        key = fingerprint(path_or_url=url, info=fs.info(url))
+        path = self.get_path(key=key).with_suffix(suffix)
+        fd = _lock_shared(path=path)
+        if fd is not None:
+            logger.debug(f"DiskCache::fetch - cache hit {url=} {path=}")
+            return CacheLease(path=path, fd=fd)
+        # make room for the new entry before downloading it
+        self.evict()
+        # download to a temporary file, so that concurrent readers never see partial files
+        tmp_path = self.cache_dir / f".{key}.{uuid.uuid4().hex}{TMP_SUFFIX}"
+        try:
+            fs.get_file(url, str(tmp_path))
+            # the lock is kept when the file is renamed
+            fd = _lock_shared(path=tmp_path)
+            assert fd is not None, f"Error! Unable to lock {tmp_path}"
+            lease = CacheLease(path=path, fd=fd)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        logger.debug(f"DiskCache::fetch - downloaded {url=} {path=}")
+        # the download might have exceeded max_bytes, e.g., if several files are downloaded
+        # concurrently
+        self.evict(keep=path)
+        return lease
@@ -0,0 +1,320 @@
+"""message-level index of GRIB2 files, which allows to fetch only the messages that match the
+requested variables and levels by byte-range requests.
+
+Two kinds of index are supported:
+    - a pre-built JSON index (<file>.index.json), i.e., a list of messages that have the cfgrib
+        keys, e.g., {"offset": 0, "length": 1024, "shortName": "2t", "cfVarName": "t2m",
+        "typeOfLevel": "heightAboveGround", "level": 2, "step": 0}
+    - the wgrib2 inventory (<file>.idx) that NOAA publishes next to its GRIB2 files, e.g.,
+        "1:0:d=2019010100:PRMSL:mean sea level:anl:". Variables and levels are translated to
+        the names used by cfgrib, e.g., TMP at "2 m above ground" is t2m
+"""
+
+import json
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import fsspec
+
+from tensorlakehouse_openeo_driver.constants import logger
+
+JSON_INDEX_SUFFIX = "index.json"
+IDX_SUFFIX = "idx"
+
+
+# cfgrib variable names (cfVarName) of the wgrib2 variables
+WGRIB2_VARIABLES = {
+    "TMP": "t",
+    "UGRD": "u",
+    "VGRD": "v",
+    "RH": "r",
+    "SPFH": "q",
+    "HGT": "gh",
+    "VVEL": "w",
+    "ABSV": "absv",
+    "O3MR": "o3mr",
+    "CLWMR": "clwmr",
+    "PRMSL": "prmsl",
+    "MSLET": "mslet",
+    "PRES": "sp",
+    "PWAT": "pwat",
+    "TCDC": "tcc",
+    "APCP": "tp",
+    "CAPE": "cape",
+    "CIN": "cin",
+    "GUST": "gust",
+    "VIS": "vis",
+}
+# cfgrib names of the variables at a specific height above ground (m), e.g., 2 m temperature
+WGRIB2_HEIGHT_ABOVE_GROUND_VARIABLES = {
+    ("TMP", 2.0): "t2m",
+    ("DPT", 2.0): "d2m",
+    ("RH", 2.0): "r2",
+    ("SPFH", 2.0): "sh2",
+    ("UGRD", 10.0): "u10",
+    ("VGRD", 10.0): "v10",
+    ("UGRD", 100.0): "u100",
+    ("VGRD", 100.0): "v100",
+}
+# cfgrib typeOfLevel of the wgrib2 levels that have a single value
+WGRIB2_LEVELS = {
+    "surface": "surface",
+    "mean sea level": "meanSea",
+    "entire atmosphere": "atmosphere",
+    "entire atmosphere (considered as a single layer)": "atmosphereSingleLayer",
+    "tropopause": "tropopause",
+    "max wind": "maxWind",
+}
+# cfgrib typeOfLevel of the wgrib2 levels that have a value, e.g., "500 mb"
+WGRIB2_LEVEL_PATTERNS = [
+    (re.compile(r"^([\d.]+) mb$"), "isobaricInhPa"),
+    (re.compile(r"^([\d.]+) m above ground$"), "heightAboveGround"),
+    (re.compile(r"^([\d.]+) m above mean sea level$"), "heightAboveSea"),
+    (re.compile(r"^([\d.]+)-[\d.]+ m below ground$"), "depthBelowLandLayer"),
+    (re.compile(r"^([\d.]+) sigma level$"), "sigma"),
+]
+WGRIB2_STEP_PATTERN = re.compile(r"^(\d+) hour fcst$")
+
+
+class GribMessage(NamedTuple):
+    offset: int
+    length: int
+    # variable name, i.e., cfgrib cfVarName or wgrib2 variable if it has no cfgrib name
+    variable: str
+    # cfgrib keys of the message, e.g., typeOfLevel, level and step
+    keys: Dict[str, Any]
+
+
+def _parse_wgrib2_level(level: str) -> Dict[str, Any]:
+    """translate a wgrib2 level to cfgrib typeOfLevel and level, e.g., "500 mb" is
+    {"typeOfLevel": "isobaricInhPa", "level": 500.0}. Unknown levels are kept as they are
+    """
+    if level in WGRIB2_LEVELS:
+        return {"typeOfLevel": WGRIB2_LEVELS[level], "level": 0.0}
+    for pattern, type_of_level in WGRIB2_LEVEL_PATTERNS:
+        match = pattern.match(level)
+        if match is not None:
+            return {"typeOfLevel": type_of_level, "level": float(match.group(1))}
+    return {"level": level}
+
+
+def _parse_wgrib2_step(step: str) -> Any:
+    """translate a wgrib2 forecast time to hours, e.g., "anl" is 0 and "6 hour fcst" is 6"""
+    if step == "anl":
+        return 0
+    match = WGRIB2_STEP_PATTERN.match(step)
+    if match is not None:
+        return int(match.group(1))
+    return step
+
+
+def _get_cfgrib_name(variable: str, keys: Dict[str, Any]) -> str:
+    """translate a wgrib2 variable to the name of the cfgrib variable. Variables that are not
+    known by this module keep the wgrib2 name"""
+    if keys.get("typeOfLevel") == "heightAboveGround":
+        name = WGRIB2_HEIGHT_ABOVE_GROUND_VARIABLES.get((variable, keys["level"]))
+        if name is not None:
+            return name
+    if variable == "PRES" and keys.get("typeOfLevel") != "surface":
+        return "pres"
+    return WGRIB2_VARIABLES.get(variable, variable)
+
+
+def parse_idx(text: str, file_size: int) -> List[GribMessage]:
+    """parse wgrib2 inventory. The length of each message is the difference between the offset
+    of the next message and its offset. The wgrib2 variable is kept as "wgrib2_name"
+
+    Args:
+        text (str): content of the .idx file
+        file_size (int): size of the GRIB2 file in bytes
+
+    Returns:
+        List[GribMessage]: messages sorted by offset
+    """
+    rows = list()
+    for line in text.splitlines():
+        fields = line.strip().split(":")
+        if len(fields) < 5:
+            continue
+        offset = int(fields[1])
+        keys = _parse_wgrib2_level(level=fields[4])
+        if len(fields) > 5:
+            keys["step"] = _parse_wgrib2_step(step=fields[5])
+        keys["wgrib2_name"] = fields[3]
+        variable = _get_cfgrib_name(variable=fields[3], keys=keys)
+        rows.append((offset, variable, keys))
+    rows.sort(key=lambda r: r[0])
+    messages = list()
+    for i, (offset, variable, keys) in enumerate(rows):
+        # messages that share the same offset are sub-messages of the same GRIB message
+        j = i + 1
+        while j < len(rows) and rows[j][0] == offset:
+            j += 1
+        end = rows[j][0] if j < len(rows) else file_size
+        messages.append(
+            GribMessage(
+                offset=offset, length=end - offset, variable=variable, keys=keys
+            )
+        )
+    return messages
+
+
+def parse_json_index(content: List[Dict[str, Any]]) -> List[GribMessage]:
+    messages = list()
+    for row in content:
+        keys = {
+            k: v
+            for k, v in row.items()
+            if k not in ["offset", "length", "shortName", "cfVarName"]
+        }
+        # cfgrib names the variables of the dataset by cfVarName, e.g., 2t is t2m
+        messages.append(
+            GribMessage(
+                offset=int(row["offset"]),
+                length=int(row["length"]),
+                variable=row.get("cfVarName", row["shortName"]),
+                keys=keys,
+            )
+        )
+    messages.sort(key=lambda m: m.offset)
+    return messages
+
+
+def read_message_index(
+    fs: fsspec.AbstractFileSystem, url: str
+) -> Optional[List[GribMessage]]:
+    """read the index of the GRIB2 file if there is one
+
+    Args:
+        fs (fsspec.AbstractFileSystem): filesystem
+        url (str): link to GRIB2 file
+
+    Returns:
+        Optional[List[GribMessage]]: messages or None if there is no index
+    """
+    json_url = f"{url}.{JSON_INDEX_SUFFIX}"
+    idx_url = f"{url}.{IDX_SUFFIX}"
+    if fs.exists(json_url):
+        return parse_json_index(content=json.loads(fs.cat_file(json_url)))
+    elif fs.exists(idx_url):
+        file_size = fs.size(url)
+        return parse_idx(text=fs.cat_file(idx_url).decode(), file_size=file_size)
+    logger.debug(f"read_message_index - GRIB2 file has no index: {url}")
+    return None
+
+
+def _matches(value: Any, selected: Any) -> bool:
+    """compare numbers as numbers, e.g., 2 and "2.0", and other values case-insensitively"""
+    if isinstance(selected, (list, tuple)):
+        return any(_matches(value=value, selected=s) for s in selected)
+    try:
+        return float(value) == float(selected)
+    except (TypeError, ValueError):
+        return str(value).lower() == str(selected).lower()
+
+
+def select_messages(
+    messages: List[GribMessage],
+    variables: List[str],
+    extra_dims_filter: Dict[str, Any],
+) -> List[GribMessage]:
+    """select the messages of the specified variables, which are matched against the cfgrib
+    name and, for wgrib2 inventories, the wgrib2 name. Extra-dimension filters are applied
+    when the index has the corresponding key, e.g., {"step": [0, 3]}; like cfgrib's
+    filter_by_keys, a filter whose name is a typeOfLevel of the index, e.g.,
+    {"isobaricInhPa": 500}, selects the messages of that type and level
+
+    Args:
+        messages (List[GribMessage]): messages
+        variables (List[str]): variables, aka bands
+        extra_dims_filter (Dict[str, Any]): dimension names and values
+
+    Returns:
+        List[GribMessage]: selected messages
+    """
+    level_types = {message.keys.get("typeOfLevel") for message in messages}
+    selected = list()
+    for message in messages:
+        names = [message.variable, message.keys.get("wgrib2_name")]
+        if not any(_matches(value=name, selected=variables) for name in names if name):
+            continue
+        keep = True
+        for dim_name, dim_value in extra_dims_filter.items():
+            if dim_name in message.keys:
+                keep = keep and _matches(
+                    value=message.keys[dim_name], selected=dim_value
+                )
+            elif dim_name in level_types:
+                keep = (
+                    keep
+                    and message.keys.get("typeOfLevel") == dim_name
+                    and _matches(value=message.keys.get("level"), selected=dim_value)
+                )
+        if keep:
+            selected.append(message)
+    return selected
+
+
+def coalesce_ranges(messages: List[GribMessage], max_gap: int) -> List[Tuple[int, int]]:
+    """merge the byte ranges of messages that are closer than max_gap, so that adjacent
+    messages are fetched by a single request
+
+    Args:
+        messages (List[GribMessage]): selected messages
+        max_gap (int): max number of bytes between two ranges that are merged
+
+    Returns:
+        List[Tuple[int, int]]: list of start (inclusive) and end (exclusive) positions
+    """
+    ranges: List[Tuple[int, int]] = list()
+    for message in sorted(messages, key=lambda m: m.offset):
+        start = message.offset
+        end = message.offset + message.length
+        if len(ranges) > 0 and start - ranges[-1][1] <= max_gap:
+            ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def fetch_messages(
+    fs: fsspec.AbstractFileSystem,
+    url: str,
+    messages: List[GribMessage],
+    max_gap: int,
+) -> bytes:
+    """fetch the selected messages concurrently by range reads. Ranges that are closer
+    than max_gap are fetched by a single request, but only the selected messages are cut out
+    of the fetched ranges, so that cfgrib does not decode the messages in between. GRIB
+    messages are self-contained, so the result is a valid GRIB file
+
+    Args:
+        fs (fsspec.AbstractFileSystem): filesystem
+        url (str): link to GRIB2 file
+        messages (List[GribMessage]): selected messages
+        max_gap (int): max number of bytes between two ranges that are merged
+
+    Returns:
+        bytes: content of the selected messages
+    """
+    ranges = coalesce_ranges(messages=messages, max_gap=max_gap)
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
+    logger.debug(
+        f"fetch_messages - {url=} messages={len(messages)} requests={len(ranges)} "
+        f"bytes={sum(e - s for s, e in ranges)}"
+    )
+    blocks = fs.cat_ranges([url] * len(ranges), starts, ends)
+    parts = list()
+    index = 0
+    end = -1
+    # messages that share the same offset are sub-messages of the same GRIB message
+    for message in sorted(messages, key=lambda m: m.offset):
+        if message.offset < end:
+            continue
+        while ranges[index][1] <= message.offset:
+            index += 1
+        start = message.offset - ranges[index][0]
+        end = message.offset + message.length
+        parts.append(blocks[index][start : start + message.length])
+    return b"".join(parts)
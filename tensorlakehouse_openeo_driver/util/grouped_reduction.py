@@ -0,0 +1,134 @@
+from typing import Any, Callable, Optional, Tuple
+
+import numpy as np
+import xarray as xr
+
+from tensorlakehouse_openeo_driver.util.callback_compiler import CompiledCallback
+
+COUNT = "count"
+MEAN = "mean"
+MIN = "min"
+MAX = "max"
+MEDIAN = "median"
+SUM = "sum"
+REDUCERS = [COUNT, MEAN, MIN, MAX, MEDIAN, SUM]
+
+# flox strategy for decomposable reductions: each chunk is reduced on its own and the partial
+# results are only combined within cohorts of chunks that share groups, so that the number of
+# tasks grows with the number of chunks instead of the number of groups
+FLOX_METHOD = "cohorts"
+
+_NUMPY_REDUCERS = {
+    np.nanmean: MEAN,
+    np.nanmedian: MEDIAN,
+    np.nanmin: MIN,
+    np.nanmax: MAX,
+    np.nansum: SUM,
+}
+# modules whose implementations of the openEO reducers ignore nodata by default
+_PROCESS_MODULES = (
+    "openeo_processes_dask.process_implementations",
+    "tensorlakehouse_openeo_driver.processes",
+)
+
+
+def get_reducer_name(reducer: Any) -> Optional[str]:
+    """find out whether the reducer is one of the common reducers (mean, median, min, max, sum,
+    count) that ignore nodata, which can be computed by a grouped reduction engine instead of
+    calling the reducer on each group
+
+    Args:
+        reducer (Any): name, numpy function, openEO process implementation or process graph
+            callback. Callbacks are recognised if they were compiled by CompilingProcessGraph
+
+    Returns:
+        Optional[str]: name of the reducer or None if it is an arbitrary callable
+    """
+    name: Optional[str] = None
+    if isinstance(reducer, str):
+        name = reducer.lower()
+    elif isinstance(reducer, CompiledCallback):
+        kwargs = reducer.node.get("resolved_kwargs", dict())
+        if set(kwargs) - {"data", "ignore_nodata"}:
+            return None
+        if kwargs.get("ignore_nodata", True) is not True:
+            return None
+        if getattr(kwargs.get("data"), "from_parameter", None) != "data":
+            return None
+        name = reducer.node.get("process_id")
+    elif callable(reducer):
+        name = _NUMPY_REDUCERS.get(reducer)
+        module = getattr(reducer, "__module__", None) or ""
+        if name is None and module.startswith(_PROCESS_MODULES):
+            # e.g., _min, _max and _sum avoid shadowing builtins
+            name = getattr(reducer, "__name__", "").lstrip("_")
+    if name in REDUCERS:
+        return name
+    return None
+
+
+def _group_aligned_chunks(
+    codes: np.ndarray, chunk_size: int
+) -> Optional[Tuple[int, ...]]:
+    """chunk sizes along the grouped dimension so that no group is split across chunks. Runs of
+    consecutive groups are merged up to chunk_size
+
+    Args:
+        codes (np.ndarray): group of each element along the dimension
+        chunk_size (int): preferred chunk size
+
+    Returns:
+        Optional[Tuple[int, ...]]: chunk sizes or None if groups are not contiguous
+    """
+    boundaries = np.flatnonzero(np.diff(codes)) + 1
+    runs = np.diff(np.concatenate(([0], boundaries, [len(codes)])))
+    if len(runs) != len(np.unique(codes)):
+        return None
+    chunks = list()
+    current = 0
+    for run in runs:
+        if current > 0 and current + run > chunk_size:
+            chunks.append(current)
+            current = 0
+        current += int(run)
+    chunks.append(current)
+    return tuple(chunks)
+
+
+def reduce_groups(
+    data: xr.DataArray,
+    dim: str,
+    codes: np.ndarray,
+    group_by: Callable[[xr.DataArray], Any],
+    reducer_name: str,
+) -> Optional[xr.DataArray]:
+    """apply a common reducer to groups along dim using the flox engine of xarray
+
+    Args:
+        data (xr.DataArray): data cube
+        dim (str): grouped dimension
+        codes (np.ndarray): group of each element along dim
+        group_by (Callable[[xr.DataArray], Any]): creates the xarray GroupBy/Resample object
+        reducer_name (str): one of REDUCERS
+
+    Returns:
+        Optional[xr.DataArray]: reduced data cube or None if the engine does not support it
+    """
+    assert reducer_name in REDUCERS, f"Error! Invalid reducer: {reducer_name}"
+    method = FLOX_METHOD
+    if reducer_name == MEDIAN:
+        # median is not decomposable, so each group must be within a single chunk
+        if data.chunks is not None:
+            chunks = _group_aligned_chunks(
+                codes=codes, chunk_size=max(data.chunksizes[dim])
+            )
+            if chunks is None:
+                return None
+            data = data.chunk({dim: chunks})
+        method = "blockwise"
+    with xr.set_options(use_flox=True):
+        grouped = group_by(data)
+        reduced: xr.DataArray = getattr(grouped, reducer_name)(
+            method=method, keep_attrs=True
+        )
+    return reduced
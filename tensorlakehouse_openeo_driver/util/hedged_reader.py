@@ -0,0 +1,340 @@
+"""read layer for object storage that controls tail latency.
+
+- latency of reads is recorded per endpoint in a histogram
+- if a read takes longer than a percentile of the observed latencies, a duplicate (hedged)
+    request is issued and the first response wins
+- the number of concurrent reads per endpoint is adapted by AIMD (additive increase,
+    multiplicative decrease): it grows while reads succeed and halves when the endpoint throttles
+    (HTTP 429/503), in which case the read is retried with exponential backoff
+
+HedgedS3FileSystem applies it to every read of the filesystem, i.e., cat, cat_ranges, mappers
+(e.g., Zarr stores and kerchunk references) and range reads of file objects. It is the s3
+filesystem returned by object_storage_util and registered for the s3 protocol
+"""
+
+import asyncio
+import bisect
+import math
+import threading
+import time
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import fsspec
+import s3fs
+from s3fs.core import S3File
+
+from tensorlakehouse_openeo_driver.constants import (
+    HEDGE_DEFAULT_DEADLINE,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+    READ_MAX_RETRIES,
+    S3_MAX_CONCURRENCY,
+    logger,
+)
+
+THROTTLING_STATUS_CODES = [429, 503]
+THROTTLING_ERROR_CODES = [
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequests",
+    "RequestLimitExceeded",
+    "ServiceUnavailable",
+]
+
+
+class LatencyHistogram:
+    """histogram of latencies (seconds) with log-spaced buckets from 1 ms to ~100 s"""
+
+    def __init__(self, num_buckets: int = 64) -> None:
+        self.bounds = [
+            0.001 * 10 ** (5 * i / (num_buckets - 1)) for i in range(num_buckets)
+        ]
+        self.counts = [0] * (num_buckets + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        """upper bound of the bucket that contains the q-th quantile
+
+        Args:
+            q (float): quantile between 0 and 1
+
+        Returns:
+            Optional[float]: latency in seconds or None if there are no observations
+        """
+        assert 0 <= q <= 1, f"Error! Invalid quantile: {q}"
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = math.ceil(q * self.count)
+            cumulative = 0
+            for i, count in enumerate(self.counts):
+                cumulative += count
+                if cumulative >= rank:
+                    return self.bounds[min(i, len(self.bounds) - 1)]
+            return self.bounds[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+def _wake(waiter: "asyncio.Future[None]") -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AIMDLimiter:
+    """concurrency limiter whose limit grows by one per window of successful requests and is
+    halved when the endpoint throttles. Requests wait asynchronously, so that the limiter can be
+    shared by the event loops of all filesystems of the endpoint"""
+
+    def __init__(self, max_limit: int, min_limit: int = 1) -> None:
+        assert 1 <= min_limit <= max_limit, f"Error! {min_limit=} {max_limit=}"
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters: List[
+            Tuple[asyncio.AbstractEventLoop, "asyncio.Future[None]"]
+        ] = list()
+
+    def _notify_all(self) -> None:
+        """wake up all waiting requests, which check the limit again. Must hold the lock"""
+        waiters, self._waiters = self._waiters, list()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            await waiter
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._notify_all()
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._notify_all()
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.limit = max(self.min_limit, self.limit / 2)
+            logger.debug(f"AIMDLimiter::on_throttle - limit={self.limit:.1f}")
+
+
+class EndpointStats:
+    def __init__(self, max_concurrency: int) -> None:
+        self.histogram = LatencyHistogram()
+        self.limiter = AIMDLimiter(max_limit=max_concurrency)
+        self.hedged = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def add_hedged(self) -> None:
+        with self._lock:
+            self.hedged += 1
+
+    def add_throttled(self) -> None:
+        with self._lock:
+            self.throttled += 1
+
+
+_stats_lock = threading.Lock()
+_endpoint_stats: Dict[str, EndpointStats] = dict()
+
+
+def get_endpoint_stats(endpoint: str) -> EndpointStats:
+    with _stats_lock:
+        stats = _endpoint_stats.get(endpoint)
+        if stats is None:
+            stats = EndpointStats(max_concurrency=S3_MAX_CONCURRENCY)
+            _endpoint_stats[endpoint] = stats
+    return stats
+
+
+def get_latency_histograms() -> Dict[str, Dict[str, Any]]:
+    """latency summary of each endpoint, e.g., to be exported as metrics
+
+    Returns:
+        Dict[str, Dict[str, Any]]: endpoint and its count, mean and percentiles
+    """
+    with _stats_lock:
+        items = list(_endpoint_stats.items())
+    summary = dict()
+    for endpoint, stats in items:
+        snapshot = stats.histogram.snapshot()
+        snapshot["hedged"] = stats.hedged
+        snapshot["throttled"] = stats.throttled
+        snapshot["concurrency_limit"] = stats.limiter.limit
+        summary[endpoint] = snapshot
+    return summary
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """check whether the error, or the error that caused it, is an HTTP 429/503 response"""
+    current: Optional[BaseException] = error
+    while current is not None:
+        response = getattr(current, "response", None)
+        if isinstance(response, dict):
+            status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            code = response.get("Error", {}).get("Code")
+            if status in THROTTLING_STATUS_CODES or code in THROTTLING_ERROR_CODES:
+                return True
+        if any(code in str(current) for code in THROTTLING_ERROR_CODES):
+            return True
+        current = current.__cause__ or current.__context__
+    return False
+
+
+def get_endpoint(fs: fsspec.AbstractFileSystem) -> str:
+    endpoint = getattr(fs, "endpoint_url", None)
+    if endpoint is None:
+        client_kwargs = getattr(fs, "client_kwargs", None) or dict()
+        endpoint = client_kwargs.get("endpoint_url")
+    if endpoint is None:
+        protocol = fs.protocol
+        endpoint = protocol if isinstance(protocol, str) else protocol[0]
+    return str(endpoint)
+
+
+class HedgedReadMixin:
+    """hedged requests and adaptive concurrency for the reads of an async fsspec filesystem,
+    i.e., for every read that goes through _cat_file"""
+
+    hedge_percentile = HEDGE_PERCENTILE
+    hedge_min_samples = HEDGE_MIN_SAMPLES
+    hedge_default_deadline = HEDGE_DEFAULT_DEADLINE
+    read_max_retries = READ_MAX_RETRIES
+    read_backoff = 0.1
+
+    @property
+    def endpoint_stats(self) -> EndpointStats:
+        return get_endpoint_stats(endpoint=get_endpoint(fs=self))  # type: ignore[arg-type]
+
+    def _hedge_deadline(self, stats: EndpointStats) -> float:
+        if stats.histogram.count < self.hedge_min_samples:
+            return self.hedge_default_deadline
+        deadline = stats.histogram.percentile(self.hedge_percentile)
+        return deadline if deadline is not None else self.hedge_default_deadline
+
+    async def _timed_cat_file(
+        self, stats: EndpointStats, path: str, start: Any, end: Any, **kwargs
+    ) -> bytes:
+        await stats.limiter.acquire()
+        try:
+            begin = time.perf_counter()
+            data: bytes = await super()._cat_file(  # type: ignore[misc]
+                path, start=start, end=end, **kwargs
+            )
+            stats.histogram.observe(time.perf_counter() - begin)
+            stats.limiter.on_success()
+            return data
+        except Exception as e:
+            if is_throttling_error(e):
+                stats.add_throttled()
+                stats.limiter.on_throttle()
+            raise
+        finally:
+            stats.limiter.release()
+
+    async def _hedged_cat_file(
+        self, stats: EndpointStats, path: str, start: Any, end: Any, **kwargs
+    ) -> bytes:
+        primary: "asyncio.Future[bytes]" = asyncio.ensure_future(
+            self._timed_cat_file(stats, path, start, end, **kwargs)
+        )
+        first, _ = await asyncio.wait([primary], timeout=self._hedge_deadline(stats))
+        if primary in first:
+            return primary.result()
+        # the primary request is slower than most requests, so a duplicate is issued
+        stats.add_hedged()
+        hedge: "asyncio.Future[bytes]" = asyncio.ensure_future(
+            self._timed_cat_file(stats, path, start, end, **kwargs)
+        )
+        pending: Set["asyncio.Future[bytes]"] = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+        finally:
+            # the slower request is cancelled, so that it releases its slot
+            for future in pending:
+                future.cancel()
+        assert error is not None
+        raise error
+
+    async def _cat_file(self, path: str, start: Any = None, end: Any = None, **kwargs):
+        """read the object or bytes [start, end) of it. Throttled reads are retried with
+        exponential backoff
+
+        Args:
+            path (str): link to object
+            start (Any, optional): first byte. Defaults to None.
+            end (Any, optional): end position (exclusive). Defaults to None.
+
+        Returns:
+            bytes: content
+        """
+        stats = self.endpoint_stats
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_cat_file(stats, path, start, end, **kwargs)
+            except Exception as e:
+                if not is_throttling_error(e) or attempt >= self.read_max_retries:
+                    raise
+                delay = self.read_backoff * 2**attempt
+                logger.debug(f"HedgedReadMixin - throttled {path=} retry in {delay}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+
+class HedgedS3FileSystem(HedgedReadMixin, s3fs.S3FileSystem):
+    """S3 filesystem whose reads are hedged and whose concurrency is adapted per endpoint"""
+
+    def _open(self, path, mode="rb", **kwargs):
+        file = super()._open(path, mode=mode, **kwargs)
+        if "r" in mode:
+            # the cache of the file fetches ranges by S3File._fetch_range, which bypasses
+            # _cat_file
+            file.cache.fetcher = partial(self._fetch_file_range, file)
+        return file
+
+    def _fetch_file_range(self, file: S3File, start: int, end: int) -> bytes:
+        if start >= end:
+            return b""
+        data: bytes = self.cat_file(
+            file.path, start=start, end=end, version_id=file.version_id
+        )
+        return data
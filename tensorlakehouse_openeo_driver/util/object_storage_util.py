@@ -1,15 +1,59 @@
 import os
-from typing import Dict
+import threading
+from typing import Any, Dict, Optional, Tuple
 import logging
 import logging.config
 
+import fsspec
+import s3fs
+from boto3.session import Session
+
+from tensorlakehouse_openeo_driver.constants import (
+    S3_MAX_CONCURRENCY,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_TCP_KEEPALIVE,
+)
+from tensorlakehouse_openeo_driver.util.hedged_reader import HedgedS3FileSystem
+
+# s3 links opened by fsspec, e.g., by xarray or kerchunk, are read with hedged requests too
+fsspec.register_implementation("s3", HedgedS3FileSystem, clobber=True)
+
 assert os.path.isfile("logging.conf")
 logging.config.fileConfig(fname="logging.conf", disable_existing_loggers=False)
 logger = logging.getLogger("geodnLogger")
 
+# process-wide registry of credentials and filesystems, which are reused across requests so
+# that connection pools stay warm
+_registry_lock = threading.Lock()
+_credentials: Dict[str, Dict[str, str]] = dict()
+_filesystems: Dict[Tuple[str, str], s3fs.S3FileSystem] = dict()
+# boto3 sessions are not thread-safe, so each thread has its own sessions, which share the
+# credentials. Sessions of all threads are discarded when the generation changes
+_thread_local = threading.local()
+_generation = 0
+
 
 def get_credentials_by_bucket(bucket: str) -> Dict[str, str]:
-    """get the credentials to access the specified bucket
+    """get the credentials to access the specified bucket. Credentials are read from the
+    environment variables once per bucket
+
+    Args:
+        bucket (str): input bucket name
+
+    Returns:
+        Dict[str, str]: a dict that contains endpoint, access_key_id, secret_access_key, region,
+            endpoint
+    """
+    with _registry_lock:
+        credentials = _credentials.get(bucket)
+        if credentials is None:
+            credentials = _read_credentials(bucket=bucket)
+            _credentials[bucket] = credentials
+    return dict(credentials)
+
+
+def _read_credentials(bucket: str) -> Dict[str, str]:
+    """read the credentials to access the specified bucket from environment variables
 
     Args:
         bucket (str): input bucket name
@@ -47,6 +91,98 @@ def get_credentials_by_bucket(bucket: str) -> Dict[str, str]:
     return credentials
 
 
+def get_endpoint_url(endpoint: str) -> str:
+    if endpoint.lower().startswith("https://"):
+        return endpoint.lower()
+    return f"https://{endpoint.lower()}"
+
+
+def get_s3filesystem_options(bucket: str) -> Dict[str, Any]:
+    """get the fsspec options to access the specified bucket, which include the settings of
+    the connection pool
+
+    Args:
+        bucket (str): input bucket name
+
+    Returns:
+        Dict[str, Any]: s3fs.S3FileSystem options
+    """
+    credentials = get_credentials_by_bucket(bucket=bucket)
+    return {
+        "anon": False,
+        "endpoint_url": get_endpoint_url(endpoint=credentials["endpoint"]),
+        "key": credentials["access_key_id"],
+        "secret": credentials["secret_access_key"],
+        "max_concurrency": S3_MAX_CONCURRENCY,
+        "config_kwargs": {
+            "max_pool_connections": S3_MAX_POOL_CONNECTIONS,
+            "tcp_keepalive": S3_TCP_KEEPALIVE,
+        },
+    }
+
+
+def get_s3filesystem(bucket: str) -> s3fs.S3FileSystem:
+    """get the filesystem of the specified bucket. Filesystems are shared by all buckets that
+    have the same endpoint and credentials
+
+    Args:
+        bucket (str): input bucket name
+
+    Returns:
+        s3fs.S3FileSystem: filesystem
+    """
+    options = get_s3filesystem_options(bucket=bucket)
+    key = (options["endpoint_url"], options["key"])
+    with _registry_lock:
+        fs = _filesystems.get(key)
+        if fs is None:
+            logger.debug(f"get_s3filesystem - creating filesystem {bucket=}")
+            fs = HedgedS3FileSystem(**options)
+            _filesystems[key] = fs
+    return fs
+
+
+def get_boto3_session(bucket: str) -> Session:
+    """get the boto3 session of the specified bucket. Sessions are reused by the calling thread
+
+    Args:
+        bucket (str): input bucket name
+
+    Returns:
+        Session: boto3 session
+    """
+    credentials = get_credentials_by_bucket(bucket=bucket)
+    region = parse_region(endpoint=credentials["endpoint"])
+    key = (credentials["endpoint"], credentials["access_key_id"], region)
+    sessions: Optional[Dict[Tuple[str, str, str], Session]] = getattr(
+        _thread_local, "sessions", None
+    )
+    if sessions is None or _thread_local.generation != _generation:
+        sessions = dict()
+        _thread_local.sessions = sessions
+        _thread_local.generation = _generation
+    session = sessions.get(key)
+    if session is None:
+        # botocore loads its data files when a session is created, which is not thread-safe
+        with _registry_lock:
+            session = Session(
+                aws_access_key_id=credentials["access_key_id"],
+                aws_secret_access_key=credentials["secret_access_key"],
+                region_name=region,
+            )
+        sessions[key] = session
+    return session
+
+
+def clear_registry() -> None:
+    """remove cached credentials, filesystems and sessions, e.g., after credentials rotate"""
+    global _generation
+    with _registry_lock:
+        _credentials.clear()
+        _filesystems.clear()
+        _generation += 1
+
+
 def parse_region(endpoint: str) -> str:
     """extract region from endpoint
 
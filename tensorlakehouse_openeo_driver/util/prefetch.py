@@ -0,0 +1,491 @@
+"""readahead of the chunks of Zarr stores (including kerchunk views of NetCDF and GRIB2 files).
+
+- the planned order of the chunks is computed from the STAC items (in the order returned by
+    the search) and from the selected extent, i.e., before dask requests any chunk
+- once dask reads the first planned chunk, the chunks of the plan are fetched in background,
+    with at most PREFETCH_WINDOW reads in flight
+- prefetching pauses while the chunks that have not been consumed yet exceed PREFETCH_MAX_BYTES
+- prefetchers are registered by job, so that they are cancelled when the job finishes. Reads
+    are executed by a pool of PREFETCH_MAX_WORKERS threads shared by all prefetchers, so that
+    prefetchers that do not belong to a job (e.g., synchronous requests) do not leak threads
+- chunks are read where dask runs the tasks: a store that is pickled, e.g., to be sent to the
+    workers of a distributed cluster, is served by a replica of the prefetcher in the worker
+    process. Replicas share the plan, prefetch ahead of the chunks read by their worker and
+    are cancelled with the job on all workers
+"""
+
+import itertools
+import json
+import threading
+import uuid
+import weakref
+from collections.abc import MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import xarray as xr
+from distributed import default_client
+
+from tensorlakehouse_openeo_driver.constants import (
+    PREFETCH_MAX_BYTES,
+    PREFETCH_MAX_WORKERS,
+    PREFETCH_WINDOW,
+    logger,
+)
+
+# id of the job whose process graph is being executed by the current thread
+_current_job_id: ContextVar[Optional[str]] = ContextVar("prefetch_job_id", default=None)
+_registry_lock = threading.Lock()
+_prefetchers: Dict[str, List["Prefetcher"]] = dict()
+# prefetchers of this process by ID, including the replicas of prefetchers of other processes
+_replicas: "weakref.WeakValueDictionary[str, Prefetcher]" = (
+    weakref.WeakValueDictionary()
+)
+# threads that read the chunks of all prefetchers, which are started on first use
+_executor = ThreadPoolExecutor(
+    max_workers=PREFETCH_MAX_WORKERS, thread_name_prefix="prefetch"
+)
+
+
+def _get_replica_store(
+    state: Dict[str, Any], store_id: int, store: MutableMapping
+) -> "PrefetchingStore":
+    """unpickle a PrefetchingStore: the store is served by the prefetcher of this process that
+    has the same ID, which is created if needed"""
+    prefetcher_id = state["prefetcher_id"]
+    job_id = state["job_id"]
+    with _registry_lock:
+        prefetcher = _replicas.get(prefetcher_id)
+        if prefetcher is None:
+            prefetcher = Prefetcher(
+                window=state["window"],
+                max_bytes=state["max_bytes"],
+                job_id=job_id,
+                prefetcher_id=prefetcher_id,
+                replica=True,
+            )
+            _replicas[prefetcher_id] = prefetcher
+            if job_id is not None:
+                _prefetchers.setdefault(job_id, list()).append(prefetcher)
+    prefetcher.register(store_id=store_id, store=store, plan=state["plan"])
+    return PrefetchingStore(prefetcher=prefetcher, store_id=store_id)
+
+
+class PrefetchingStore(MutableMapping):
+    """read-only view of a store whose planned chunks are served by the prefetcher"""
+
+    def __init__(self, prefetcher: "Prefetcher", store_id: int) -> None:
+        self.prefetcher = prefetcher
+        self.store_id = store_id
+        self.store = prefetcher.stores[store_id]
+
+    def __reduce__(self):
+        # other processes, e.g., dask workers, read the store through a replica of the
+        # prefetcher, which has the same plan
+        state = self.prefetcher.get_state()
+        return (_get_replica_store, (state, self.store_id, self.store))
+
+    def __getitem__(self, key: str) -> bytes:
+        return self.prefetcher.get(store_id=self.store_id, key=key)
+
+    def __setitem__(self, key: str, value: bytes) -> None:
+        raise PermissionError("Error! PrefetchingStore is read-only")
+
+    def __delitem__(self, key: str) -> None:
+        raise PermissionError("Error! PrefetchingStore is read-only")
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.store
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+
+class Prefetcher:
+    """fetches the chunks of one or more stores in a planned order. Chunks are consumed in
+    whatever order dask reads them: a chunk that has not been prefetched yet is read directly
+    and skipped by the prefetcher"""
+
+    def __init__(
+        self,
+        window: int = PREFETCH_WINDOW,
+        max_bytes: int = PREFETCH_MAX_BYTES,
+        job_id: Optional[str] = None,
+        prefetcher_id: Optional[str] = None,
+        replica: bool = False,
+    ) -> None:
+        assert window > 0, f"Error! Invalid window: {window}"
+        self.window = window
+        self.max_bytes = max_bytes
+        self.job_id = job_id
+        self.prefetcher_id = prefetcher_id or uuid.uuid4().hex
+        # a replica serves the chunks read by one worker, while other workers read the others
+        self.replica = replica
+        self.stores: Dict[int, MutableMapping] = dict()
+        # planned chunks as (store_id, key) and their position in the plan
+        self.plan: List[Tuple[int, str]] = list()
+        self.positions: Dict[Tuple[int, str], int] = dict()
+        self.consumed: Set[int] = set()
+        # position of the chunks that have been submitted but not consumed yet
+        self.futures: Dict[int, Future] = dict()
+        self.sizes: Dict[int, int] = dict()
+        self.in_flight = 0
+        self.buffered_bytes = 0
+        self.next_position = 0
+        self.started = False
+        self.cancelled = False
+        self.hits = 0
+        self.misses = 0
+        # reentrant, because the callback of a future that is already done runs immediately
+        self._lock = threading.RLock()
+
+    def get_state(self) -> Dict[str, Any]:
+        """state that is shared by the replicas of this prefetcher"""
+        with self._lock:
+            return dict(
+                prefetcher_id=self.prefetcher_id,
+                job_id=self.job_id,
+                window=self.window,
+                max_bytes=self.max_bytes,
+                plan=list(self.plan),
+            )
+
+    def register(
+        self, store_id: int, store: MutableMapping, plan: List[Tuple[int, str]]
+    ) -> None:
+        """add a store and the chunks that have been planned by another process
+
+        Args:
+            store_id (int): index of the store in the original prefetcher
+            store (MutableMapping): wrapped store
+            plan (List[Tuple[int, str]]): plan of the original prefetcher
+        """
+        with self._lock:
+            if store_id in self.stores:
+                return
+            self.stores[store_id] = store
+            # the plan of the original prefetcher is append-only
+            for chunk in plan[len(self.plan) :]:
+                self.positions[chunk] = len(self.plan)
+                self.plan.append(chunk)
+            # chunks of the store that have been skipped, because it was unknown, are
+            # scheduled again
+            positions = [
+                position
+                for position, (other_id, _) in enumerate(
+                    self.plan[: self.next_position]
+                )
+                if other_id == store_id
+            ]
+            if len(positions) > 0:
+                self.next_position = positions[0]
+            self._schedule()
+
+    def wrap(self, store: MutableMapping) -> PrefetchingStore:
+        """wrap the store, so that its chunks can be prefetched once they are planned
+
+        Args:
+            store (MutableMapping): e.g., fsspec mapper of a Zarr store
+
+        Returns:
+            PrefetchingStore: store to be opened by xarray
+        """
+        with self._lock:
+            store_id = len(self.stores)
+            self.stores[store_id] = store
+        return PrefetchingStore(prefetcher=self, store_id=store_id)
+
+    def add_keys(self, store: PrefetchingStore, keys: List[str]) -> None:
+        """append the keys of the store to the plan, e.g., in the order of the STAC items
+
+        Args:
+            store (PrefetchingStore): store returned by wrap
+            keys (List[str]): chunk keys
+        """
+        assert store.prefetcher is self, "Error! store has not been wrapped by self"
+        with self._lock:
+            for key in keys:
+                chunk = (store.store_id, key)
+                if chunk not in self.positions:
+                    self.positions[chunk] = len(self.plan)
+                    self.plan.append(chunk)
+
+    def _on_done(self, position: int, future: Future) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            # the chunk might have been consumed or discarded in the meantime
+            if (
+                self.futures.get(position) is future
+                and not future.cancelled()
+                and future.exception() is None
+            ):
+                size = len(future.result())
+                self.sizes[position] = size
+                self.buffered_bytes += size
+            self._schedule()
+
+    def _schedule(self) -> None:
+        """submit the next planned chunks while less than window reads are in flight and the
+        chunks that have not been consumed fit in max_bytes. Caller holds the lock"""
+        while (
+            self.started
+            and not self.cancelled
+            and self.next_position < len(self.plan)
+            and self.in_flight < self.window
+            and self.buffered_bytes < self.max_bytes
+        ):
+            position = self.next_position
+            self.next_position += 1
+            store_id, key = self.plan[position]
+            if (
+                position in self.consumed
+                or position in self.futures
+                or store_id not in self.stores
+            ):
+                continue
+            self.in_flight += 1
+            future = _executor.submit(self.stores[store_id].__getitem__, key)
+            self.futures[position] = future
+            future.add_done_callback(partial(self._on_done, position))
+
+    def get(self, store_id: int, key: str) -> bytes:
+        """read a chunk of the store, either from the prefetched chunks or from the store
+
+        Args:
+            store_id (int): index of the store
+            key (str): chunk key
+
+        Returns:
+            bytes: content of the chunk
+        """
+        store = self.stores[store_id]
+        position = self.positions.get((store_id, key))
+        data: bytes
+        if position is None or self.cancelled:
+            data = store[key]
+            return data
+        with self._lock:
+            # the first read of a planned chunk means that the computation has started
+            self.started = True
+            self.consumed.add(position)
+            self.buffered_bytes -= self.sizes.pop(position, 0)
+            future = self.futures.pop(position, None)
+            if self.replica:
+                self._discard_before(position=position - self.window)
+            self._schedule()
+        if future is not None:
+            try:
+                data = future.result()
+                self.hits += 1
+                return data
+            except Exception as e:
+                logger.debug(f"Prefetcher::get - prefetch of {key=} failed: {e}")
+        self.misses += 1
+        data = store[key]
+        return data
+
+    def _discard_before(self, position: int) -> None:
+        """discard the chunks that are far behind the latest read, because other workers read
+        them. Caller holds the lock"""
+        for stale in [p for p in self.futures if p < position]:
+            self.futures.pop(stale).cancel()
+            self.buffered_bytes -= self.sizes.pop(stale, 0)
+            self.consumed.add(stale)
+
+    def plan_chunks(
+        self,
+        store: PrefetchingStore,
+        variables: List[str],
+        source: xr.Dataset,
+        subset: xr.DataArray,
+    ) -> int:
+        """plan the chunks of the variables of the store that intersect the subset. Planning is
+        best-effort: if it fails, e.g., because the store is not a Zarr (v2) store, chunks are
+        read directly
+
+        Args:
+            store (PrefetchingStore): store returned by wrap
+            variables (List[str]): selected variables
+            source (xr.Dataset): dataset opened from store
+            subset (xr.DataArray): selection of the dataset
+
+        Returns:
+            int: number of planned chunks
+        """
+        try:
+            keys = plan_chunk_keys(
+                store=store,
+                variables=variables,
+                index_ranges=get_index_ranges(source=source, subset=subset),
+            )
+        except Exception as e:
+            logger.warning(
+                f"Prefetcher::plan_chunks - chunks are not prefetched: {e!r}"
+            )
+            return 0
+        self.add_keys(store=store, keys=keys)
+        return len(keys)
+
+    def cancel(self) -> None:
+        """stop prefetching and discard the chunks that have not been consumed"""
+        with self._lock:
+            self.cancelled = True
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+            self.sizes.clear()
+            self.buffered_bytes = 0
+        logger.debug(f"Prefetcher::cancel - hits={self.hits} misses={self.misses}")
+
+
+def create_prefetcher() -> Optional[Prefetcher]:
+    """create a prefetcher that is cancelled with the current job
+
+    Returns:
+        Optional[Prefetcher]: prefetcher or None if prefetching is disabled
+    """
+    if PREFETCH_WINDOW <= 0:
+        return None
+    job_id = _current_job_id.get()
+    prefetcher = Prefetcher(job_id=job_id)
+    with _registry_lock:
+        _replicas[prefetcher.prefetcher_id] = prefetcher
+        if job_id is not None:
+            _prefetchers.setdefault(job_id, list()).append(prefetcher)
+    return prefetcher
+
+
+def _cancel_local_job(job_id: str) -> int:
+    """cancel the prefetchers of the job that belong to this process"""
+    with _registry_lock:
+        prefetchers = _prefetchers.pop(job_id, list())
+    for prefetcher in prefetchers:
+        prefetcher.cancel()
+    return len(prefetchers)
+
+
+def cancel_job(job_id: str) -> int:
+    """cancel all prefetchers of the job, including their replicas on the workers of the dask
+    cluster, if this process has a distributed client
+
+    Args:
+        job_id (str): job ID
+
+    Returns:
+        int: number of cancelled prefetchers
+    """
+    cancelled = _cancel_local_job(job_id=job_id)
+    try:
+        client = default_client()
+    except ValueError:
+        # no distributed cluster, i.e., chunks are read by this process
+        return cancelled
+    try:
+        cancelled_by_worker: Dict[str, int] = client.run(
+            _cancel_local_job, job_id=job_id
+        )
+    except Exception as e:
+        logger.warning(f"cancel_job - cannot cancel the prefetchers of workers: {e!r}")
+        return cancelled
+    return cancelled + sum(cancelled_by_worker.values())
+
+
+@contextmanager
+def job_context(job_id: str):
+    """prefetchers created within this context belong to the job and are cancelled when the
+    job finishes or fails"""
+    token = _current_job_id.set(job_id)
+    try:
+        yield
+    finally:
+        _current_job_id.reset(token)
+        cancel_job(job_id=job_id)
+
+
+def get_index_ranges(
+    source: xr.Dataset, subset: xr.DataArray
+) -> Dict[str, Tuple[int, int]]:
+    """get the positions [start, stop) of the subset in each indexed dimension of the source
+
+    Args:
+        source (xr.Dataset): dataset as stored
+        subset (xr.DataArray): selection of the dataset
+
+    Returns:
+        Dict[str, Tuple[int, int]]: dimension name and range of positions. Dimensions whose
+            values are not in source have an empty range
+    """
+    ranges: Dict[str, Tuple[int, int]] = dict()
+    for dim in map(str, subset.dims):
+        if dim not in source.indexes or dim not in subset.indexes:
+            continue
+        index = source.indexes[dim]
+        if not index.is_unique:
+            continue
+        positions = index.get_indexer(subset.indexes[dim])
+        positions = positions[positions >= 0]
+        if len(positions) == 0:
+            ranges[dim] = (0, 0)
+        else:
+            ranges[dim] = (int(np.min(positions)), int(np.max(positions)) + 1)
+    return ranges
+
+
+def _load_json(store: MutableMapping, key: str) -> Optional[Dict[str, Any]]:
+    try:
+        value = store[key]
+    except KeyError:
+        return None
+    content: Dict[str, Any] = (
+        json.loads(value) if isinstance(value, (bytes, str)) else value
+    )
+    return content
+
+
+def plan_chunk_keys(
+    store: MutableMapping,
+    variables: List[str],
+    index_ranges: Dict[str, Tuple[int, int]],
+) -> List[str]:
+    """list the keys of the chunks of the variables that intersect the selection. Keys are
+    sorted by chunk index, i.e., in the order of the first (usually temporal) dimension, and
+    the variables are interleaved, which is the order in which dask reads them
+
+    Args:
+        store (MutableMapping): Zarr (v2) store
+        variables (List[str]): selected variables
+        index_ranges (Dict[str, Tuple[int, int]]): positions [start, stop) of the selection
+            in each dimension. Dimensions that are not specified are read entirely
+
+    Returns:
+        List[str]: chunk keys
+    """
+    planned: List[Tuple[Tuple[int, ...], int, str]] = list()
+    for variable_index, variable in enumerate(variables):
+        zarray = _load_json(store=store, key=f"{variable}/.zarray")
+        zattrs = _load_json(store=store, key=f"{variable}/.zattrs") or dict()
+        if zarray is None:
+            continue
+        shape = zarray["shape"]
+        chunks = zarray["chunks"]
+        separator = zarray.get("dimension_separator") or "."
+        dims = zattrs.get("_ARRAY_DIMENSIONS", [None] * len(shape))
+        chunk_ranges = list()
+        for dim, size, chunk in zip(dims, shape, chunks):
+            start, stop = index_ranges.get(dim, (0, size))
+            if stop <= start:
+                chunk_ranges.append(range(0))
+            else:
+                chunk_ranges.append(range(start // chunk, (stop - 1) // chunk + 1))
+        for chunk_index in itertools.product(*chunk_ranges):
+            key = separator.join(str(i) for i in chunk_index) if chunk_index else "0"
+            planned.append((chunk_index, variable_index, f"{variable}/{key}"))
+    planned.sort()
+    return [key for _, _, key in planned]
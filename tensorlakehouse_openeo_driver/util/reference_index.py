@@ -0,0 +1,366 @@
+"""precompute byte-range references (kerchunk) of the NetCDF and GRIB2 files of a collection,
+so that readers open a Zarr view of the files instead of parsing the header of each file.
+
+Usage:
+    python -m tensorlakehouse_openeo_driver.util.reference_index --collection-id <id>
+"""
+
+import argparse
+import json
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import urlparse
+
+import fsspec
+import xarray as xr
+
+from tensorlakehouse_openeo_driver.constants import (
+    GRIB2_MEDIA_TYPE,
+    NETCDF_MEDIA_TYPE,
+    REFERENCES_ASSET,
+    REFERENCES_MEDIA_TYPE,
+    REFERENCES_SUFFIX,
+    STAC_URL,
+    X_NETCDF_MEDIA_TYPE,
+    logger,
+)
+from tensorlakehouse_openeo_driver.file_reader.cloud_storage_file_reader import (
+    CloudStorageFileReader,
+)
+from tensorlakehouse_openeo_driver.util import object_storage_util
+from tensorlakehouse_openeo_driver.util.prefetch import Prefetcher
+
+# a single set of references for NetCDF files and one set per hypercube for GRIB2 files
+References = Union[Dict[str, Any], List[Dict[str, Any]]]
+
+# GRIB2 messages that share these dimensions are combined into the same hypercube
+GRIB2_IDENTICAL_DIMS = ["latitude", "longitude", "time"]
+GRIB2_CONCAT_DIMS = ["step"]
+
+
+def _is_local(url: str) -> bool:
+    return urlparse(url).scheme == ""
+
+
+def to_s3_url(url: str) -> str:
+    """kerchunk and fsspec address COS objects using the s3 scheme
+
+    Args:
+        url (str): link to file either using s3 or https scheme
+
+    Returns:
+        str: link to file using s3 scheme
+    """
+    if url.lower().startswith("http"):
+        return CloudStorageFileReader._convert_https_to_s3(url=url)
+    return url
+
+
+def get_storage_options(url: str) -> Dict[str, Any]:
+    """get the fsspec options that grant access to the bucket of the specified url
+
+    Args:
+        url (str): link to file
+
+    Returns:
+        Dict[str, Any]: storage options, which are empty for local files
+    """
+    if _is_local(url):
+        return dict()
+    bucket = CloudStorageFileReader._extract_bucket_name_from_url(url=url)
+    return object_storage_util.get_s3filesystem_options(bucket=bucket)
+
+
+def get_references_url(url: str) -> str:
+    """references are stored as a sidecar file next to the data file"""
+    return f"{url}.{REFERENCES_SUFFIX}"
+
+
+def _generate_netcdf_references(
+    url: str, storage_options: Dict[str, Any]
+) -> Dict[str, Any]:
+    from kerchunk.hdf import SingleHdf5ToZarr
+    from kerchunk.netCDF3 import NetCDF3ToZarr
+
+    with fsspec.open(url, mode="rb", **storage_options) as file_obj:
+        signature = file_obj.read(3)
+    # NetCDF4 files are HDF5 files, whereas NetCDF3 files start with CDF
+    refs: Dict[str, Any]
+    if signature == b"CDF":
+        refs = NetCDF3ToZarr(url, storage_options=storage_options).translate()
+    else:
+        with fsspec.open(url, mode="rb", **storage_options) as file_obj:
+            refs = SingleHdf5ToZarr(file_obj, url).translate()
+    return refs
+
+
+def _get_type_of_level(refs: Dict[str, Any]) -> str:
+    """get the typeOfLevel of a GRIB2 message from the attributes of its variables"""
+    for key, value in refs["refs"].items():
+        if key.endswith("/.zattrs") and "/" in key:
+            attrs = json.loads(value) if isinstance(value, str) else value
+            type_of_level = attrs.get("GRIB_typeOfLevel")
+            if type_of_level is not None:
+                return str(type_of_level)
+    return "unknown"
+
+
+def _generate_grib2_references(
+    url: str, storage_options: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    from kerchunk.combine import MultiZarrToZarr, drop
+    from kerchunk.grib2 import scan_grib
+
+    messages = scan_grib(url, storage_options=storage_options)
+    # like cfgrib.open_datasets, messages are split into hypercubes by type of level
+    groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for refs in messages:
+        groups[_get_type_of_level(refs=refs)].append(refs)
+    hypercubes = list()
+    for type_of_level, group in groups.items():
+        if len(group) == 1:
+            hypercubes.append(group[0])
+            continue
+        mzz = MultiZarrToZarr(
+            group,
+            remote_protocol=fsspec.utils.get_protocol(url),
+            remote_options=storage_options,
+            concat_dims=[type_of_level] + GRIB2_CONCAT_DIMS,
+            identical_dims=GRIB2_IDENTICAL_DIMS,
+            preprocess=drop(("valid_time",)),
+        )
+        hypercubes.append(mzz.translate())
+    return hypercubes
+
+
+def generate_references(
+    url: str, media_type: str, storage_options: Dict[str, Any]
+) -> References:
+    """scan the file and compute the byte-range references of its chunks
+
+    Args:
+        url (str): link to NetCDF or GRIB2 file
+        media_type (str): media type of the asset
+        storage_options (Dict[str, Any]): fsspec options
+
+    Returns:
+        References: kerchunk references
+    """
+    if media_type in [NETCDF_MEDIA_TYPE, X_NETCDF_MEDIA_TYPE]:
+        return _generate_netcdf_references(url=url, storage_options=storage_options)
+    elif media_type == GRIB2_MEDIA_TYPE:
+        return _generate_grib2_references(url=url, storage_options=storage_options)
+    else:
+        raise ValueError(f"Error! Unsupported media type: {media_type}")
+
+
+def write_references(url: str, references: References) -> str:
+    """write references as a sidecar file next to the data file
+
+    Args:
+        url (str): link to data file
+        references (References): kerchunk references
+
+    Returns:
+        str: link to references file
+    """
+    references_url = get_references_url(url=url)
+    storage_options = get_storage_options(url=references_url)
+    fs, path = fsspec.core.url_to_fs(references_url, **storage_options)
+    fs.pipe(path, json.dumps(references).encode())
+    logger.debug(f"Wrote references: {references_url}")
+    return references_url
+
+
+def _load_references(references_url: str) -> References:
+    storage_options = get_storage_options(url=references_url)
+    with fsspec.open(references_url, mode="rb", **storage_options) as file_obj:
+        references: References = json.load(file_obj)
+    return references
+
+
+def _open_references(
+    refs: Dict[str, Any],
+    references_url: str,
+    prefetcher: Optional[Prefetcher] = None,
+) -> xr.Dataset:
+    """open a Zarr view of a single set of references"""
+    storage_options = get_storage_options(url=references_url)
+    # assumption: data files and references file are in the same bucket
+    fs = fsspec.filesystem(
+        "reference",
+        fo=refs,
+        remote_protocol=fsspec.utils.get_protocol(references_url),
+        remote_options=storage_options,
+    )
+    store = fs.get_mapper("")
+    if prefetcher is not None:
+        store = prefetcher.wrap(store=store)
+    ds = xr.open_dataset(
+        store,
+        engine="zarr",
+        backend_kwargs={"consolidated": False},
+        chunks={},
+    )
+    if prefetcher is not None:
+        ds.encoding["prefetch_store"] = store
+    return ds
+
+
+def open_reference_datasets(
+    references_url: str, prefetcher: Optional[Prefetcher] = None
+) -> List[xr.Dataset]:
+    """open a Zarr view of the data file through its references. Chunks are read directly from
+    the data file by byte-range requests
+
+    Args:
+        references_url (str): link to references file
+        prefetcher (Optional[Prefetcher], optional): if specified, the Zarr store of each
+            dataset is wrapped by the prefetcher and set as "prefetch_store" in its
+            encoding, so that the caller can plan its chunks. Defaults to None.
+
+    Returns:
+        List[xr.Dataset]: one dask-backed dataset per hypercube
+    """
+    references_url = to_s3_url(url=references_url)
+    references = _load_references(references_url=references_url)
+    if isinstance(references, dict):
+        references = [references]
+    return [
+        _open_references(
+            refs=refs, references_url=references_url, prefetcher=prefetcher
+        )
+        for refs in references
+    ]
+
+
+def _get_array_dimensions(refs: Dict[str, Any]) -> Dict[str, List[str]]:
+    """get the dimensions of each variable of a set of references"""
+    dims = dict()
+    for key, value in refs["refs"].items():
+        if key.endswith("/.zattrs"):
+            attrs = json.loads(value) if isinstance(value, str) else value
+            dims[key[: -len("/.zattrs")]] = attrs.get("_ARRAY_DIMENSIONS", [])
+    return dims
+
+
+def open_combined_reference_dataset(
+    references_urls: List[str],
+    concat_dim: str,
+    prefetcher: Optional[Prefetcher] = None,
+) -> Optional[xr.Dataset]:
+    """combine the references of several NetCDF files along concat_dim into a single Zarr view,
+    so that a multi-file query opens one lazy dataset instead of concatenating one dataset per
+    file
+
+    Args:
+        references_urls (List[str]): links to the references files, one per data file
+        concat_dim (str): dimension along which files are combined
+        prefetcher (Optional[Prefetcher], optional): see open_reference_datasets. Defaults
+            to None.
+
+    Returns:
+        Optional[xr.Dataset]: dask-backed dataset or None if the references cannot be combined,
+            e.g., because concat_dim is not a variable of every file
+    """
+    from kerchunk.combine import MultiZarrToZarr
+
+    references_urls = [to_s3_url(url=url) for url in references_urls]
+    references = list()
+    for url in references_urls:
+        refs = _load_references(references_url=url)
+        # GRIB2 references are split into hypercubes, which are not combined
+        if not isinstance(refs, dict) or f"{concat_dim}/.zarray" not in refs["refs"]:
+            return None
+        references.append(refs)
+    # variables that do not depend on concat_dim (e.g., coordinates) are taken from the first file
+    identical_dims = [
+        name
+        for name, dims in _get_array_dimensions(refs=references[0]).items()
+        if concat_dim not in dims
+    ]
+    mzz = MultiZarrToZarr(
+        references,
+        remote_protocol=fsspec.utils.get_protocol(references_urls[0]),
+        remote_options=get_storage_options(url=references_urls[0]),
+        concat_dims=[concat_dim],
+        identical_dims=identical_dims,
+    )
+    return _open_references(
+        refs=mzz.translate(), references_url=references_urls[0], prefetcher=prefetcher
+    )
+
+
+def index_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """generate references of the data asset of the item and add them as a new asset
+
+    Args:
+        item (Dict[str, Any]): STAC item as dict
+
+    Returns:
+        Dict[str, Any]: updated item
+    """
+    asset = CloudStorageFileReader._get_data_asset(assets=item["assets"])
+    url = to_s3_url(url=asset["href"])
+    storage_options = get_storage_options(url=url)
+    references = generate_references(
+        url=url, media_type=asset["type"], storage_options=storage_options
+    )
+    references_url = write_references(url=url, references=references)
+    item["assets"][REFERENCES_ASSET] = {
+        "href": references_url,
+        "type": REFERENCES_MEDIA_TYPE,
+        "roles": ["index"],
+    }
+    return item
+
+
+def index_collection(
+    collection_id: str, limit: Optional[int] = None, page_size: int = 100
+) -> int:
+    """add references to all items of the collection that have NetCDF or GRIB2 assets
+
+    Args:
+        collection_id (str): collection ID
+        limit (Optional[int], optional): max number of items. Defaults to None, i.e., all items.
+        page_size (int, optional): number of items per request. Defaults to 100.
+
+    Returns:
+        int: number of indexed items
+    """
+    from tensorlakehouse_openeo_driver.stac.stac import STAC
+
+    stac = STAC(url=STAC_URL)
+    counter = 0
+    for item in stac.iter_items(
+        collection_id=collection_id, limit=limit, page_size=page_size
+    ):
+        asset = CloudStorageFileReader._get_data_asset(assets=item["assets"])
+        if asset.get("type") not in [
+            NETCDF_MEDIA_TYPE,
+            X_NETCDF_MEDIA_TYPE,
+            GRIB2_MEDIA_TYPE,
+        ]:
+            continue
+        item = index_item(item=item)
+        stac.update_item(item=item, collection_id=collection_id)
+        counter += 1
+    logger.info(f"Indexed {counter} items of {collection_id}")
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate byte-range references of NetCDF and GRIB2 items"
+    )
+    parser.add_argument("--collection-id", required=True)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+    index_collection(
+        collection_id=args.collection_id, limit=args.limit, page_size=args.page_size
+    )
+
+
+if __name__ == "__main__":
+    main()
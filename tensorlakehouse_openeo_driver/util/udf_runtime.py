@@ -0,0 +1,235 @@
+import ast
+import hashlib
+import multiprocessing
+import threading
+import time
+from multiprocessing.pool import Pool
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from tensorlakehouse_openeo_driver.constants import (
+    UDF_MAX_MEMORY,
+    UDF_MAX_WORKERS,
+    UDF_TIMEOUT,
+    logger,
+)
+
+# functions of the UDFs that have been executed by this process, keyed by the hash of the source
+_FUNCTIONS: Dict[str, Callable] = dict()
+# code objects of the UDFs that have been compiled by this process, keyed by the hash of the source
+_CODE: Dict[str, Tuple[str, Any]] = dict()
+_pool: Optional[Pool] = None
+_pool_lock = threading.Lock()
+# seconds between checks that the UDF processes are alive while waiting for a result
+POLL_INTERVAL = 1.0
+# dask configuration of the clusters that run UDFs: the UDF processes are started by the dask
+# workers, which must not be daemonic processes
+DASK_CONFIG = {"distributed.worker.daemon": False}
+
+
+def get_digest(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def compile_udf(source: str) -> Tuple[str, Any]:
+    """compile the UDF without running it. The result is cached by the hash of the source
+
+    Args:
+        source (str): python code that defines a function
+
+    Raises:
+        ValueError: if the code does not define a function at module level
+
+    Returns:
+        Tuple[str, Any]: name of the first function defined by the code and code object
+    """
+    digest = get_digest(source)
+    if digest not in _CODE:
+        tree = ast.parse(source, filename=f"<udf-{digest[:12]}>")
+        names = [
+            node.name
+            for node in tree.body
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+        ]
+        if len(names) == 0:
+            raise ValueError("Error! The UDF does not define a function")
+        code = compile(tree, filename=f"<udf-{digest[:12]}>", mode="exec")
+        _CODE[digest] = (names[0], code)
+    return _CODE[digest]
+
+
+def _get_function(source: str) -> Callable:
+    """run the code of the UDF in its own namespace once per process and return its function"""
+    digest = get_digest(source)
+    if digest not in _FUNCTIONS:
+        name, code = compile_udf(source=source)
+        namespace: Dict[str, Any] = {"__name__": f"udf_{digest[:12]}"}
+        exec(code, namespace)
+        _FUNCTIONS[digest] = namespace[name]
+    return _FUNCTIONS[digest]
+
+
+def _limit_resources(max_memory: int) -> None:
+    """initializer of the UDF processes"""
+    if max_memory > 0:
+        import resource
+
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+
+def _call_udf(source: str, block: np.ndarray, context: Any) -> np.ndarray:
+    """run the UDF on a block of the data cube, in a UDF process"""
+    f = _get_function(source=source)
+    return np.asarray(f(block, context))
+
+
+def _get_pool() -> Pool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if multiprocessing.current_process().daemon:
+                raise RuntimeError(
+                    "Error! UDFs cannot start processes from a daemonic process, e.g., set "
+                    "distributed.worker.daemon to False on the dask workers"
+                )
+            # forking a process that runs threads (e.g., dask, gunicorn) might deadlock
+            context = multiprocessing.get_context("spawn")
+            _pool = context.Pool(
+                processes=UDF_MAX_WORKERS,
+                initializer=_limit_resources,
+                initargs=(UDF_MAX_MEMORY,),
+            )
+        return _pool
+
+
+def _terminate_pool(pool: Pool) -> None:
+    """kill the UDF processes, e.g., because one of them is stuck"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.terminate()
+
+
+def _has_dead_worker(workers: List[BaseProcess]) -> bool:
+    """check whether one of the UDF processes exited, e.g., because it was killed by the OS.
+    The pool replaces dead processes, but the tasks they were running are lost"""
+    return any(worker.exitcode is not None for worker in workers)
+
+
+def _apply(block: np.ndarray, source: str, context: Any, timeout: float) -> np.ndarray:
+    """run the UDF on a block in a UDF process and wait for the result. If a UDF process dies
+    or the UDF does not finish within timeout, the pool is terminated, so that the next call
+    starts new processes"""
+    pool = _get_pool()
+    # processes of the pool are private, but they are the only way to detect that the
+    # process that runs the task died
+    workers: List[BaseProcess] = list(pool._pool)  # type: ignore[attr-defined]
+    task = pool.apply_async(_call_udf, (source, block, context))
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            result: np.ndarray = task.get(timeout=max(min(POLL_INTERVAL, remaining), 0))
+            return result
+        except multiprocessing.TimeoutError:
+            if _has_dead_worker(workers=workers):
+                _terminate_pool(pool)
+                raise RuntimeError(
+                    f"Error! A UDF process died while processing a chunk of shape {block.shape}, "
+                    f"e.g., because it exceeded {UDF_MAX_MEMORY} bytes"
+                )
+            if remaining <= POLL_INTERVAL:
+                _terminate_pool(pool)
+                raise TimeoutError(
+                    f"Error! The UDF did not process a chunk of shape {block.shape} within {timeout} seconds"
+                )
+
+
+def _check_shape(result: np.ndarray, block: np.ndarray) -> None:
+    if result.shape != block.shape:
+        raise ValueError(
+            "Error! The UDF is applied to each chunk of the data cube and must return an array "
+            "with the shape of its input, i.e., it cannot reduce or add dimensions: "
+            f"{result.shape} != {block.shape}. Use reduce_dimension or apply_dimension instead"
+        )
+
+
+def run_block(
+    block: np.ndarray, source: str, context: Any, timeout: float = UDF_TIMEOUT
+) -> np.ndarray:
+    """run the UDF on a block in an isolated process
+
+    Args:
+        block (np.ndarray): block of the data cube
+        source (str): code of the UDF
+        context (Any): context of the UDF
+        timeout (float, optional): seconds. Defaults to UDF_TIMEOUT.
+
+    Raises:
+        TimeoutError: if the UDF does not finish within timeout
+        RuntimeError: if the UDF process dies, e.g., because it ran out of memory
+        ValueError: if the UDF changes the shape of the block
+
+    Returns:
+        np.ndarray: result of the UDF
+    """
+    result = _apply(block=block, source=source, context=context, timeout=timeout)
+    _check_shape(result=result, block=block)
+    return result
+
+
+def _infer_dtype(
+    data: xr.DataArray, source: str, context: Any, timeout: float
+) -> np.dtype:
+    """run the UDF on a single element to get the dtype of its result"""
+    sample = np.zeros((1,) * data.ndim, dtype=data.dtype)
+    try:
+        result = _apply(block=sample, source=source, context=context, timeout=timeout)
+    except (ValueError, ArithmeticError, TypeError, IndexError) as e:
+        logger.debug(f"udf_runtime - cannot infer dtype of the UDF: {e}")
+        return data.dtype
+    # fail before any task is submitted if the UDF changes the shape
+    _check_shape(result=result, block=sample)
+    return result.dtype
+
+
+def run_udf(
+    data: xr.DataArray, source: str, context: Any, timeout: float = UDF_TIMEOUT
+) -> xr.DataArray:
+    """run a UDF that maps an array to an array of the same shape. The UDF is compiled once and
+    executed by a pool of processes with limited memory. If data is a dask array, it is applied
+    to each chunk by a separate task, which runs on the cluster if a distributed client is active.
+    Since the UDF only sees a chunk, it cannot reduce or add dimensions
+
+    Args:
+        data (xr.DataArray): data cube
+        source (str): python code that defines a function f(data, context)
+        context (Any): context of the UDF
+        timeout (float, optional): seconds per chunk. Defaults to UDF_TIMEOUT.
+
+    Returns:
+        xr.DataArray: data cube with the same coordinates as data
+    """
+    # fail fast on invalid code, before any task is submitted
+    name, _ = compile_udf(source=source)
+    logger.debug(f"udf_runtime - running function {name} on {data.chunks=}")
+    if not isinstance(data.data, da.Array):
+        result = run_block(
+            block=np.asarray(data.data), source=source, context=context, timeout=timeout
+        )
+        return data.copy(data=result)
+    dtype = _infer_dtype(data=data, source=source, context=context, timeout=timeout)
+    result = da.map_blocks(
+        run_block,
+        data.data,
+        source=source,
+        context=context,
+        timeout=timeout,
+        dtype=dtype,
+    )
+    return data.copy(data=result)
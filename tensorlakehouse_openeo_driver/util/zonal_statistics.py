@@ -0,0 +1,570 @@
+import inspect
+import warnings
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+import dask.array as da
+import geopandas as gpd
+import numpy as np
+import shapely
+import xarray as xr
+import xvec  # noqa: F401
+from rasterio import features
+from shapely import STRtree
+
+from tensorlakehouse_openeo_driver.constants import logger
+
+COUNT = "count"
+MEAN = "mean"
+MIN = "min"
+MAX = "max"
+MEDIAN = "median"
+SUM = "sum"
+STD = "std"
+STATISTICS = [COUNT, MEAN, MIN, MAX, MEDIAN, SUM, STD]
+# statistics that are computed from partial results of each spatial block
+DECOMPOSABLE_STATISTICS = [COUNT, MEAN, MIN, MAX, SUM, STD]
+# sum of squared deviations from the mean, which is the partial result of std
+_M2 = "__m2__"
+# partial results of a spatial block, from which all decomposable statistics are derived
+_PARTIALS = [COUNT, SUM, _M2, MIN, MAX]
+
+GEOMETRY_DIM = "geometry"
+STATISTIC_DIM = "__zonal_statistic__"
+
+# callable reducers are applied once per layer to an array of shape (geometries, pixels) padded
+# with nan, unless padding would multiply the number of pixels by more than this factor
+MAX_PADDING_FACTOR = 4
+
+Statistic = Union[str, Callable]
+
+
+def assign_layers(geometries: Sequence) -> np.ndarray:
+    """assign each geometry to a layer, so that geometries of the same layer do not intersect
+    each other and can be burned into the same label raster. Most sets of field parcels fit in a
+    single layer
+
+    Args:
+        geometries (Sequence): shapely geometries
+
+    Returns:
+        np.ndarray: layer index of each geometry
+    """
+    tree = STRtree(geometries)
+    source, target = tree.query(geometries, predicate="intersects")
+    is_pair = source != target
+    neighbours: Dict[int, List[int]] = dict()
+    for i, j in zip(source[is_pair], target[is_pair]):
+        neighbours.setdefault(int(i), list()).append(int(j))
+    layers = np.full(len(geometries), -1, dtype=np.int64)
+    # greedy coloring: smallest layer that is not used by any intersecting geometry
+    for i in range(len(geometries)):
+        used = {layers[j] for j in neighbours.get(i, [])}
+        layer = 0
+        while layer in used:
+            layer += 1
+        layers[i] = layer
+    return layers
+
+
+def _block_bounds(coords: np.ndarray, chunks: Sequence[int]) -> np.ndarray:
+    """min/max of the coordinates of each block along one dimension, padded by half a pixel so
+    that the bounds cover the pixel footprints
+
+    Args:
+        coords (np.ndarray): pixel center coordinates
+        chunks (Sequence[int]): size of each block
+
+    Returns:
+        np.ndarray: (blocks, 2) array
+    """
+    half_pixel = abs(float(coords[1] - coords[0])) / 2 if len(coords) > 1 else 0.0
+    offsets = np.cumsum((0,) + tuple(chunks))
+    bounds = np.array(
+        [
+            [coords[start:stop].min(), coords[start:stop].max()]
+            for start, stop in zip(offsets[:-1], offsets[1:])
+        ],
+        dtype=np.float64,
+    )
+    bounds[:, 0] -= half_pixel
+    bounds[:, 1] += half_pixel
+    return bounds
+
+
+def select_blocks(
+    data: xr.DataArray,
+    geometries: Sequence,
+    x_dim: str,
+    y_dim: str,
+) -> np.ndarray:
+    """find the blocks (i.e., dask chunks) of the data that intersect at least one geometry.
+    The footprints of all blocks are queried against an STRtree of the geometries at once
+
+    Args:
+        data (xr.DataArray): raster cube
+        geometries (Sequence): shapely geometries in the CRS of the data
+        x_dim (str): name of the x dimension
+        y_dim (str): name of the y dimension
+
+    Returns:
+        np.ndarray: (blocks, 2) array of the y and x block indices of the selected blocks
+    """
+    y_chunks, x_chunks = _get_spatial_chunks(data=data, x_dim=x_dim, y_dim=y_dim)
+    y_bounds = _block_bounds(coords=data[y_dim].values, chunks=y_chunks)
+    x_bounds = _block_bounds(coords=data[x_dim].values, chunks=x_chunks)
+    block_y, block_x = np.meshgrid(
+        np.arange(len(y_chunks)), np.arange(len(x_chunks)), indexing="ij"
+    )
+    footprints = shapely.box(
+        x_bounds[block_x.ravel(), 0],
+        y_bounds[block_y.ravel(), 0],
+        x_bounds[block_x.ravel(), 1],
+        y_bounds[block_y.ravel(), 1],
+    )
+    tree = STRtree(geometries)
+    hits, _ = tree.query(footprints, predicate="intersects")
+    hits = np.unique(hits)
+    if len(hits) == 0:
+        # no geometry intersects the data, keep the first block to return empty statistics
+        hits = np.array([0])
+    return np.stack([block_y.ravel()[hits], block_x.ravel()[hits]], axis=-1)
+
+
+def _get_spatial_chunks(
+    data: xr.DataArray, x_dim: str, y_dim: str
+) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """chunk sizes along the y and x dimensions, i.e., a single chunk if data is in memory"""
+    chunksizes = data.chunksizes if data.chunks is not None else dict()
+    y_chunks = tuple(chunksizes.get(y_dim, (data.sizes[y_dim],)))
+    x_chunks = tuple(chunksizes.get(x_dim, (data.sizes[x_dim],)))
+    return y_chunks, x_chunks
+
+
+def _labelled_blocks(
+    labels: np.ndarray, y_chunks: Sequence[int], x_chunks: Sequence[int]
+) -> np.ndarray:
+    """find the blocks that have at least one pixel of a geometry
+
+    Args:
+        labels (np.ndarray): (layer, y, x) label rasters
+        y_chunks (Sequence[int]): size of each block along y
+        x_chunks (Sequence[int]): size of each block along x
+
+    Returns:
+        np.ndarray: (y blocks, x blocks) boolean array
+    """
+    inside = (labels > 0).any(axis=0).astype(np.int64)
+    y_starts = np.cumsum((0,) + tuple(y_chunks))[:-1]
+    x_starts = np.cumsum((0,) + tuple(x_chunks))[:-1]
+    per_block = np.add.reduceat(
+        np.add.reduceat(inside, y_starts, axis=0), x_starts, axis=1
+    )
+    return np.asarray(per_block > 0)
+
+
+def _fill_unlabelled_blocks(array: da.Array, labelled: np.ndarray) -> da.Array:
+    """replace the blocks without any pixel of a geometry by zeros, so that their chunks are
+    not read. Their values would be ignored anyway
+
+    Args:
+        array (da.Array): (..., y, x) array
+        labelled (np.ndarray): (y blocks, x blocks) boolean array
+
+    Returns:
+        da.Array: array with the same shape and chunks
+    """
+    rows = list()
+    for by in range(labelled.shape[0]):
+        row = list()
+        for bx in range(labelled.shape[1]):
+            block = array.blocks[..., by, bx]
+            if not labelled[by, bx]:
+                block = da.zeros(block.shape, chunks=block.chunks, dtype=block.dtype)
+            row.append(block)
+        rows.append(row)
+    result: da.Array = da.block(rows)
+    return result
+
+
+def rasterize_geometries(
+    geometries: Sequence,
+    data: xr.DataArray,
+    x_dim: str,
+    y_dim: str,
+) -> np.ndarray:
+    """burn geometries into label rasters on the grid of the data. A pixel belongs to a geometry
+    if its center is within the geometry, which is the rule of rio.clip
+
+    Args:
+        geometries (Sequence): shapely geometries in the CRS of the data
+        data (xr.DataArray): raster cube
+        x_dim (str): name of the x dimension
+        y_dim (str): name of the y dimension
+
+    Returns:
+        np.ndarray: (layer, y, x) array, where 0 is background and i + 1 is the i-th geometry
+    """
+    layers = assign_layers(geometries=geometries)
+    transform = data.rio.set_spatial_dims(x_dim=x_dim, y_dim=y_dim).rio.transform()
+    out_shape = (data.sizes[y_dim], data.sizes[x_dim])
+    labels = np.zeros((int(layers.max()) + 1,) + out_shape, dtype=np.int32)
+    for layer in range(labels.shape[0]):
+        shapes = [
+            (geometries[i], i + 1)
+            for i in np.flatnonzero(layers == layer).tolist()
+            if not geometries[i].is_empty
+        ]
+        if len(shapes) > 0:
+            features.rasterize(
+                shapes,
+                out=labels[layer],
+                transform=transform,
+                fill=0,
+                all_touched=False,
+            )
+    return labels
+
+
+def _apply_reducer(reducer: Callable, values: np.ndarray) -> np.ndarray:
+    """apply an openEO reducer (e.g., a process graph callback) or a numpy function along the
+    last axis"""
+    parameters = inspect.signature(reducer).parameters
+    accepts_data = "data" in parameters or any(
+        p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values()
+    )
+    if accepts_data:
+        result = reducer(data=values, axis=-1)
+    else:
+        result = reducer(values, axis=-1)
+    return np.asarray(result, dtype=np.float64)
+
+
+def _reduce_segments(
+    values: np.ndarray,
+    starts: np.ndarray,
+    sizes: np.ndarray,
+    statistic: Statistic,
+) -> np.ndarray:
+    """reduce contiguous segments of pixels, one segment per geometry
+
+    Args:
+        values (np.ndarray): (n, pixels) array sorted by geometry
+        starts (np.ndarray): first pixel of each segment
+        sizes (np.ndarray): number of pixels of each segment
+        statistic (Statistic): statistic name or reducer
+
+    Returns:
+        np.ndarray: (n, segments) array
+    """
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid.astype(np.int64), starts, axis=-1).astype(np.float64)
+    empty = count == 0
+    if statistic == COUNT:
+        return count
+    if statistic in [SUM, MEAN, STD, _M2]:
+        total = np.add.reduceat(np.where(valid, values, 0), starts, axis=-1)
+        if statistic == SUM:
+            return total
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+        if statistic == MEAN:
+            return np.where(empty, np.nan, mean)
+        deviation = np.where(valid, values - np.repeat(mean, sizes, axis=-1), 0)
+        m2 = np.add.reduceat(deviation**2, starts, axis=-1)
+        if statistic == _M2:
+            return m2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(empty, np.nan, np.sqrt(m2 / count))
+    if statistic == MIN:
+        result = np.minimum.reduceat(np.where(valid, values, np.inf), starts, axis=-1)
+        return np.where(empty, np.nan, result)
+    if statistic == MAX:
+        result = np.maximum.reduceat(np.where(valid, values, -np.inf), starts, axis=-1)
+        return np.where(empty, np.nan, result)
+    # median and callables need all pixels of a geometry, so segments are padded with nan
+    max_size = int(sizes.max())
+    if max_size * len(sizes) <= MAX_PADDING_FACTOR * values.shape[-1]:
+        column = np.arange(values.shape[-1]) - np.repeat(starts, sizes)
+        row = np.repeat(np.arange(len(sizes)), sizes)
+        padded = np.full(values.shape[:-1] + (len(sizes), max_size), np.nan)
+        padded[..., row, column] = values
+        segments = [padded]
+    else:
+        # a few large geometries, which are reduced one by one
+        segments = [
+            values[..., np.newaxis, start : start + size]
+            for start, size in zip(starts, sizes)
+        ]
+    results = list()
+    # geometries whose pixels are all nodata make nan-aware reducers warn
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for segment in segments:
+            if statistic == MEDIAN:
+                results.append(np.nanmedian(segment, axis=-1))
+            else:
+                assert callable(statistic), f"Error! Invalid statistic: {statistic}"
+                results.append(_apply_reducer(reducer=statistic, values=segment))
+    return np.concatenate(results, axis=-1)
+
+
+def _reduce_zones(
+    values: np.ndarray,
+    labels: np.ndarray,
+    n_geometries: int,
+    statistics: List[Statistic],
+) -> np.ndarray:
+    """compute the statistics of each geometry for every leading index (e.g., band and time)
+
+    Args:
+        values (np.ndarray): (..., y, x) array
+        labels (np.ndarray): (layer, y, x) label rasters
+        n_geometries (int): number of geometries
+        statistics (List[Statistic]): statistic names or reducers
+
+    Returns:
+        np.ndarray: (..., geometry, statistic) array
+    """
+    lead_shape = values.shape[:-2]
+    flat = values.reshape((-1, values.shape[-2] * values.shape[-1])).astype(
+        np.float64, copy=False
+    )
+    result = np.full((flat.shape[0], n_geometries, len(statistics)), np.nan)
+    for layer_labels in labels.reshape((labels.shape[0], -1)):
+        inside = np.flatnonzero(layer_labels)
+        if len(inside) == 0:
+            continue
+        # sort pixels by geometry, so that each geometry is a contiguous segment
+        order = inside[np.argsort(layer_labels[inside], kind="stable")]
+        geometry_ids, starts, sizes = np.unique(
+            layer_labels[order], return_index=True, return_counts=True
+        )
+        selected = flat[:, order]
+        for s, statistic in enumerate(statistics):
+            result[:, geometry_ids - 1, s] = _reduce_segments(
+                values=selected, starts=starts, sizes=sizes, statistic=statistic
+            )
+    return result.reshape(lead_shape + (n_geometries, len(statistics)))
+
+
+def _combine_partials(partials: np.ndarray, statistics: List[str]) -> np.ndarray:
+    """combine the partial results of the spatial blocks into the statistics. The sums of
+    squared deviations are combined by the parallel algorithm of Chan et al., so that std does
+    not lose precision
+
+    Args:
+        partials (np.ndarray): (..., block, geometry, partial) array, which is nan where a
+            geometry has no pixel in a block
+        statistics (List[str]): decomposable statistic names
+
+    Returns:
+        np.ndarray: (..., geometry, statistic) array
+    """
+    block_count, block_sum, block_m2, block_min, block_max = (
+        partials[..., i] for i in range(len(_PARTIALS))
+    )
+    present = ~np.isnan(block_count).all(axis=-2)
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        # e.g., nanmin of geometries that have no valid pixel in any block
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        count = np.nansum(block_count, axis=-2)
+        total = np.nansum(block_sum, axis=-2)
+        mean = total / count
+        shift = np.where(
+            block_count > 0,
+            block_count * (block_sum / block_count - mean[..., np.newaxis, :]) ** 2,
+            0,
+        )
+        m2 = np.nansum(block_m2 + shift, axis=-2)
+        results = {
+            COUNT: count,
+            SUM: total,
+            MEAN: mean,
+            STD: np.sqrt(m2 / count),
+            MIN: np.nanmin(block_min, axis=-2),
+            MAX: np.nanmax(block_max, axis=-2),
+        }
+    result = np.stack([results[statistic] for statistic in statistics], axis=-1)
+    return np.where(present[..., np.newaxis], result, np.nan)
+
+
+def _reduce_blocks(
+    array: da.Array,
+    labels: np.ndarray,
+    n_geometries: int,
+    statistics: List[str],
+) -> da.Array:
+    """compute decomposable statistics by reducing each spatial block of the data to partial
+    results, which are then combined. Blocks keep their size, so memory does not grow with the
+    extent of the geometries, and blocks without any labelled pixel are not read at all
+
+    Args:
+        array (da.Array): (..., y, x) array
+        labels (np.ndarray): (layer, y, x) label rasters
+        n_geometries (int): number of geometries
+        statistics (List[str]): decomposable statistic names
+
+    Returns:
+        da.Array: (..., geometry, statistic) array
+    """
+    lead_chunks = array.chunks[:-2]
+    y_offsets = np.cumsum((0,) + array.chunks[-2])
+    x_offsets = np.cumsum((0,) + array.chunks[-1])
+    labelled = _labelled_blocks(
+        labels=labels, y_chunks=array.chunks[-2], x_chunks=array.chunks[-1]
+    )
+    partials = list()
+    for by, bx in np.argwhere(labelled).tolist():
+        block = array.blocks[..., by, bx]
+        partials.append(
+            block.map_blocks(
+                _reduce_zones,
+                labels=labels[
+                    :,
+                    y_offsets[by] : y_offsets[by + 1],
+                    x_offsets[bx] : x_offsets[bx + 1],
+                ],
+                n_geometries=n_geometries,
+                statistics=_PARTIALS,
+                chunks=lead_chunks + ((n_geometries,), (len(_PARTIALS),)),
+                dtype=np.float64,
+            )
+        )
+    output_chunks = lead_chunks + ((n_geometries,), (len(statistics),))
+    result: da.Array
+    if len(partials) == 0:
+        result = da.full(
+            tuple(sum(c) for c in output_chunks),
+            np.nan,
+            chunks=output_chunks,
+            dtype=np.float64,
+        )
+        return result
+    block_axis = len(lead_chunks)
+    stacked = da.stack(partials, axis=block_axis).rechunk({block_axis: -1})
+    result = stacked.map_blocks(
+        _combine_partials,
+        statistics=statistics,
+        drop_axis=block_axis,
+        chunks=output_chunks,
+        dtype=np.float64,
+    )
+    return result
+
+
+def zonal_statistics(
+    data: xr.DataArray,
+    geometries: gpd.GeoSeries,
+    statistics: Dict[str, Statistic],
+    x_dim: str,
+    y_dim: str,
+) -> xr.Dataset:
+    """compute per-geometry statistics of a raster cube. Geometries are rasterized once into
+    label rasters on the data grid and all statistics of all geometries are computed by a single
+    blockwise pass over the cube, so that the cost barely depends on the number of geometries.
+    Decomposable statistics (count, mean, min, max, sum, std) are reduced per block and
+    combined (see _reduce_blocks). Otherwise each block spans the whole x/y extent, so that
+    statistics that are not decomposable (e.g., median) are exact. The data is cropped to the
+    window of the chunks that intersect a geometry (see select_blocks) and chunks without any
+    pixel of a geometry are never read
+
+    Args:
+        data (xr.DataArray): raster cube
+        geometries (gpd.GeoSeries): geometries in the CRS of the data
+        statistics (Dict[str, Statistic]): output variable name and either a statistic name
+            (count, mean, min, max, median, sum, std) or a reducer, which is applied to the pixels
+            of each geometry along the last axis
+        x_dim (str): name of the x dimension
+        y_dim (str): name of the y dimension
+
+    Returns:
+        xr.Dataset: one variable per statistic with the non-spatial dimensions of the data and
+            a geometry dimension
+    """
+    for name, statistic in statistics.items():
+        assert statistic in STATISTICS or callable(
+            statistic
+        ), f"Error! Invalid statistic {name}: {statistic}"
+    geometry_values = list(geometries.values)
+    blocks = select_blocks(
+        data=data, geometries=geometry_values, x_dim=x_dim, y_dim=y_dim
+    )
+    y_chunks, x_chunks = _get_spatial_chunks(data=data, x_dim=x_dim, y_dim=y_dim)
+    y_offsets = np.cumsum((0,) + y_chunks)
+    x_offsets = np.cumsum((0,) + x_chunks)
+    # crop to the window of the selected blocks, which keeps the grid regular for rasterization
+    data = data.isel(
+        {
+            y_dim: slice(
+                y_offsets[blocks[:, 0].min()], y_offsets[blocks[:, 0].max() + 1]
+            ),
+            x_dim: slice(
+                x_offsets[blocks[:, 1].min()], x_offsets[blocks[:, 1].max() + 1]
+            ),
+        }
+    )
+    labels = rasterize_geometries(
+        geometries=geometry_values, data=data, x_dim=x_dim, y_dim=y_dim
+    )
+    logger.debug(
+        f"zonal_statistics - {len(geometry_values)} geometries {labels.shape[0]} layers {list(statistics)} pixels {labels.shape[1:]}"
+    )
+    data = data.transpose(..., y_dim, x_dim)
+    n_geometries = len(geometry_values)
+    statistic_values = list(statistics.values())
+    decomposable = [
+        s
+        for s in statistic_values
+        if isinstance(s, str) and s in DECOMPOSABLE_STATISTICS
+    ]
+    array = data.data
+    reduced_values: Union[da.Array, np.ndarray]
+    if isinstance(array, da.Array) and len(decomposable) == len(statistic_values):
+        reduced_values = _reduce_blocks(
+            array=array,
+            labels=labels,
+            n_geometries=n_geometries,
+            statistics=decomposable,
+        )
+    elif isinstance(array, da.Array):
+        # median and reducers need all pixels of a geometry, so each block spans the whole
+        # x/y extent
+        labelled = _labelled_blocks(
+            labels=labels, y_chunks=array.chunks[-2], x_chunks=array.chunks[-1]
+        )
+        array = _fill_unlabelled_blocks(array=array, labelled=labelled)
+        array = array.rechunk({array.ndim - 2: -1, array.ndim - 1: -1})
+        reduced_values = array.map_blocks(
+            _reduce_zones,
+            labels=labels,
+            n_geometries=n_geometries,
+            statistics=statistic_values,
+            chunks=array.chunks[:-2] + ((n_geometries,), (len(statistics),)),
+            dtype=np.float64,
+        )
+    else:
+        reduced_values = _reduce_zones(
+            values=np.asarray(array),
+            labels=labels,
+            n_geometries=n_geometries,
+            statistics=statistic_values,
+        )
+    coords = {
+        name: coord
+        for name, coord in data.coords.items()
+        if y_dim not in coord.dims and x_dim not in coord.dims
+    }
+    reduced = xr.DataArray(
+        reduced_values,
+        dims=list(data.dims[:-2]) + [GEOMETRY_DIM, STATISTIC_DIM],
+        coords=coords,
+    )
+    geometry_index = np.empty(len(geometry_values), dtype=object)
+    geometry_index[:] = geometry_values
+    reduced = reduced.assign_coords(
+        {GEOMETRY_DIM: geometry_index, STATISTIC_DIM: list(statistics)}
+    )
+    dataset = reduced.to_dataset(dim=STATISTIC_DIM)
+    if geometries.crs is not None:
+        dataset = dataset.xvec.set_geom_indexes(GEOMETRY_DIM, crs=geometries.crs)
+    return dataset